@@ -0,0 +1,390 @@
+"""Резервная копия состояния бота: потоковый экспорт и возобновляемый импорт.
+
+Формат - JSON Lines в gzip. Первая строка - заголовок (формат, версия,
+id копии, счетчики), дальше записи по типам:
+    user         пользователь с ролью и каналами
+    channel      настройки канала и политика очереди
+    queue        до CHUNK медиа очереди канала: [полоса, медиа] в порядке выдачи
+    used_files, used_hashes  уже использованные пути и SHA-256 канала, пачками
+    history      пачка записей истории постов
+    end          число записей - без нее копия считается оборванной
+Сессии пользователей (незавершенные диалоги) не сохраняются, медиафайлы из
+папок каналов переносятся отдельно (rsync, tar).
+
+Экспорт снимает согласованный снимок ссылок на данные (без копирования
+самих медиа-записей) и пишет его построчно, не собирая файл в памяти.
+Импорт применяет записи по одной и раз в CHECKPOINT секунд сохраняет
+файл данных и прогресс в <копия>.progress; прерванный импорт того же
+файла продолжается с последней отметки.
+
+Из командной строки (при остановленном боте - иначе он перезапишет файл данных):
+    python backup.py export -o backup.jsonl.gz
+    python backup.py import backup.jsonl.gz --replace
+Во время работы бота владелец использует команды /export и /import.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+import mediaqueue
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "bot-backup"
+VERSION = 1
+CHUNK = 500  # элементов в одной записи queue/used_files/used_hashes/history
+CHECKPOINT = 5.0  # секунд между сохранениями при импорте: каждое - полная запись файла данных
+# Ключи канала, которые пишутся отдельными записями
+_CHANNEL_BULK = ("media_queue", "used_files", "used_hashes")
+
+_import_lock = threading.Lock()
+
+
+class BackupError(ValueError):
+    pass
+
+
+def _chunks(items, size=CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _plain(value):
+    """Множества - в отсортированные списки, чтобы снимок сериализовался в JSON"""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def snapshot(bot_data, history=None):
+    """Согласованный снимок: копируются ссылки на записи, не сами записи.
+
+    Ссылки копируются под блокировкой изменений bot_data (changing), поэтому
+    изменение из нескольких шагов не попадет в снимок наполовину.
+    """
+    if _import_lock.locked():
+        raise BackupError("идет импорт - экспорт после его завершения")
+    bot_data.ensure_loaded()  # загрузка берет ту же блокировку
+    with bot_data.changing():
+        users = [(user_id, _plain(data)) for user_id, data in list(bot_data.users.items())]
+        channels = []
+        for channel_id, channel in list(bot_data.channels.items()):
+            queue = channel["media_queue"]
+            channels.append({
+                "id": channel_id,
+                "data": {key: _plain(value) for key, value in list(channel.items()) if key not in _CHANNEL_BULK},
+                "policy": queue.policy,
+                "queue": list(queue.entries()),
+                "used_files": list(channel["used_files"]),
+                "used_hashes": list(channel.get("used_hashes", ())),
+            })
+    entries = history.entries() if history is not None else []
+    return {"users": users, "channels": channels, "history": entries}
+
+
+def _records(snap):
+    for user_id, data in snap["users"]:
+        yield {"type": "user", "id": user_id, "data": data}
+    for channel in snap["channels"]:
+        channel_id = channel["id"]
+        yield {"type": "channel", "id": channel_id, "data": channel["data"], "policy": channel["policy"]}
+        for chunk in _chunks(channel["queue"]):
+            yield {"type": "queue", "channel": channel_id, "items": [[lane, item] for lane, item in chunk]}
+        for kind in ("used_files", "used_hashes"):
+            for chunk in _chunks(channel[kind]):
+                yield {"type": kind, "channel": channel_id, "values": chunk}
+    for chunk in _chunks(snap["history"]):
+        yield {"type": "history", "entries": chunk}
+
+
+def export_state(bot_data, path, history=None):
+    """Пишет копию в path (атомарно, через временный файл); возвращает отчет"""
+    started = time.perf_counter()
+    snap = snapshot(bot_data, history)
+    counts = {
+        "users": len(snap["users"]),
+        "channels": len(snap["channels"]),
+        "queue": sum(len(channel["queue"]) for channel in snap["channels"]),
+        "history": len(snap["history"]),
+    }
+    header = {
+        "format": FORMAT, "version": VERSION, "id": uuid.uuid4().hex,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "admin_id": bot_data.admin_id, "counts": counts,
+    }
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    records = 0
+    try:
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for record in _records(snap):
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                records += 1
+            f.write(json.dumps({"type": "end", "records": records}) + "\n")
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {
+        **counts, "path": path, "records": records, "bytes": os.path.getsize(path),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def read_backup(path):
+    """(заголовок, генератор записей); оборванный gzip заканчивает генератор с BackupError"""
+    try:
+        f = gzip.open(path, "rt", encoding="utf-8")
+    except OSError as e:
+        raise BackupError(f"{path}: {e.strerror or e}")
+    try:
+        header = json.loads(f.readline() or "{}")
+    except (OSError, ValueError, EOFError, zlib.error) as e:
+        f.close()
+        raise BackupError(f"{path}: не читается как резервная копия ({e})")
+    if header.get("format") != FORMAT:
+        f.close()
+        raise BackupError(f"{path}: не резервная копия бота")
+    if header.get("version", 0) > VERSION:
+        f.close()
+        raise BackupError(f"{path}: версия формата {header['version']} новее поддерживаемой {VERSION}")
+
+    def records():
+        with f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        raise BackupError("оборванная запись - файл скопирован не полностью")
+            except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+                raise BackupError(f"файл оборван ({e})")
+
+    return header, records()
+
+
+def _read_progress(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_progress(path, backup_id, records):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"id": backup_id, "records": records}, f)
+    os.replace(temp_path, path)
+
+
+class _Importer:
+    def __init__(self, bot_data, history):
+        self.bot_data = bot_data
+        self.history = history
+        self.report = {"users": 0, "channels": 0, "queue": 0, "history": 0, "skipped": 0}
+
+    def apply(self, record):
+        kind = record.get("type")
+        bot_data = self.bot_data
+        if kind == "user":
+            data = record["data"]
+            data.setdefault("channels", [])
+            if data.get("role") == "owner" and record["id"] != bot_data.admin_id:
+                # Владелец здесь - admin_id из конфига; прежний владелец становится админом
+                data["role"] = "admin"
+            bot_data.users[record["id"]] = data
+            self.report["users"] += 1
+        elif kind == "channel":
+            # Канал заменяется целиком: повтор записи после возобновления дает тот же результат
+            channel = dict(record["data"])
+            channel["post_times"] = list(channel.get("post_times", []))
+            channel["media_queue"] = mediaqueue.MediaQueue(policy=record.get("policy", "fifo"))
+            channel["used_files"] = set()
+            channel["used_hashes"] = set()
+            channel.setdefault("timezone", None)
+            channel.setdefault("post_count", 0)
+            bot_data.channels[record["id"]] = channel
+            bot_data._captions.pop(record["id"], None)
+            self.report["channels"] += 1
+        elif kind == "queue":
+            added = bot_data.channels[record["channel"]]["media_queue"].restore(
+                (lane, item) for lane, item in record["items"]
+            )
+            self.report["queue"] += added
+        elif kind in ("used_files", "used_hashes"):
+            bot_data.channels[record["channel"]][kind].update(record["values"])
+        elif kind == "history":
+            if self.history is None:
+                self.report["skipped"] += len(record["entries"])
+            else:
+                for entry in record["entries"]:
+                    self.history.record(entry)
+                self.report["history"] += len(record["entries"])
+        else:
+            # Записи новых типов той же версии формата пропускаются
+            self.report["skipped"] += 1
+
+    def finish(self):
+        """Владелец и админы видят все каналы, как после add_channel"""
+        bot_data = self.bot_data
+        owner = bot_data.users.setdefault(bot_data.admin_id, {"role": "owner", "channels": []})
+        owner["role"] = "owner"
+        for user_data in bot_data.users.values():
+            if user_data.get("role") in ("owner", "admin"):
+                known = set(user_data["channels"])
+                user_data["channels"].extend(cid for cid in bot_data.channels if cid not in known)
+
+
+def import_state(bot_data, path, history=None, replace=False, progress_path=None, checkpoint=CHECKPOINT):
+    """Применяет копию к bot_data; возвращает отчет.
+
+    replace - удалить пользователей и каналы, которых нет в копии (при
+    первом запуске; возобновление продолжает с отметки и ничего не удаляет).
+    Бросает BackupError, если файл не копия или оборван - прогресс при
+    этом сохраняется, и повторный запуск продолжит с последней отметки.
+    """
+    if not _import_lock.acquire(blocking=False):
+        raise BackupError("другой импорт еще идет - дождитесь его завершения")
+    try:
+        return _import_state(bot_data, path, history, replace, progress_path, checkpoint)
+    finally:
+        _import_lock.release()
+
+
+def _import_state(bot_data, path, history, replace, progress_path, checkpoint):
+    started = time.perf_counter()
+    progress_path = progress_path or f"{path}.progress"
+    header, records = read_backup(path)
+    progress = _read_progress(progress_path)
+    done = progress["records"] if progress and progress.get("id") == header.get("id") else 0
+
+    importer = _Importer(bot_data, history)
+    bot_data.ensure_loaded()
+    if not done and replace:
+        with bot_data.changing():
+            bot_data.users.clear()
+            bot_data.channels.clear()
+            bot_data._captions.clear()
+
+    index = saved = done
+    unsaved = False  # есть примененные записи, которых еще нет в файле данных
+    last_save = time.monotonic()
+    complete = False
+    try:
+        for position, record in enumerate(records, 1):
+            if position <= done:
+                continue
+            if record.get("type") == "end":
+                if record.get("records") != position - 1:
+                    raise BackupError(f"в копии {position - 1} записей, ожидалось {record.get('records')}")
+                complete = True
+                break
+            history_record = record.get("type") == "history"
+            if history_record and unsaved:
+                bot_data.save_data()
+                unsaved = False
+            with bot_data.changing():
+                importer.apply(record)
+            index = position
+            if history_record:
+                # История пишется в свой файл сразу - отметка после каждой пачки исключает дубли при повторе
+                _write_progress(progress_path, header["id"], index)
+                saved = index
+                continue
+            unsaved = True
+            if time.monotonic() - last_save >= checkpoint:
+                bot_data.save_data()
+                _write_progress(progress_path, header["id"], index)
+                saved, unsaved, last_save = index, False, time.monotonic()
+        if not complete:
+            raise BackupError("нет записи end - файл скопирован не полностью")
+    finally:
+        if index != saved:
+            if unsaved:
+                bot_data.save_data()
+            _write_progress(progress_path, header["id"], index)
+
+    with bot_data.changing():
+        importer.finish()
+    bot_data.save_data()
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return {
+        **importer.report, "path": path, "records": index, "resumed_from": done,
+        "created": header.get("created"), "seconds": time.perf_counter() - started,
+    }
+
+
+def format_export(report):
+    return (
+        f"💾 Резервная копия готова за {report['seconds']:.1f}s\n"
+        f"Пользователей: {report['users']}, каналов: {report['channels']}\n"
+        f"Медиа в очередях: {report['queue']}, записей истории: {report['history']}\n"
+        f"Размер: {report['bytes'] / 1048576:.1f} МБ"
+    )
+
+
+def format_import(report):
+    lines = [
+        f"✅ Копия от {report['created']} загружена за {report['seconds']:.1f}s",
+        f"Пользователей: {report['users']}, каналов: {report['channels']}",
+        f"Медиа в очередях: {report['queue']}, записей истории: {report['history']}",
+    ]
+    if report["resumed_from"]:
+        lines.append(f"Продолжено с записи {report['resumed_from']}")
+    if report["skipped"]:
+        lines.append(f"Пропущено: {report['skipped']}")
+    return "\n".join(lines)
+
+
+def default_path(folder):
+    return os.path.join(folder, f"backup-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yml")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Записать резервную копию")
+    export_parser.add_argument("-o", "--output", help="Файл копии (по умолчанию в backup.dir)")
+    import_parser = commands.add_parser("import", help="Загрузить резервную копию")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--replace", action="store_true", help="Удалить пользователей и каналы, которых нет в копии")
+    args = parser.parse_args()
+
+    import bot
+    import history
+
+    config = bot.load_config(args.config)
+    bot_data = bot.BotData(config["storage"]["data_file"], config["telegram"]["admin_id"])
+    post_history = history.create_history(config)
+    try:
+        if args.command == "export":
+            path = args.output
+            if not path:
+                folder = (config.get("backup") or {}).get("dir", "backups")
+                os.makedirs(folder, exist_ok=True)
+                path = default_path(folder)
+            print(format_export(export_state(bot_data, path, post_history)))
+            print(path)
+        else:
+            print(format_import(import_state(bot_data, args.path, post_history, replace=args.replace)))
+    except BackupError as e:
+        raise SystemExit(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков без настоящего токена"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class _ApiError(Exception):
+    def __init__(self, code, description):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+class FakeTelegramAPI:
+    """Поддерживает getUpdates, getFile, скачивание файлов и send*-методы.
+
+    latency - задержка ответа (секунды), throttle_rate - доля ответов 429,
+    file_size - размер отдаваемых файлов (байт).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, throttle_rate=0.0,
+                 file_size=200 * 1024, retry_after=1, seed=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.file_size = file_size
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._updates = deque()
+        self._update_id = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        # Сигнатура JPEG в начале, чтобы файлы проходили проверку формата при предобработке
+        self._payload = b"\xff\xd8\xff\xe0" + bytes(self.random.getrandbits(8) for _ in range(min(file_size, 4096) - 4))
+        self.sent = []
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                api._handle(self)
+
+            def do_POST(self):
+                api._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        return self.base_url + "/bot{0}/{1}"
+
+    @property
+    def file_url(self):
+        return self.base_url + "/file/bot{0}/{1}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def install(self, apihelper):
+        """Направляет запросы telebot на заглушку"""
+        apihelper.API_URL = self.api_url
+        apihelper.FILE_URL = self.file_url
+
+    def push_update(self, update):
+        """Кладет апдейт в очередь getUpdates; update_id проставляется автоматически"""
+        with self._updates_ready:
+            self._update_id += 1
+            update = dict(update, update_id=self._update_id)
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+            return self._update_id
+
+    # --- внутренняя обработка запросов ---
+
+    def _handle(self, request):
+        parts = urlsplit(request.path)
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if body and request.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()})
+
+        with self._lock:
+            self.bytes_received += len(body)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        segments = parts.path.strip("/").split("/")
+        if segments[0] == "file":
+            self._send_file(request)
+            return
+
+        method = segments[-1]
+        with self._lock:
+            self.calls[method] += 1
+
+        if method != "getUpdates" and self.throttle_rate and self.random.random() < self.throttle_rate:
+            with self._lock:
+                self.calls["429"] += 1
+            self._send_json(request, 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+            return
+
+        handler = getattr(self, f"_api_{method}", self._api_default)
+        try:
+            result = handler(params, len(body))
+        except _ApiError as e:
+            self._send_json(request, e.code, {"ok": False, "error_code": e.code, "description": e.description})
+            return
+        self._send_json(request, 200, {"ok": True, "result": result})
+
+    def _send_json(self, request, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _send_file(self, request):
+        request.send_response(200)
+        request.send_header("Content-Type", "application/octet-stream")
+        request.send_header("Content-Length", str(self.file_size))
+        request.end_headers()
+        remaining = self.file_size
+        while remaining > 0:
+            chunk = self._payload[:remaining]
+            request.wfile.write(chunk)
+            remaining -= len(chunk)
+        with self._lock:
+            self.bytes_sent += self.file_size
+
+    def _message(self, chat_id, **extra):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(chat_id) if chat_id not in (None, "") else 0
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private"},
+        }
+        message.update(extra)
+        return message
+
+    def _api_getMe(self, params, size):
+        return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    def _api_getUpdates(self, params, size):
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        deadline = time.monotonic() + timeout
+        with self._updates_ready:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_ready.wait(deadline - time.monotonic())
+            limit = int(params.get("limit", 100) or 100)
+            return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    def _api_getFile(self, params, size):
+        file_id = params.get("file_id", "file")
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": self.file_size,
+            "file_path": f"media/{file_id}",
+        }
+
+    def _api_sendMessage(self, params, size):
+        self._check_text(params.get("text", ""))
+        message = self._message(params.get("chat_id"), text=params.get("text", ""))
+        self.sent.append(("sendMessage", message["chat"]["id"], size))
+        return message
+
+    def _api_editMessageText(self, params, size):
+        self._check_text(params.get("text", ""))
+        message = self._message(params.get("chat_id"), text=params.get("text", ""))
+        message["message_id"] = int(params.get("message_id") or message["message_id"])
+        return message
+
+    @staticmethod
+    def _check_text(text):
+        # Как и настоящий Bot API, отклоняем сообщения длиннее 4096 символов
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise _ApiError(400, "Bad Request: message is too long")
+
+    def _api_sendPhoto(self, params, size):
+        photo = [{"file_id": f"p{self._message_id}", "file_unique_id": f"p{self._message_id}", "width": 1280, "height": 720}]
+        message = self._message(params.get("chat_id"), photo=photo, caption=params.get("caption"))
+        self.sent.append(("sendPhoto", message["chat"]["id"], size))
+        return message
+
+    def _api_sendVideo(self, params, size):
+        video = {"file_id": f"v{self._message_id}", "file_unique_id": f"v{self._message_id}",
+                 "width": 1280, "height": 720, "duration": 10}
+        message = self._message(params.get("chat_id"), video=video, caption=params.get("caption"))
+        self.sent.append(("sendVideo", message["chat"]["id"], size))
+        return message
+
+    def _api_sendDocument(self, params, size):
+        # Файл приходит в multipart - chat_id из него не разбираем, размер учитываем
+        document = {"file_id": f"d{self._message_id}", "file_unique_id": f"d{self._message_id}", "file_size": size}
+        message = self._message(params.get("chat_id"), document=document, caption=params.get("caption"))
+        self.sent.append(("sendDocument", message["chat"]["id"], size))
+        return message
+
+    def _api_default(self, params, size):
+        return True
@@ -0,0 +1,327 @@
+"""Воспроизведение записанных апдейтов (capture.file) против заглушки Bot API.
+
+Апдейты подаются в обработчики бота в том же порядке и с теми же паузами,
+ускоренными в --speed раз (0 - без пауз). Цепочка апдейтов одного чата,
+пока у него есть следующий шаг register_next_step_handler или сессия в
+user_sessions, считается одним сценарием и называется по первому
+обработчику: add_channel_start, edit_channel_start, select_moderator_for_channels...
+Для каждого сценария - время обработки p50/p99 (без пауз пользователя),
+для каждого обработчика - время шага. В конце состояние BotData сводится
+к сравнимому виду и проверяется по файлу ожиданий.
+
+Примеры:
+    python bench/replay.py updates.jsonl --save-expect expect.json
+    python bench/replay.py updates.jsonl --speed 50 --expect expect.json
+    python bench/replay.py updates.jsonl --speed 0 --latency 0.02 --state bot_data.pkl
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from run import percentile, start_bot  # noqa: E402
+
+
+def prepare_environment(args, owner_id):
+    from fake_api import FakeTelegramAPI
+
+    workdir = tempfile.mkdtemp(prefix="bot-replay-")
+    os.chdir(workdir)
+    config = {
+        "telegram": {"token": "123456:REPLAY", "admin_id": owner_id},
+        "posts": {"timezone_offset": 0, "random_offset_minutes": 0},
+        "storage": {"data_file": "bot_data.pkl", "flush_interval": 3},
+        "metrics": {"enabled": True},
+        "media": {"preprocess": args.preprocess},
+    }
+    if args.state:
+        shutil.copy(args.state, config["storage"]["data_file"])
+
+    api = FakeTelegramAPI(latency=args.latency, file_size=args.file_size * 1024, seed=args.seed).start()
+    return config, api, workdir
+
+
+def _handler_counts():
+    import metrics
+    return {key[0]: state[2] for key, state in metrics.HANDLER_LATENCY.snapshot().items()}
+
+
+def _sender(update):
+    """(chat_id, user_id) апдейта"""
+    if "callback_query" in update:
+        query = update["callback_query"]
+        chat = (query.get("message") or {}).get("chat") or {}
+        return chat.get("id", query["from"]["id"]), query["from"]["id"]
+    message = update.get("message") or update.get("edited_message") or {}
+    return message.get("chat", {}).get("id"), (message.get("from") or {}).get("id")
+
+
+class FlowTracker:
+    """Разбивает апдейты на сценарии и собирает время шагов"""
+
+    def __init__(self, bot, bot_data):
+        self.bot = bot
+        self.bot_data = bot_data
+        self.active = {}  # {chat_id: {"name", "seconds", "steps", "errors"}}
+        self.flows = {}  # {имя: [(секунды, шагов, ошибок)]}
+        self.handlers = {}  # {обработчик: [секунды]}
+        self.unfinished = 0
+
+    def _in_flow(self, chat_id, user_id):
+        return chat_id in self.bot.next_step_backend.handlers or user_id in self.bot_data.user_sessions
+
+    def feed(self, update):
+        from telebot import types
+        chat_id, user_id = _sender(update)
+        before = _handler_counts()
+        error = 0
+        start = time.perf_counter()
+        try:
+            self.bot.process_new_updates([types.Update.de_json(update)])
+        except Exception:
+            error = 1
+        duration = time.perf_counter() - start
+        after = _handler_counts()
+        ran = [name for name, count in after.items() if count > before.get(name, 0)]
+        for name in ran:
+            self.handlers.setdefault(name, []).append(duration / len(ran))
+
+        flow = self.active.pop(chat_id, None)
+        if flow is None:
+            flow = {"name": ran[0] if ran else "unhandled", "seconds": 0.0, "steps": 0, "errors": 0}
+        flow["seconds"] += duration
+        flow["steps"] += 1
+        flow["errors"] += error
+        if self._in_flow(chat_id, user_id):
+            self.active[chat_id] = flow
+        else:
+            self._close(flow)
+        return duration, error
+
+    def _close(self, flow):
+        self.flows.setdefault(flow["name"], []).append((flow["seconds"], flow["steps"], flow["errors"]))
+
+    def finish(self):
+        """Незавершенные к концу записи сценарии учитываются как есть"""
+        self.unfinished = len(self.active)
+        for flow in self.active.values():
+            self._close(flow)
+        self.active = {}
+
+    def report(self):
+        flows = {}
+        for name, runs in sorted(self.flows.items()):
+            seconds = [run[0] for run in runs]
+            flows[name] = {
+                "count": len(runs),
+                "steps": sum(run[1] for run in runs),
+                "errors": sum(run[2] for run in runs),
+                "p50_ms": round(percentile(seconds, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(seconds, 0.99) * 1000, 3),
+            }
+        handlers = {
+            name: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            }
+            for name, values in sorted(self.handlers.items())
+        }
+        return flows, handlers
+
+
+def state_summary(bot_data):
+    """Состояние BotData без путей и времени: то, что должен оставить после себя сценарий"""
+    users = {
+        str(user_id): {"role": data.get("role"), "channels": sorted(str(cid) for cid in data.get("channels", []))}
+        for user_id, data in bot_data.users.items()
+    }
+    channels = {}
+    for channel_id, data in bot_data.channels.items():
+        queue = data["media_queue"]
+        channels[str(channel_id)] = {
+            "name": data.get("name"),
+            "post_text": data.get("post_text"),
+            "post_times": list(data.get("post_times", [])),
+            "timezone": data.get("timezone"),
+            "queue": len(queue),
+            "lanes": queue.lane_counts(),
+            "policy": queue.policy,
+        }
+    sessions = {str(user_id): session.get("state") for user_id, session in bot_data.user_sessions.items()}
+    return {"users": users, "channels": channels, "sessions": sessions}
+
+
+def diff_state(expected, actual, path=""):
+    """Различия вида "channels.-100123.name: ожидалось 'a', получено 'b'" """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        problems = []
+        for key in sorted(set(expected) | set(actual), key=str):
+            name = f"{path}.{key}" if path else str(key)
+            if key not in actual:
+                problems.append(f"{name}: отсутствует")
+            elif key not in expected:
+                problems.append(f"{name}: лишний ключ")
+            else:
+                problems.extend(diff_state(expected[key], actual[key], name))
+        return problems
+    if expected != actual:
+        return [f"{path}: ожидалось {expected!r}, получено {actual!r}"]
+    return []
+
+
+def check_expectations(expect, result):
+    problems = []
+    if "state" in expect:
+        problems.extend("состояние " + problem for problem in diff_state(expect["state"], result["state"]))
+    for name, budget in sorted((expect.get("flows") or {}).items()):
+        flow = result["flows"].get(name)
+        if flow is None:
+            problems.append(f"сценарий {name}: не встретился")
+            continue
+        for key, limit in sorted(budget.items()):
+            if key in flow and flow[key] > limit:
+                problems.append(f"сценарий {name}: {key} {flow[key]} > {limit}")
+    if "errors" in expect and result["errors"] > expect["errors"]:
+        problems.append(f"ошибок обработки {result['errors']} > {expect['errors']}")
+    return problems
+
+
+def make_expectations(result, headroom):
+    """Ожидания по текущему прогону: состояние как есть, бюджеты времени с запасом"""
+    return {
+        "state": result["state"],
+        "flows": {
+            name: {"p99_ms": round(max(flow["p99_ms"] * headroom, 1.0), 1)}
+            for name, flow in result["flows"].items()
+        },
+        "errors": result["errors"],
+    }
+
+
+def replay(args):
+    import recorder
+    header, entries = recorder.read_recording(args.recording)
+    config, api, workdir = prepare_environment(args, header["owner"])
+    bot_module = start_bot(config, api)
+    bot = bot_module.bot
+    bot.threaded = False
+    tracker = FlowTracker(bot, bot_module.bot_data)
+
+    latencies = []
+    errors = 0
+    max_lag = 0.0
+    started = time.perf_counter()
+    for entry in entries:
+        if args.limit and len(latencies) >= args.limit:
+            break
+        if args.speed > 0:
+            due = started + entry["t"] / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        update = entry["update"]
+        # Дата - как будто апдейт пришел сейчас, иначе задержка опроса в метриках считается от записи
+        for message in (update.get("message"), (update.get("callback_query") or {}).get("message")):
+            if message:
+                message["date"] = int(time.time())
+        duration, error = tracker.feed(update)
+        latencies.append(duration)
+        errors += error
+    bot_module.media_processor.drain(timeout=60)
+    elapsed = time.perf_counter() - started
+    tracker.finish()
+    flows, handlers = tracker.report()
+    bot_module.bot_data.flush()
+    api.stop()
+
+    result = {
+        "recording": args.recording,
+        "speed": args.speed,
+        "updates": len(latencies),
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_lag_ms": round(max_lag * 1000, 3),
+        "errors": errors,
+        "unfinished_flows": tracker.unfinished,
+        "flows": flows,
+        "handlers": handlers,
+        "api_calls": dict(api.calls),
+        "state": state_summary(bot_module.bot_data),
+    }
+    if args.save_state:
+        shutil.copy(os.path.join(workdir, config["storage"]["data_file"]), args.save_state)
+    return result
+
+
+def print_report(result, problems):
+    print(f"== {result['recording']} (x{result['speed'] or 'max'}) ==")
+    for key in ("updates", "seconds", "throughput", "p50_ms", "p99_ms", "max_lag_ms", "errors", "unfinished_flows"):
+        print(f"  {key:<17} {result[key]}")
+    print("\n  сценарий                            раз  шагов   p50_ms    p99_ms  ошибок")
+    for name, flow in result["flows"].items():
+        print(f"  {name:<34} {flow['count']:>4} {flow['steps']:>6} {flow['p50_ms']:>8} {flow['p99_ms']:>9} {flow['errors']:>7}")
+    print("\n  обработчик                          раз   p50_ms    p99_ms")
+    for name, handler in result["handlers"].items():
+        print(f"  {name:<34} {handler['count']:>4} {handler['p50_ms']:>8} {handler['p99_ms']:>9}")
+    print(f"\n  api_calls         {result['api_calls']}")
+    if problems:
+        print("\nНе совпало с ожиданиями:")
+        for problem in problems:
+            print(f"  - {problem}")
+    elif problems is not None:
+        print("\nОжидания выполнены")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="Файл записи апдейтов (capture.file)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение относительно записи; 0 - без пауз")
+    parser.add_argument("--limit", type=int, default=0, help="Воспроизвести только первые N апдейтов")
+    parser.add_argument("--state", help="Начальный файл состояния (с теми же псевдонимами id)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа заглушки API, с")
+    parser.add_argument("--file-size", type=int, default=200, help="Размер скачиваемых медиа, КБ")
+    parser.add_argument("--preprocess", action="store_true", help="Включить предобработку медиа")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--expect", help="Проверить состояние и бюджеты сценариев по файлу ожиданий")
+    parser.add_argument("--save-expect", help="Записать ожидания по этому прогону")
+    parser.add_argument("--headroom", type=float, default=2.0, help="Запас бюджетов времени для --save-expect")
+    parser.add_argument("--save-state", help="Сохранить итоговый файл состояния")
+    parser.add_argument("--json", help="Сохранить полный результат в JSON")
+    args = parser.parse_args()
+    # Прогон идет во временном каталоге - пути из командной строки считаем от текущего
+    for name in ("recording", "state", "expect", "save_expect", "save_state", "json"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    result = replay(args)
+    problems = None
+    if args.expect:
+        with open(args.expect, "r", encoding="utf-8") as f:
+            problems = check_expectations(json.load(f), result)
+    print_report(result, problems)
+
+    if args.save_expect:
+        with open(args.save_expect, "w", encoding="utf-8") as f:
+            json.dump(make_expectations(result, args.headroom), f, ensure_ascii=False, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
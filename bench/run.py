@@ -0,0 +1,322 @@
+"""Офлайн-бенчмарки bot.py против локальной заглушки Bot API.
+
+Примеры:
+    python bench/run.py
+    python bench/run.py --workloads upload,post --latency 0.02 --throttle 0.05
+    python bench/run.py --save baseline.json
+    python bench/run.py --baseline baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+WORKLOADS = ("startup", "upload", "post", "status")
+OWNER_ID = 1000
+COMPARED_KEYS = ("throughput", "p50_ms", "p99_ms", "peak_rss_kb", "saves", "save_bytes", "fsyncs")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_message(message_id, user_id, **fields):
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+    }
+    message.update(fields)
+    return message
+
+
+def prepare_environment(args):
+    """Готовит временный каталог с конфигом и поднимает заглушку API"""
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, ROOT_DIR)
+    from fake_api import FakeTelegramAPI
+
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.chdir(workdir)
+    config = {
+        "telegram": {"token": "123456:BENCH", "admin_id": OWNER_ID},
+        "posts": {"timezone_offset": 0, "random_offset_minutes": 0},
+        "storage": {"data_file": "bot_data.pkl", "flush_interval": 3},
+        "metrics": {"enabled": True},
+        "media": {"preprocess": args.preprocess},
+    }
+
+    api = FakeTelegramAPI(
+        latency=args.latency,
+        throttle_rate=args.throttle,
+        file_size=args.file_size * 1024,
+        seed=args.seed,
+    ).start()
+    return config, api
+
+
+def start_bot(config, api):
+    """Импортирует бота и собирает приложение через create_app"""
+    import bot as bot_module
+    from telebot import apihelper
+    bot_module.create_app(config)
+    api.install(apihelper)
+    return bot_module
+
+
+def write_state(path, channels, queue):
+    """Записывает файл состояния с заданным числом каналов и медиа в очередях"""
+    import pickle
+    data = {"users": {OWNER_ID: {"role": "owner", "channels": []}}, "channels": {}, "user_sessions": {}}
+    for i in range(channels):
+        channel_id = -1000000000000 - i
+        folder = f"media/channel_{abs(channel_id)}"
+        paths = [f"{folder}/photo_{j}.jpg" for j in range(queue)]
+        data["channels"][channel_id] = {
+            "name": f"bench_{i}",
+            "media_folder": folder,
+            "post_text": "Бенчмарк",
+            "post_times": ["10:00", "15:00"],
+            "media_queue": [{"path": p, "type": "photo"} for p in paths],
+            "used_files": set(paths),
+        }
+        data["users"][OWNER_ID]["channels"].append(channel_id)
+    with open(path, "wb") as f:
+        pickle.dump(data, f)
+
+
+def add_channels(bot_module, count, post_time="10:00", queue=0, file_size=0):
+    bot_data = bot_module.bot_data
+    payload = os.urandom(min(file_size, 64 * 1024))
+    for i in range(count):
+        channel_id = -1000000000000 - i
+        bot_data.add_channel(channel_id, f"bench_{i}", "Бенчмарк", [post_time])
+        folder = bot_data.channels[channel_id]["media_folder"]
+        for j in range(queue):
+            path = os.path.join(folder, f"photo_{j}.jpg")
+            with open(path, "wb") as f:
+                f.write(payload)
+            bot_data.add_file_to_channel(channel_id, path, "photo")
+    return [-1000000000000 - i for i in range(count)]
+
+
+def workload_startup(config, api, args):
+    """Холодный старт до первого ответа: импорт bot.py, create_app и обработка первого апдейта.
+
+    Файл состояния читается при первом обращении к данным, поэтому без первого
+    апдейта замер не включал бы загрузку состояния.
+    """
+    write_state(config["storage"]["data_file"], args.channels, args.queue)
+    start = time.perf_counter()
+    bot_module = start_bot(config, api)
+    from telebot import types
+    update = types.Update.de_json({"update_id": 1, "message": make_message(1, OWNER_ID, text="/start")})
+    bot_module.bot.threaded = False
+    bot_module.bot.process_new_updates([update])
+    elapsed = time.perf_counter() - start
+    replied = any(method == "sendMessage" for method, _, _ in api.sent)
+    return [elapsed], elapsed, 0 if replied else 1
+
+
+def workload_upload(config, api, args):
+    """Пачка фото через handle_media в одной сессии загрузки"""
+    bot_module = start_bot(config, api)
+    from telebot import types
+    channel_id = add_channels(bot_module, 1)[0]
+    bot_module.bot_data.start_write_behind(config["storage"]["flush_interval"])
+    bot_module.bot_data.start_adding_session(OWNER_ID, channel_id)
+
+    messages = [
+        types.Message.de_json(make_message(
+            i, OWNER_ID,
+            photo=[{"file_id": f"bench{i}", "file_unique_id": f"bench{i}", "width": 1280, "height": 720}],
+        ))
+        for i in range(args.uploads)
+    ]
+
+    def run(message):
+        start = time.perf_counter()
+        bot_module.handle_media(message)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(run, messages))
+    bot_module.media_processor.wait(OWNER_ID)
+    elapsed = time.perf_counter() - started
+    added = bot_module.bot_data.finish_adding_session(OWNER_ID)
+    return latencies, elapsed, args.uploads - added
+
+
+def workload_post(config, api, args):
+    """Все каналы срабатывают в одном проходе check_posts"""
+    bot_module = start_bot(config, api)
+    post_time = datetime.now(timezone.utc).strftime("%H:%M")
+    add_channels(bot_module, args.channels, post_time=post_time, queue=args.queue, file_size=args.file_size * 1024)
+    scheduler = bot_module.scheduler
+
+    latencies = []
+    send = scheduler.send_scheduled_post
+
+    def timed_send(channel_id, occurrence=None):
+        start = time.perf_counter()
+        try:
+            return send(channel_id, occurrence)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    scheduler.send_scheduled_post = timed_send
+    started = time.perf_counter()
+    scheduler.check_posts()
+    elapsed = time.perf_counter() - started
+    posted = sum(1 for method, chat_id, _ in api.sent if method in ("sendPhoto", "sendVideo"))
+    return latencies, elapsed, args.channels - posted
+
+
+def workload_status(config, api, args):
+    """Запросы статуса через getUpdates и обработку апдейтов"""
+    bot_module = start_bot(config, api)
+    add_channels(bot_module, args.channels, queue=1, file_size=1024)
+    bot = bot_module.bot
+    bot.threaded = False
+
+    for i in range(args.queries):
+        api.push_update({"message": make_message(i, OWNER_ID, text="📊 Статус")})
+
+    latencies = []
+    offset = 0
+    started = time.perf_counter()
+    while len(latencies) < args.queries:
+        updates = bot.get_updates(offset=offset, timeout=1)
+        if not updates:
+            break
+        for update in updates:
+            start = time.perf_counter()
+            bot.process_new_updates([update])
+            latencies.append(time.perf_counter() - start)
+            offset = update.update_id + 1
+    elapsed = time.perf_counter() - started
+    return latencies, elapsed, args.queries - len(latencies)
+
+
+def run_child(args):
+    config, api = prepare_environment(args)
+    workload = globals()[f"workload_{args.child}"]
+    latencies, elapsed, errors = workload(config, api, args)
+    import metrics
+    api.stop()
+
+    saves = sum(state[2] for state in metrics.SAVE_DURATION.snapshot().values())
+    result = {
+        "workload": args.child,
+        "ops": len(latencies),
+        "seconds": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_rss_kb": peak_rss_kb(),
+        "errors": errors,
+        "saves": saves,
+        "save_bytes": metrics.SAVE_BYTES.total(),
+        "fsyncs": metrics.SAVE_FSYNCS.total(),
+        "api_calls": dict(api.calls),
+    }
+    print(json.dumps(result))
+
+
+def run_workload(name, argv):
+    command = [sys.executable, os.path.abspath(__file__), "--child", name] + argv
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Нагрузка {name} завершилась с ошибкой:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_report(results, baseline=None):
+    baseline = {item["workload"]: item for item in (baseline or [])}
+    for result in results:
+        print(f"\n== {result['workload']} ==")
+        for key in ("ops", "seconds", "throughput", "p50_ms", "p99_ms", "peak_rss_kb", "errors", "saves", "save_bytes", "fsyncs"):
+            line = f"  {key:<12} {result.get(key)}"
+            base = baseline.get(result["workload"], {}).get(key)
+            if key in COMPARED_KEYS and base:
+                delta = (result[key] - base) / base * 100
+                line += f"   (было {base}, {delta:+.1f}%)"
+            print(line)
+        print(f"  api_calls    {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="Список нагрузок через запятую")
+    parser.add_argument("--latency", type=float, default=0.005, help="Задержка ответа заглушки API, с")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--file-size", type=int, default=200, help="Размер медиафайлов, КБ")
+    parser.add_argument("--uploads", type=int, default=200, help="Файлов в пачке загрузки")
+    parser.add_argument("--concurrency", type=int, default=2, help="Потоков обработки апдейтов")
+    parser.add_argument("--channels", type=int, default=50, help="Количество каналов")
+    parser.add_argument("--queue", type=int, default=10, help="Медиа в очереди каждого канала")
+    parser.add_argument("--queries", type=int, default=100, help="Запросов статуса")
+    parser.add_argument("--preprocess", action="store_true", help="Включить предобработку медиа в пуле процессов")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="Сравнить с сохраненными результатами")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    passthrough = _strip_values(sys.argv[1:], ("--save", "--baseline", "--workloads"))
+    results = [run_workload(name.strip(), passthrough) for name in args.workloads.split(",") if name.strip()]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def _strip_values(argv, options):
+    """Убирает из argv опции родительского процесса вместе с их значениями"""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg in options:
+            skip = True
+            continue
+        if arg.split("=", 1)[0] in options:
+            continue
+        result.append(arg)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,57 @@
 import os
+import io
 import logging
 import random
-import yaml
+import signal
 import threading
 import pickle
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta, timezone
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import mimetypes
+from time import perf_counter, monotonic, sleep
+import metrics
+import schedule
+import media
+import importer
+import views
+import sendpool
+import logsetup
+import settings
+import profiler
+import history
+import captions
+import health
+import mediaqueue
+import recorder
+import backup
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Загрузка конфигурации
-try:
-    with open("config.yml", "r", encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-    
-    TOKEN = config["telegram"]["token"]
-    ADMIN_ID = config["telegram"]["admin_id"]
-    TIMEZONE_OFFSET = config["posts"]["timezone_offset"]
-    RANDOM_OFFSET = config["posts"]["random_offset_minutes"]
-    DATA_FILE = config["storage"]["data_file"]
-    
-except Exception as e:
-    logger.error(f"Ошибка загрузки конфига: {e}")
-    exit()
+def load_config(path="config.yml"):
+    """Загружает config.yml"""
+    return settings.load_config(path)
+
+def atomic_write(path, payload):
+    """Записывает файл целиком или не трогает его: временный файл, fsync и os.replace"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # fsync каталога, чтобы переименование пережило сбой питания
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
 # Роли пользователей
 ROLES = {
@@ -39,49 +61,183 @@ ROLES = {
     "user": 0
 }
 
+def _changes(method):
+    """Метод BotData, меняющий данные в несколько шагов: выполняется под блокировкой изменений"""
+    def wrapper(self, *args, **kwargs):
+        # Загрузка берет ту же блокировку, поэтому выполняется до нее
+        self.ensure_loaded()
+        with self._change_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class BotData:
-    def __init__(self):
-        self.users = {}  # {user_id: {"role": "owner/admin/moderator/user", "channels": [channel_ids]}}
-        self.channels = {}  # {channel_id: {"name": "Название", "media_folder": "path", "post_text": "текст", "post_times": ["10:00", "15:00"]}}
-        self.user_sessions = {}  # {user_id: {"state": "adding_media", "current_channel": channel_id, "temp_files": []}}
-        self.load_data()
-        
-        # Инициализация владельца
-        if ADMIN_ID not in self.users:
-            self.users[ADMIN_ID] = {"role": "owner", "channels": list(self.channels.keys())}  # Владелец имеет доступ ко всем каналам
-            self.save_data()
+    def __init__(self, data_file, admin_id, read_only=False):
+        self.data_file = data_file
+        self.admin_id = admin_id
+        self.read_only = read_only  # воркеры шардов только читают файл данных
+        self._loaded_stat = None
+        self._users = {}  # {user_id: {"role": "owner/admin/moderator/user", "channels": [channel_ids]}}
+        self._channels = {}  # {channel_id: {"name": "Название", "media_folder": "path", "post_text": "текст", "post_times": ["10:00", "15:00"]}}
+        self._user_sessions = {}  # {user_id: {"state": "adding_media", "current_channel": channel_id, "temp_files": []}}
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._change_lock = threading.RLock()  # многошаговые изменения данных и снимки для резервной копии
+        self._dirty = False  # есть несохраненные изменения сессий (write-behind)
+        self.version = 0  # растет при каждом изменении данных; по ней сбрасываются кэши представлений
+        self.flush_interval = 3  # период write-behind; меняется при перечитывании конфига
+        self._stop_flush = threading.Event()  # останавливает поток write-behind
+        self._captions = {}  # {channel_id: ((текст, название), captions.CompiledCaption)}
+        self.last_write = None  # monotonic-момент последней успешной записи
+        self.write_error = None  # текст ошибки последней записи (None - запись в порядке)
+    
+    # Состояние загружается с диска при первом обращении, а не при создании объекта
+    @property
+    def users(self):
+        self.ensure_loaded()
+        return self._users
+    
+    @property
+    def channels(self):
+        self.ensure_loaded()
+        return self._channels
+    
+    @property
+    def user_sessions(self):
+        self.ensure_loaded()
+        return self._user_sessions
+    
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock, self._change_lock:
+            if self._loaded:
+                return
+            self.load_data()
+            self._loaded = True
+            
+            # Инициализация владельца
+            if self.admin_id not in self._users:
+                self._users[self.admin_id] = {"role": "owner", "channels": list(self._channels.keys())}  # Владелец имеет доступ ко всем каналам
+                self.save_data()
+    
+    def reload_if_changed(self):
+        """Перечитывает файл данных, если его изменил другой процесс"""
+        try:
+            stat = os.stat(self.data_file)
+        except FileNotFoundError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == self._loaded_stat:
+            return False
+        with self._load_lock, self._change_lock:
+            self.load_data()
+            self._loaded = True
+        return True
     
     def load_data(self):
         try:
-            with open(DATA_FILE, "rb") as f:
+            with open(self.data_file, "rb") as f:
+                stat = os.fstat(f.fileno())
+                self._loaded_stat = (stat.st_mtime_ns, stat.st_size)
                 data = pickle.load(f)
-                self.users = data.get("users", {})
-                self.channels = data.get("channels", {})
-                self.user_sessions = data.get("user_sessions", {})
+                self.version += 1
+                self._users = data.get("users", {})
+                self._channels = data.get("channels", {})
+                self._user_sessions = data.get("user_sessions", {})
                 
                 # Миграция для старых данных: добавляем поле channels если его нет
-                for user_id, user_data in self.users.items():
+                for user_id, user_data in self._users.items():
                     if "channels" not in user_data:
                         if user_data["role"] == "owner" or user_data["role"] == "admin":
-                            user_data["channels"] = list(self.channels.keys())  # Админы и владелец имеют доступ ко всем каналам
+                            user_data["channels"] = list(self._channels.keys())  # Админы и владелец имеют доступ ко всем каналам
                         else:
                             user_data["channels"] = []  # Новые модераторы без доступа
                 
-                # Создаем папки для каналов
-                for channel_id, channel_data in self.channels.items():
-                    os.makedirs(channel_data["media_folder"], exist_ok=True)
+                for channel_data in self._channels.values():
+                    channel_data.setdefault("timezone", None)
+                    channel_data.setdefault("used_hashes", set())
+                    channel_data.setdefault("post_count", 0)
+                    if isinstance(channel_data["media_queue"], list):
+                        # Очередь-список из старых данных становится обычной полосой в прежнем порядке
+                        channel_data["media_queue"] = mediaqueue.MediaQueue(channel_data["media_queue"])
+                
+                # Папки каналов создаются по требованию при записи файлов (ensure_media_folder)
                     
         except (FileNotFoundError, EOFError):
             pass
     
+    def changing(self):
+        """Блокировка изменений: пока она взята, данные не меняются и снимок не застанет изменение наполовину"""
+        return self._change_lock
+    
     def save_data(self):
+        """Сразу записывает все состояние на диск (с fsync); вызывается после каждого изменения данных"""
+        self.version += 1
+        self._write()
+    
+    def _write(self):
+        if self.read_only:
+            return
         data = {
-            "users": self.users,
-            "channels": self.channels,
-            "user_sessions": self.user_sessions
+            "users": self._users,
+            "channels": self._channels,
+            "user_sessions": self._user_sessions
         }
-        with open(DATA_FILE, "wb") as f:
-            pickle.dump(data, f)
+        # Сериализация под блокировкой изменений: мутаторы не меняют данные посреди pickle.
+        # Порядок блокировок везде один: _load_lock, _change_lock, _save_lock
+        with self._change_lock, self._save_lock:
+            start = perf_counter()
+            # Сбрасываем флаг до сериализации: изменения во время записи попадут в следующую
+            self._dirty = False
+            try:
+                payload = pickle.dumps(data)
+                # Прерванная запись (SIGKILL, сбой диска) оставляет прежний файл целым
+                atomic_write(self.data_file, payload)
+            except Exception as e:
+                self._dirty = True
+                self.write_error = str(e)[:200]
+                raise
+            self.last_write = monotonic()
+            self.write_error = None
+            metrics.SAVE_DURATION.observe(perf_counter() - start)
+            metrics.SAVE_BYTES.inc(len(payload))
+            metrics.SAVE_FSYNCS.inc()
+    
+    def mark_dirty(self):
+        """Отмечает изменение эфемерного состояния (сессии, UI); оно запишется при flush"""
+        self._dirty = True
+    
+    def flush(self):
+        """Записывает отложенные изменения, если они есть"""
+        if self._dirty:
+            self._write()
+            return True
+        return False
+    
+    def start_write_behind(self, interval=3):
+        """Фоновый поток, периодически сбрасывающий отложенные изменения на диск"""
+        self.flush_interval = interval
+        
+        def loop():
+            while not self._stop_flush.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Ошибка отложенного сохранения: %s", e)
+        
+        thread = threading.Thread(target=loop, name="write-behind", daemon=True)
+        thread.start()
+        return thread
+    
+    def stop_write_behind(self):
+        """Останавливает фоновый сброс; последний flush делает вызывающий"""
+        self._stop_flush.set()
+    
+    def ensure_media_folder(self, channel_id):
+        """Создает папку канала при первой записи и возвращает ее путь"""
+        media_folder = self.channels[channel_id]["media_folder"]
+        os.makedirs(media_folder, exist_ok=True)
+        return media_folder
     
     def get_user_role(self, user_id):
         return self.users.get(user_id, {}).get("role", "user")
@@ -118,6 +274,7 @@ class BotData:
         
         return []
     
+    @_changes
     def add_channel_access(self, user_id, channel_id):
         """Добавляет доступ к каналу для модератора"""
         if user_id not in self.users or self.users[user_id]["role"] != "moderator":
@@ -136,6 +293,7 @@ class BotData:
         
         return False
     
+    @_changes
     def remove_channel_access(self, user_id, channel_id):
         """Удаляет доступ к каналу у модератора"""
         if user_id not in self.users or self.users[user_id]["role"] != "moderator":
@@ -148,7 +306,37 @@ class BotData:
         
         return False
     
+    def caption(self, channel_id):
+        """Скомпилированный шаблон подписи канала; компилируется заново только при смене текста или названия"""
+        channel = self.channels[channel_id]
+        key = (channel["post_text"], channel["name"])
+        cached = self._captions.get(channel_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            compiled = captions.compile_caption(channel["post_text"], name=channel["name"])
+        except captions.CaptionError as e:
+            # Текст, сохраненный до появления шаблонов, публикуется как есть
+            logger.warning("Подпись канала %s не компилируется (%s), используется как текст", channel_id, e)
+            compiled = captions.literal(channel["post_text"])
+        self._captions[channel_id] = (key, compiled)
+        return compiled
+    
+    def _caption_compiles(self, channel):
+        try:
+            captions.compile_caption(channel["post_text"], name=channel["name"])
+        except captions.CaptionError:
+            return False
+        return True
+    
+    def post_number(self, channel_id):
+        """Сколько медиа канала уже взято в посты (включая текущий)"""
+        return self.channels[channel_id].get("post_count", 0)
+    
+    @_changes
     def add_channel(self, channel_id, name, post_text, post_times):
+        # Ошибка в шаблоне подписи (CaptionError) не дает создать канал
+        compiled = captions.compile_caption(post_text, name=name)
         media_folder = f"media/channel_{abs(channel_id)}"
         os.makedirs(media_folder, exist_ok=True)
         
@@ -157,9 +345,13 @@ class BotData:
             "media_folder": media_folder,
             "post_text": post_text,
             "post_times": post_times,
-            "media_queue": [],
-            "used_files": set()
+            "timezone": None,  # None - часовой пояс из конфига
+            "media_queue": mediaqueue.MediaQueue(),  # полосы urgent/normal/filler, см. mediaqueue
+            "used_files": set(),
+            "used_hashes": set(),  # SHA-256 импортированных файлов для отсева дубликатов
+            "post_count": 0  # сколько медиа отправлено; для {number} и {rotate:...} в подписи
         }
+        self._captions[channel_id] = ((post_text, name), compiled)
         
         # Автоматически даем доступ к новому каналу владельцу и админам
         for uid, user_data in self.users.items():
@@ -171,74 +363,195 @@ class BotData:
         
         self.save_data()
     
-    def add_file_to_channel(self, channel_id, file_path, file_type):
+    @_changes
+    def add_file_to_channel(self, channel_id, file_path, file_type, **details):
         if channel_id not in self.channels:
             return False
         
         channel = self.channels[channel_id]
         if file_path not in channel["used_files"]:
-            channel["media_queue"].append({"path": file_path, "type": file_type})
+            # details - результаты предобработки: size, width, height, duration
+            channel["media_queue"].append({"path": file_path, "type": file_type, **details})
             channel["used_files"].add(file_path)
             self.save_data()
             return True
         return False
     
+    @_changes
+    def add_files_to_channel(self, channel_id, items):
+        """Добавляет пачку файлов в очередь с одной записью файла данных"""
+        if channel_id not in self.channels:
+            return 0
+        
+        channel = self.channels[channel_id]
+        added = 0
+        for item in items:
+            if item["path"] in channel["used_files"] or item.get("sha256") in channel["used_hashes"]:
+                continue
+            channel["media_queue"].append(item)
+            channel["used_files"].add(item["path"])
+            if item.get("sha256"):
+                channel["used_hashes"].add(item["sha256"])
+            added += 1
+        
+        if added:
+            self.save_data()
+        return added
+    
+    def channel_hashes(self, channel_id):
+        """Хэши файлов канала: уже импортированные и стоящие в очереди"""
+        channel = self.channels[channel_id]
+        hashes = set(channel["used_hashes"])
+        hashes.update(item["sha256"] for item in channel["media_queue"] if item.get("sha256"))
+        return hashes
+    
+    @_changes
     def get_next_file_from_channel(self, channel_id, remove=True):
         if channel_id not in self.channels:
             return None
         
         channel = self.channels[channel_id]
         if channel["media_queue"]:
-            return channel["media_queue"].pop(0) if remove else channel["media_queue"][0]
+            if remove:
+                channel["post_count"] = channel.get("post_count", 0) + 1
+                item = channel["media_queue"].pop()
+                # Взятое медиа сразу пишется на диск: иначе после перезапуска его отправили бы повторно
+                self.save_data()
+                return item
+            return channel["media_queue"].peek()
         return None
     
+    def queue_length(self, channel_id):
+        return len(self.channels[channel_id]["media_queue"])
+    
+    def queue_item(self, channel_id, position):
+        """Медиа на позиции position (с 1) в порядке выдачи; QueueError, если ее нет"""
+        if channel_id not in self.channels:
+            raise mediaqueue.QueueError("Канал не найден")
+        return self.channels[channel_id]["media_queue"].at(position)
+    
+    @_changes
+    def move_queue_item(self, channel_id, position, lane=None, where="bottom"):
+        """Переносит медиа в начало или конец полосы; остальная очередь не переписывается"""
+        item = self.queue_item(channel_id, position)
+        self.channels[channel_id]["media_queue"].move(item["path"], lane, where)
+        self.save_data()
+        return item
+    
+    @_changes
+    def bump_queue_item(self, channel_id, position):
+        item = self.queue_item(channel_id, position)
+        self.channels[channel_id]["media_queue"].bump(item["path"])
+        self.save_data()
+        return item
+    
+    @_changes
+    def remove_queue_item(self, channel_id, position):
+        """Убирает медиа из очереди и удаляет файл; путь остается в used_files, чтобы не вернуться повторно"""
+        item = self.queue_item(channel_id, position)
+        self.channels[channel_id]["media_queue"].remove(item["path"])
+        self.save_data()
+        if os.path.exists(item["path"]):
+            os.remove(item["path"])
+        return item
+    
+    @_changes
+    def set_queue_policy(self, channel_id, policy):
+        if channel_id not in self.channels:
+            return False
+        self.channels[channel_id]["media_queue"].set_policy(policy)
+        self.save_data()
+        return True
+    
     def start_adding_session(self, user_id, channel_id):
         self.user_sessions[user_id] = {
             "state": "adding_media",
             "current_channel": channel_id,
             "temp_files": []
         }
-        self.save_data()
+        self.mark_dirty()
     
     def add_temp_file(self, user_id, file_path, file_type):
         if user_id in self.user_sessions:
             self.user_sessions[user_id]["temp_files"].append({"path": file_path, "type": file_type})
-            self.save_data()
+            self.mark_dirty()
             return True
         return False
     
+    def update_temp_file(self, user_id, file_path, **details):
+        """Дополняет временный файл сессии результатами предобработки"""
+        if user_id not in self.user_sessions:
+            return False
+        for file_info in self.user_sessions[user_id]["temp_files"]:
+            if file_info["path"] == file_path:
+                file_info.update(details)
+                self.mark_dirty()
+                return True
+        return False
+    
+    def discard_temp_file(self, user_id, file_path):
+        """Убирает отклоненный файл из сессии и удаляет его с диска"""
+        if user_id in self.user_sessions:
+            temp_files = self.user_sessions[user_id]["temp_files"]
+            self.user_sessions[user_id]["temp_files"] = [f for f in temp_files if f["path"] != file_path]
+            self.mark_dirty()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    
+    @_changes
     def finish_adding_session(self, user_id):
         if user_id not in self.user_sessions:
             return 0
         
         session = self.user_sessions[user_id]
-        channel_id = session["current_channel"]
+        channel = self.channels.get(session["current_channel"])
         added_count = 0
         
         for file_info in session["temp_files"]:
-            if self.add_file_to_channel(channel_id, file_info["path"], file_info["type"]):
+            if channel is not None and file_info["path"] not in channel["used_files"]:
+                # file_info уже содержит path, type и результаты предобработки;
+                # источник - загрузивший модератор (для политики interleave)
+                channel["media_queue"].append({**file_info, "source": f"user:{user_id}"})
+                channel["used_files"].add(file_info["path"])
                 added_count += 1
             else:
                 if os.path.exists(file_info["path"]):
                     os.remove(file_info["path"])
         
         del self.user_sessions[user_id]
+        # Очередь и закрытие сессии - одной записью на диск
         self.save_data()
         
         return added_count
     
+    @_changes
     def remove_user_role(self, user_id):
-        if user_id in self.users and user_id != ADMIN_ID:
+        if user_id in self.users and user_id != self.admin_id:
             role = self.users[user_id]["role"]
             del self.users[user_id]
             self.save_data()
             return role
         return None
     
+    @_changes
     def update_channel(self, channel_id, **kwargs):
         if channel_id not in self.channels:
             return False
         
+        channel = self.channels[channel_id]
+        if "post_text" in kwargs or "name" in kwargs:
+            # Шаблон проверяется до сохранения: при CaptionError канал не меняется
+            text = kwargs.get("post_text", channel["post_text"])
+            name = kwargs.get("name", channel["name"])
+            try:
+                compiled = captions.compile_caption(text, name=name)
+            except captions.CaptionError:
+                if "post_text" in kwargs or self._caption_compiles(channel):
+                    raise
+                # Старый текст, который не компилировался и раньше, переименование не блокирует
+                compiled = captions.literal(text)
+            self._captions[channel_id] = ((text, name), compiled)
+        
         for key, value in kwargs.items():
             if key in self.channels[channel_id] and key != "media_folder":
                 self.channels[channel_id][key] = value
@@ -246,6 +559,7 @@ class BotData:
         self.save_data()
         return True
     
+    @_changes
     def delete_channel(self, channel_id):
         if channel_id not in self.channels:
             return False
@@ -266,73 +580,332 @@ class BotData:
             os.rmdir(media_folder)
         
         del self.channels[channel_id]
+        self._captions.pop(channel_id, None)
         self.save_data()
         return True
 
 class PostScheduler:
-    def __init__(self, bot, bot_data):
+    def __init__(self, bot, bot_data, timezone_offset=3, random_offset=0, clock=None, default_timezone=None, window=60, sender=None, history=None):
         self.bot = bot
+        # Чем публиковать посты: основной бот или sendpool.SendPool; уведомления идут через основного
+        self.sender = sender or bot
         self.bot_data = bot_data
+        self.timezone_offset = timezone_offset
+        self.random_offset = random_offset
+        # Часовой пояс каналов без собственного: IANA из конфига или фиксированное смещение
+        self.default_timezone_name = default_timezone or timezone_offset
+        self.default_timezone = schedule.get_timezone(self.default_timezone_name)
+        # Источник текущего времени (aware, UTC); в симуляции подменяется виртуальными часами
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.window = window  # сколько секунд после запланированного времени пост еще можно отправить
+        self.plans = {}  # {channel_id: {"signature", "schedule", "next", "planned"}}
         self.last_sent = {}
+        self.restored = {}  # {channel_id: (signature, fire_at, planned)} из сохраненного состояния
+        self._previews = {}  # {channel_id: (signature, schedule)} для каналов, которых планировщик еще не проверял
+        self.stopping = threading.Event()  # при остановке новые посты не начинаются
+        self.history = history  # history.PostHistory или None
+        self._local = threading.local()  # last_post свой у каждого потока цикла
+        self.heartbeat = health.Heartbeat()  # отмечается на каждом проходе и перед каждым каналом
+        self.sending = None  # (channel_id, occurrence, planned) отправляемого сейчас поста
+        self.active_loop = None  # поток цикла; после перезапуска сторожем прежний поток выходит
+    
+    @property
+    def last_post(self):
+        """Подробности последней отправки этого потока для истории (байты, message_id...)"""
+        return self._local.__dict__.setdefault("last_post", {})
+    
+    @last_post.setter
+    def last_post(self, value):
+        self._local.last_post = value
+    
+    def channel_timezone(self, channel_id):
+        name = self.bot_data.channels[channel_id].get("timezone")
+        return schedule.get_timezone(name) if name else self.default_timezone
+    
+    def get_plan(self, channel_id):
+        """Скомпилированное расписание канала; пересобирается только при изменении времени или пояса"""
+        channel = self.bot_data.channels[channel_id]
+        signature = (tuple(channel["post_times"]), channel.get("timezone"))
+        plan = self.plans.get(channel_id)
+        if plan is None or plan["signature"] != signature:
+            plan = {
+                "signature": signature,
+                "schedule": schedule.compile_schedule(channel["post_times"], self.channel_timezone(channel_id)),
+                "next": None,
+                "planned": None,
+                "attempt": None,  # (fire_at, итог, подробности) неудачной попытки текущего слота
+                "initialized": False
+            }
+            self.plans[channel_id] = plan
+        return plan
+    
+    def invalidate(self, channel_ids=None):
+        """Сбрасывает планы каналов (все, если channel_ids не задан)"""
+        if channel_ids is None:
+            self.plans.clear()
+        else:
+            for channel_id in channel_ids:
+                self.plans.pop(channel_id, None)
+    
+    def reconfigure(self, timezone_offset, random_offset, default_timezone=None):
+        """Применяет перечитанные настройки постов, сохраняя last_sent; возвращает число затронутых планов"""
+        affected = set()
+        zone = default_timezone or timezone_offset
+        self.timezone_offset = timezone_offset
+        if zone != self.default_timezone_name:
+            self.default_timezone = schedule.get_timezone(zone)
+            self.default_timezone_name = zone
+            # Каналы с собственным поясом от пояса по умолчанию не зависят
+            for channel_id, plan in list(self.plans.items()):
+                channel = self.bot_data.channels.get(channel_id)
+                if channel is None or not channel.get("timezone"):
+                    plan["signature"] = None  # пересоберется при следующем get_plan
+                    affected.add(channel_id)
+        if random_offset != self.random_offset:
+            self.random_offset = random_offset
+            # Расписание не меняется - заново выбирается только разброс ближайшего срабатывания
+            for channel_id, plan in list(self.plans.items()):
+                plan["initialized"] = False
+                affected.add(channel_id)
+        return len(affected)
+    
+    def _advance(self, plan, after, previous_planned=None):
+        occurrence = plan["schedule"].next_after(after)
+        plan["next"] = occurrence
+        plan["attempt"] = None
+        if occurrence is None:
+            plan["planned"] = None
+            return
+        # Разброс выбирается один раз на срабатывание, а не на каждой проверке
+        planned = occurrence.fire_at + timedelta(minutes=random.randint(-self.random_offset, self.random_offset))
+        if previous_planned is not None and planned <= previous_planned:
+            planned = previous_planned + timedelta(minutes=1)
+        plan["planned"] = planned
+    
+    def _skip_missed(self, channel_id, plan, now, report=True):
+        while plan["next"] is not None and (now - plan["planned"]).total_seconds() > self.window:
+            occurrence = plan["next"]
+            attempt = plan.get("attempt")
+            if attempt is not None and attempt[0] == occurrence.fire_at:
+                # Слот пытались отправить: в историю идет итог последней попытки, а не пропуск
+                self.record_history(channel_id, occurrence, plan["planned"], attempt[1], **attempt[2])
+            elif report and not self.was_sent(channel_id, occurrence.date_key, occurrence.label):
+                metrics.MISSED_POSTS.inc(channel=channel_id)
+                self.record_history(channel_id, occurrence, plan["planned"], "missed")
+                logger.warning(
+                    "Пропущен пост в канал %s по расписанию %s", channel_id, occurrence.label,
+                    extra={"event": "post_missed"}
+                )
+            self._advance(plan, occurrence.fire_at, plan["planned"])
+    
+    def next_post(self, channel_id, now=None):
+        """Ближайшее срабатывание канала: (occurrence, запланированное время с разбросом)"""
+        plan = self.get_plan(channel_id)
+        now = now or self.clock()
+        if not plan["initialized"]:
+            if self._restore_plan(channel_id, plan):
+                # Теплый старт: тот же разброс, что до остановки; пропущенное за простой учитывается
+                self._skip_missed(channel_id, plan, now)
+            else:
+                # Слоты, которые из-за разброса еще впереди, тоже учитываются
+                self._advance(plan, now - timedelta(seconds=self.window, minutes=self.random_offset))
+                self._skip_missed(channel_id, plan, now, report=False)
+            plan["initialized"] = True
+        else:
+            self._skip_missed(channel_id, plan, now)
+        return plan["next"], plan["planned"]
     
-    def convert_to_utc(self, msk_time_str):
-        hour, minute = map(int, msk_time_str.split(":"))
-        hour_utc = (hour - TIMEZONE_OFFSET) % 24
-        return time(hour_utc, minute)
+    def preview_post(self, channel_id, now=None):
+        """Ближайшее срабатывание для показа: как next_post, но план не меняется и пропуски не отмечаются.
+        
+        Вызывается из обработчиков параллельно с циклом планировщика, поэтому только читает его план.
+        Возвращает (occurrence, запланированное время, скомпилированное расписание)."""
+        now = now or self.clock()
+        channel = self.bot_data.channels[channel_id]
+        signature = (tuple(channel["post_times"]), channel.get("timezone"))
+        plan = self.plans.get(channel_id)
+        if plan is not None and plan["signature"] == signature and plan["initialized"]:
+            compiled = plan["schedule"]
+            occurrence, planned = plan["next"], plan["planned"]
+            if occurrence is None or (now - planned).total_seconds() <= self.window:
+                return occurrence, planned, compiled
+        else:
+            cached = self._previews.get(channel_id)
+            if cached is None or cached[0] != signature:
+                cached = (signature, schedule.compile_schedule(channel["post_times"], self.channel_timezone(channel_id)))
+                self._previews[channel_id] = cached
+            compiled = cached[1]
+        # Разброс еще не выбран или план отстал: показываем время по расписанию
+        occurrence = compiled.next_after(now - timedelta(seconds=self.window))
+        return occurrence, occurrence.fire_at if occurrence is not None else None, compiled
+    
+    def _restore_plan(self, channel_id, plan):
+        saved = self.restored.pop(channel_id, None)
+        if saved is None or saved[0] != plan["signature"]:
+            return False
+        signature, fire_at, planned = saved
+        occurrence = plan["schedule"].next_after(fire_at - timedelta(microseconds=1))
+        if occurrence is None or occurrence.fire_at != fire_at:
+            return False
+        plan["next"] = occurrence
+        plan["planned"] = planned
+        return True
     
-    def calculate_post_times(self, channel_id):
+    def export_state(self, keep_days=3):
+        """Состояние для теплого старта: отметки об отправке и выбранный разброс ближайших постов"""
+        today = self.clock().date()
+        last_sent = {
+            channel_id: {date_key: dict(slots) for date_key, slots in dates.items() if (today - date_key).days <= keep_days}
+            for channel_id, dates in list(self.last_sent.items())
+        }
+        plans = {
+            channel_id: (plan["signature"], plan["next"].fire_at, plan["planned"])
+            for channel_id, plan in list(self.plans.items())
+            if plan.get("initialized") and plan["next"] is not None and plan["signature"] is not None
+        }
+        return {
+            "version": 1,
+            "saved_at": self.clock(),
+            "default_timezone": self.default_timezone_name,
+            "last_sent": {channel_id: dates for channel_id, dates in last_sent.items() if dates},
+            "plans": plans,
+        }
+    
+    def restore_state(self, state):
+        """Применяет export_state предыдущего запуска; планы восстанавливаются при первом обращении"""
+        if not state or state.get("version") != 1:
+            return False
+        for channel_id, dates in state.get("last_sent", {}).items():
+            for date_key, slots in dates.items():
+                self.last_sent.setdefault(channel_id, {}).setdefault(date_key, {}).update(slots)
+        for channel_id, (signature, fire_at, planned) in state.get("plans", {}).items():
+            # При другом поясе по умолчанию сохраненное время каналов без своего пояса неверно
+            if signature[1] is None and state.get("default_timezone") != self.default_timezone_name:
+                continue
+            self.restored[channel_id] = (signature, fire_at, planned)
+        return True
+    
+    def save_state(self, path):
+        atomic_write(path, pickle.dumps(self.export_state()))
+    
+    def load_state(self, path):
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("Состояние планировщика %s не прочитано: %s", path, e)
+            return False
+        return self.restore_state(state)
+    
+    def calculate_post_times(self, channel_id, hours=24):
+        """Срабатывания канала в ближайшие hours часов: [(метка времени, момент в UTC)]"""
         if channel_id not in self.bot_data.channels:
             return []
-            
-        now = datetime.now()
-        post_times = []
         
-        for msk_time in self.bot_data.channels[channel_id]["post_times"]:
-            utc_time = self.convert_to_utc(msk_time)
-            post_time = datetime.combine(now.date(), utc_time)
-            
-            post_time += timedelta(minutes=random.randint(-RANDOM_OFFSET, RANDOM_OFFSET))
-            
-            if post_time < now - timedelta(minutes=1):
-                post_time += timedelta(days=1)
-            
-            post_times.append((msk_time, post_time))
+        now = self.clock()
+        occurrence, planned, compiled = self.preview_post(channel_id, now)
+        if occurrence is None:
+            return []
         
-        return sorted(post_times, key=lambda x: x[1])
+        post_times = [(occurrence.label, planned)]
+        until = now + timedelta(hours=hours)
+        for following in compiled.occurrences(occurrence.fire_at + timedelta(minutes=1), until):
+            post_times.append((following.label, following.fire_at))
+        return post_times
     
-    def should_send_post(self, channel_id, msk_time, post_time):
-        now = datetime.now()
-        date_key = post_time.date()
-        
-        time_diff = (now - post_time).total_seconds()
-        if abs(time_diff) > 60:
-            return False
-        
+    def was_sent(self, channel_id, date_key, msk_time):
+        return self.last_sent.get(channel_id, {}).get(date_key, {}).get(msk_time, False)
+    
+    def mark_sent(self, channel_id, date_key, msk_time):
         if channel_id not in self.last_sent:
             self.last_sent[channel_id] = {}
-            
-        if self.last_sent[channel_id].get(date_key, {}).get(msk_time, False):
-            return False
-            
-        return True
+        if date_key not in self.last_sent[channel_id]:
+            self.last_sent[channel_id][date_key] = {}
+        self.last_sent[channel_id][date_key][msk_time] = True
+    
+    def is_active_loop(self):
+        return self.active_loop is None or self.active_loop == threading.get_ident()
     
     def check_posts(self):
+        for channel_id in list(self.bot_data.channels.keys()):
+            if self.stopping.is_set() or not self.is_active_loop():
+                break
+            self.heartbeat.beat()
+            try:
+                with logsetup.log_context(channel_id=channel_id):
+                    self.check_channel(channel_id)
+            except Exception as e:
+                logger.error("Ошибка проверки постов канала %s: %s", channel_id, e, extra={"channel_id": channel_id})
+    
+    def check_channel(self, channel_id):
+        occurrence, planned = self.next_post(channel_id, self.clock())
+        if occurrence is None or self.clock() < planned:
+            return
+        
+        plan = self.plans[channel_id]
+        if self.was_sent(channel_id, occurrence.date_key, occurrence.label):
+            self._advance(plan, occurrence.fire_at, planned)
+            return
+        
+        started = perf_counter()
+        self.last_post = {}
+        current = self.sending = (channel_id, occurrence, planned)
         try:
-            for channel_id in self.bot_data.channels.keys():
-                for msk_time, post_time in self.calculate_post_times(channel_id):
-                    if self.should_send_post(channel_id, msk_time, post_time):
-                        if self.send_scheduled_post(channel_id):
-                            date_key = post_time.date()
-                            if channel_id not in self.last_sent:
-                                self.last_sent[channel_id] = {}
-                            if date_key not in self.last_sent[channel_id]:
-                                self.last_sent[channel_id][date_key] = {}
-                            self.last_sent[channel_id][date_key][msk_time] = True
-                            logger.info(f"Отправлен пост в канал {channel_id} по расписанию {msk_time} МСК")
-        except Exception as e:
-            logger.error(f"Ошибка проверки постов: {e}")
+            sent = self.send_scheduled_post(channel_id, occurrence)
+        finally:
+            if self.sending is current:
+                self.sending = None
+        if sent:
+            metrics.POST_DELAY.observe(abs((self.clock() - planned).total_seconds()), channel=channel_id)
+            self.mark_sent(channel_id, occurrence.date_key, occurrence.label)
+            self.record_history(channel_id, occurrence, planned, "sent", **self.last_post)
+            logger.info(
+                "Отправлен пост в канал %s по расписанию %s (%s)",
+                channel_id, occurrence.label, plan["schedule"].tz,
+                extra={"event": "post_sent", "duration": round(perf_counter() - started, 3)}
+            )
+        if not self.is_active_loop():
+            # Сторож уже отметил слот отправленным и запустил новый цикл: план теперь его,
+            # а исход зависшей отправки известен только этому потоку
+            if not sent:
+                self.record_history(channel_id, occurrence, planned, self.last_post.pop("outcome", "failed"), **self.last_post)
+            return
+        if sent:
+            self._advance(plan, occurrence.fire_at, planned)
+        else:
+            # Слот повторяется, пока не выйдет окно; в историю попадет один итог - отправка или последняя неудача
+            outcome = self.last_post.pop("outcome", "failed")
+            plan["attempt"] = (occurrence.fire_at, outcome, dict(self.last_post))
     
-    def send_scheduled_post(self, channel_id):
+    def record_history(self, channel_id, occurrence, planned, outcome, **details):
+        if self.history is None:
+            return
+        now = self.clock()
+        entry = {
+            "channel_id": channel_id,
+            "date": occurrence.date_key.isoformat(),
+            "slot": occurrence.label,
+            "planned": planned.isoformat() if planned else None,
+            "sent_at": now.isoformat() if outcome == "sent" else None,
+            "delay": round((now - planned).total_seconds(), 3) if outcome == "sent" and planned else None,
+            "outcome": outcome,
+        }
+        entry.update(details)
+        self.history.record(entry)
+    
+    def render_caption(self, channel_id, file_info, occurrence=None):
+        """Подпись к посту по шаблону канала для слота occurrence (по умолчанию - текущее время)"""
+        local = occurrence.local if occurrence is not None else self.clock().astimezone(self.channel_timezone(channel_id))
+        return self.bot_data.caption(channel_id).render({
+            "local": local,
+            "number": self.bot_data.post_number(channel_id),
+            "remaining": self.bot_data.queue_length(channel_id),
+            "item": file_info,
+        })
+    
+    def send_scheduled_post(self, channel_id, occurrence=None):
         file_info = self.bot_data.get_next_file_from_channel(channel_id)
         if not file_info:
             for user_id, user_data in self.bot_data.users.items():
@@ -342,30 +915,43 @@ class PostScheduler:
                         self.bot.send_message(user_id, f"❌ В канале '{channel_name}' нет медиа для поста!")
                     except:
                         pass
+            self.last_post = {"outcome": "empty"}
             return False
         
         try:
-            channel_data = self.bot_data.channels[channel_id]
             file_path = file_info["path"]
             file_type = file_info["type"]
+            file_size = os.path.getsize(file_path)
+            caption = self.render_caption(channel_id, file_info, occurrence)
+            self.last_post = {"type": file_type, "bytes": file_size}
+            sent = None
             
-            with open(file_path, "rb") as media_file:
+            with open(file_path, "rb") as media_file, metrics.TRANSFER_SECONDS.time(direction="upload") as upload:
                 if file_type == "photo":
-                    self.bot.send_photo(
+                    sent = self.sender.send_photo(
                         chat_id=channel_id,
                         photo=media_file,
-                        caption=channel_data["post_text"]
+                        caption=caption
                     )
                 elif file_type == "video":
-                    self.bot.send_video(
+                    sent = self.sender.send_video(
                         chat_id=channel_id,
                         video=media_file,
-                        caption=channel_data["post_text"]
+                        caption=caption,
+                        duration=file_info.get("duration"),
+                        width=file_info.get("width"),
+                        height=file_info.get("height"),
+                        supports_streaming=True if "duration" in file_info else None
                     )
+            metrics.TRANSFER_BYTES.inc(file_size, direction="upload")
+            self.last_post.update(
+                upload_seconds=round(upload.elapsed, 3),
+                message_id=getattr(sent, "message_id", None)
+            )
             
             os.remove(file_path)
             
-            remaining = len(self.bot_data.channels[channel_id]["media_queue"])
+            remaining = self.bot_data.queue_length(channel_id)
             if remaining <= 6:
                 channel_name = self.bot_data.channels[channel_id]["name"]
                 # Уведомляем только тех, у кого есть доступ к каналу
@@ -380,68 +966,222 @@ class PostScheduler:
                             pass
             return True
         except Exception as e:
-            logger.error(f"Ошибка отправки поста в канал {channel_id}: {e}")
+            logger.error("Ошибка отправки поста в канал %s: %s", channel_id, e)
+            self.last_post["error"] = str(e)[:200]
             return False
-    
-    def get_schedule_info(self, user_id=None):
-        """Возвращает информацию о расписании с учетом доступных каналов"""
-        info = []
-        now = datetime.now()
-        
-        # Определяем, какие каналы показывать
-        if user_id is None or self.bot_data.has_permission(user_id, "admin"):
-            channels_to_show = self.bot_data.channels
-        else:
-            accessible_channels = self.bot_data.get_accessible_channels(user_id)
-            channels_to_show = {cid: data for cid, data in self.bot_data.channels.items() 
-                              if cid in accessible_channels}
-        
-        if not channels_to_show:
-            return "❌ Нет доступных каналов" if user_id else "❌ Нет добавленных каналов"
-        
-        for channel_id, channel_data in channels_to_show.items():
-            info.append(f"📺 Канал: {channel_data['name']}")
-            info.append(f"📊 Осталось медиа: {len(channel_data['media_queue'])}")
-            
-            channel_times = self.calculate_post_times(channel_id)
-            if not channel_times:
-                info.append("   ⚠️ Нет расписания")
-            else:
-                for i, (msk_time, post_time) in enumerate(channel_times, 1):
-                    time_left = post_time - now
-                    if time_left.total_seconds() < 0:
-                        time_left = timedelta(0)
-                    
-                    hours, rem = divmod(time_left.seconds, 3600)
-                    minutes, seconds = divmod(rem, 60)
-                    
-                    info.append(
-                        f"   {i}. Через {hours:02d}:{minutes:02d}:{seconds:02d} "
-                        f"(~{msk_time} МСК)"
-                    )
-            info.append("")
-        
-        return "\n".join(info)
 
-def run_scheduler(bot, bot_data):
-    scheduler = PostScheduler(bot, bot_data)
-    while True:
+def run_scheduler(scheduler, interval=30):
+    scheduler.active_loop = threading.get_ident()
+    while not scheduler.stopping.is_set() and scheduler.is_active_loop():
+        scheduler.heartbeat.beat()
+        started = perf_counter()
         try:
             scheduler.check_posts()
         except Exception as e:
-            logger.error(f"Ошибка в планировщике: {e}")
-        threading.Event().wait(30)
+            logger.error("Ошибка в планировщике: %s", e)
+        if scheduler.stopping.wait(interval) or not scheduler.is_active_loop():
+            break
+        metrics.SCHEDULER_LAG.set(max(0.0, perf_counter() - started - interval))
+
+# Объекты приложения создаются в create_app
+bot = None
+bot_data = None
+scheduler = None
+media_processor = None
+paged_views = None
+health_monitor = None
+app_settings = None  # settings.Settings; задается в main, без него перечитывание недоступно
+_background_jobs = set()  # потоки импорта, которых дожидается остановка
+_shutdown_deadline = None  # monotonic-момент, к которому остановка должна завершиться
+_handlers = []
+_callback_handlers = []
+
+def message_handler(**filters):
+    """Запоминает обработчик сообщений; в TeleBot он регистрируется в create_app"""
+    def decorator(func):
+        wrapped = metrics.timed_handler(func)
+        _handlers.append((wrapped, filters))
+        return wrapped
+    return decorator
+
+def callback_handler(**filters):
+    """То же для нажатий инлайн-кнопок"""
+    def decorator(func):
+        wrapped = metrics.timed_handler(func)
+        _callback_handlers.append((wrapped, filters))
+        return wrapped
+    return decorator
+
+def create_app(config):
+    """Создает бота, хранилище и планировщик по конфигурации без запуска фоновых потоков"""
+    global bot, bot_data, scheduler, media_processor, paged_views, health_monitor
+    
+    bot_data = BotData(config["storage"]["data_file"], config["telegram"]["admin_id"])
+    bot = telebot.TeleBot(config["telegram"]["token"])
+    scheduler = PostScheduler(
+        bot, bot_data,
+        timezone_offset=config["posts"]["timezone_offset"],
+        random_offset=config["posts"]["random_offset_minutes"],
+        default_timezone=config["posts"].get("timezone"),
+        sender=sendpool.create_sender(config, bot),
+        history=history.create_history(config)
+    )
+    media_processor = media.MediaProcessor(config.get("media"))
+    paged_views = views.PagedViews(bot_data, scheduler)
+    health_monitor = health.HealthMonitor(bot, bot_data, scheduler, processor=media_processor, config=config.get("health"))
+    
+    for handler, filters in _handlers:
+        bot.register_message_handler(handler, **filters)
+    for handler, filters in _callback_handlers:
+        bot.register_callback_query_handler(handler, **filters)
+    
+    metrics.REGISTRY.gauge(
+        "bot_queue_depth", "Длина очереди медиа по каналам", ("channel",),
+        callback=lambda: {(cid,): len(data["media_queue"]) for cid, data in list(bot_data.channels.items())}
+    )
+    metrics.REGISTRY.gauge(
+        "bot_heartbeat_age_seconds", "Секунды с последнего пульса планировщика и опроса", ("component",),
+        callback=lambda: {("scheduler",): health_monitor.scheduler_age(), ("polling",): health_monitor.polling.age()}
+    )
+    metrics.REGISTRY.gauge(
+        "bot_log_dropped", "Записи лога, отброшенные из-за переполненной очереди",
+        callback=lambda: {(): logsetup.dropped()}
+    )
+    metrics.REGISTRY.gauge(
+        "bot_upload_sessions", "Активные сессии загрузки",
+        callback=lambda: {(): sum(1 for s in list(bot_data.user_sessions.values()) if s.get("state") == "adding_media")}
+    )
+    if (config.get("metrics") or {}).get("enabled", True):
+        apihelper.CUSTOM_REQUEST_SENDER = metrics.instrumented_request
+    
+    return bot
+
+def reconfigure_components(config, changed, scheduler, processor=None, bot_data=None, monitor=None, **log_fields):
+    """Применяет перечитанный конфиг к объектам процесса - только к зависящим от changed"""
+    sections = {key.split(".", 1)[0] for key in changed}
+    if "logging" in sections:
+        logsetup.setup_logging(config.get("logging"), **log_fields)
+    if "posts" in sections:
+        posts = config["posts"]
+        affected = scheduler.reconfigure(posts["timezone_offset"], posts["random_offset_minutes"], posts.get("timezone"))
+        logger.info("Пересчитано расписаний каналов: %d", affected, extra={"event": "config_reload"})
+    if "send_pool" in sections and isinstance(scheduler.sender, sendpool.SendPool):
+        scheduler.sender.reconfigure(config.get("send_pool"))
+    if "media" in sections and processor is not None:
+        processor.reconfigure(config.get("media"))
+    if "storage" in sections and bot_data is not None:
+        bot_data.flush_interval = config["storage"].get("flush_interval", 3)
+    if "health" in sections and monitor is not None:
+        monitor.reconfigure(config.get("health"))
+
+def reload_config():
+    """Перечитывает config.yml; возвращает (изменено, требует перезапуска), при ошибке - ConfigError"""
+    if app_settings is None:
+        raise settings.ConfigError("конфигурация загружена без settings.Settings")
+    try:
+        result = app_settings.reload()
+    except settings.ConfigError:
+        metrics.CONFIG_RELOADS.inc(result="error")
+        raise
+    metrics.CONFIG_RELOADS.inc(result="ok")
+    return result
+
+def _reload_on_signal(signum, frame):
+    # Обработчик сигнала выполняется в главном потоке между инструкциями -
+    # перечитываем в отдельном потоке, чтобы не столкнуться с занятыми блокировками
+    def run():
+        try:
+            reload_config()
+        except settings.ConfigError as e:
+            logger.error("Конфигурация не применена: %s", e, extra={"event": "config_reload"})
+    
+    threading.Thread(target=run, name="config-reload", daemon=True).start()
+
+def _stop_on_signal(signum, frame):
+    """SIGTERM/SIGINT: перестаем принимать обновления и начинать посты; остальное делает graceful_shutdown"""
+    global _shutdown_deadline
+    if _shutdown_deadline is not None:
+        # Повторный сигнал - не ждем зависшие отправки
+        logger.warning("Повторный сигнал, немедленный выход")
+        os._exit(1)
+    timeout = ((app_settings.get("shutdown") if app_settings else None) or {}).get("timeout", 30)
+    _shutdown_deadline = monotonic() + timeout
+    logger.info("Получен сигнал %s, остановка (до %ss)...", signal.Signals(signum).name, timeout, extra={"event": "shutdown"})
+    scheduler.stopping.set()
+    bot.stop_polling()
+
+def _handlers_idle():
+    pool = getattr(bot, "worker_pool", None)
+    return metrics.HANDLERS_IN_FLIGHT.value() <= 0 and (pool is None or pool.tasks.empty())
+
+def graceful_shutdown(config, scheduler_thread=None, supervisor=None, deadline=None):
+    """Дожидается обработчиков и текущих постов, затем сбрасывает данные и состояние планировщика"""
+    started = perf_counter()
+    deadline = deadline or _shutdown_deadline or monotonic() + (config.get("shutdown") or {}).get("timeout", 30)
+    
+    def remaining():
+        return max(0.0, deadline - monotonic())
+    
+    scheduler.stopping.set()
+    bot.stop_polling()
+    
+    # Обновления, уже полученные от Telegram: загрузки файлов и шаги диалогов
+    idle_checks = 0
+    while idle_checks < 2 and remaining() > 0:
+        idle_checks = idle_checks + 1 if _handlers_idle() else 0
+        sleep(0.1)
+    if idle_checks < 2:
+        logger.warning("Не дождались обработчиков: %d", metrics.HANDLERS_IN_FLIGHT.value(), extra={"event": "shutdown"})
+    try:
+        # Подтверждаем обработанные обновления, чтобы после запуска они не пришли снова
+        bot.get_updates(offset=bot.last_update_id + 1, limit=1, timeout=5, long_polling_timeout=0)
+    except Exception as e:
+        logger.warning("Не удалось подтвердить обновления: %s", e)
+    
+    for thread in list(_background_jobs):
+        thread.join(remaining())
+    if media_processor.drain(remaining()):
+        media_processor.shutdown()
+    else:
+        logger.warning("Предобработка медиа не завершилась до остановки", extra={"event": "shutdown"})
+        media_processor.shutdown(wait=False)
+    
+    # Текущая отправка поста завершается, новые не начинаются
+    if scheduler_thread is not None:
+        scheduler_thread.join(remaining())
+        if scheduler_thread.is_alive():
+            logger.warning("Планировщик не завершил отправку до остановки", extra={"event": "shutdown"})
+    if supervisor is not None:
+        supervisor.stop(remaining())
+    
+    bot_data.stop_write_behind()
+    bot_data.flush()
+    state_file = config["storage"].get("scheduler_state")
+    if state_file:
+        scheduler.save_state(state_file)
+    logger.info(
+        "Бот остановлен за %.1fs", perf_counter() - started,
+        extra={"event": "shutdown", "duration": round(perf_counter() - started, 3)}
+    )
+    logsetup.stop_logging()
 
-# Инициализация
-bot_data = BotData()
-bot = telebot.TeleBot(TOKEN)
+SCHEDULE_HELP = (
+    "Пришлите расписание: по одной записи на строку или через ';' (простое время можно через запятую).\n"
+    "Примеры:\n"
+    "10:00, 15:00, 20:00\n"
+    "пн-пт 09:30\n"
+    "каждые 2ч 09:00-21:00\n"
+    "cron: 0 9,18 * * 1-5"
+)
 
-# Запуск планировщика
-threading.Thread(
-    target=run_scheduler,
-    args=(bot, bot_data),
-    daemon=True
-).start()
+CAPTION_HELP = (
+    "Пришлите текст для постов. Можно использовать переменные:\n"
+    "{name} - название канала, {date} или {date:%d.%m} - дата, {time} - время по расписанию,\n"
+    "{weekday}, {month} - день недели и месяц, {number} - номер поста, {remaining} - осталось в очереди,\n"
+    "{type}, {width}, {height}, {duration} - данные файла,\n"
+    "{rotate:#a|#b|#c} - варианты по очереди, {random:#a|#b} - случайный вариант.\n"
+    "Фигурные скобки в тексте пишутся двойными: {{ и }}"
+)
 
 def create_main_keyboard(user_id):
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -450,10 +1190,11 @@ def create_main_keyboard(user_id):
         keyboard.add("📤 Добавить медиа")
     
     if bot_data.has_permission(user_id, "admin"):
-        keyboard.add("👥 Управление пользователями")
+        keyboard.add("👥 Управление пользователями", "🗂 Очередь")
     
     if bot_data.has_permission(user_id, "owner"):
-        keyboard.add("📺 Управление каналами")
+        keyboard.add("📺 Управление каналами", "📈 Метрики")
+        keyboard.add("📜 История постов", "🔬 Профилировать")
     
     keyboard.add("📊 Статус", "❓ Помощь")
     return keyboard
@@ -492,22 +1233,38 @@ def create_owner_keyboard():
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add("➕ Добавить канал", "📋 Список каналов")
     keyboard.add("✏️ Редактировать канал", "🗑️ Удалить канал")
+    keyboard.add("📥 Импорт медиа", "🔄 Перечитать конфиг")
     keyboard.add("🔙 Назад")
     return keyboard
 
 def create_edit_channel_keyboard():
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add("📝 Изменить название", "📝 Изменить текст")
-    keyboard.add("⏰ Изменить время", "🔙 Назад")
+    keyboard.add("⏰ Изменить время", "🌍 Изменить часовой пояс")
+    keyboard.add("🔙 Назад")
     return keyboard
 
+def create_queue_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.add("➡️ По порядку", "🔀 Перемешать", "🔁 Чередовать источники")
+    keyboard.add("🔙 Назад")
+    return keyboard
+
+QUEUE_HELP = (
+    "Команды (номер - позиция в списке выше):\n"
+    "/bump N - в срочные\n"
+    "/move N urgent|normal|filler [top|bottom] - в другую полосу\n"
+    "/move N top|bottom - в начало или конец своей полосы\n"
+    "/remove N - убрать из очереди и удалить файл"
+)
+
 def create_moderator_management_keyboard():
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
     keyboard.add("➕ Добавить канал модератору", "➖ Удалить канал у модератора")
     keyboard.add("📋 Показать каналы модератора", "🔙 Назад")
     return keyboard
 
-@bot.message_handler(commands=["start"])
+@message_handler(commands=["start"])
 def start(message):
     user_id = message.from_user.id
     role = bot_data.get_user_role(user_id)
@@ -520,7 +1277,7 @@ def start(message):
         reply_markup=create_main_keyboard(user_id)
     )
 
-@bot.message_handler(func=lambda message: message.text == "❓ Помощь")
+@message_handler(func=lambda message: message.text == "❓ Помощь")
 def help_command(message):
     user_id = message.from_user.id
     role = bot_data.get_user_role(user_id)
@@ -534,7 +1291,12 @@ def help_command(message):
 📊 Статус - информация о доступных каналах и расписании
 
 {f"👥 Управление пользователями - добавление/удаление модераторов и администраторов, назначение каналов" if bot_data.has_permission(user_id, "admin") else ""}
-{f"📺 Управление каналами - добавление/редактирование/удаление каналов" if bot_data.has_permission(user_id, "owner") else ""}
+{f"🗂 Очередь - срочные и заполнители, перемешивание и чередование источников (/bump, /move, /remove)" if bot_data.has_permission(user_id, "admin") else ""}
+{f"📺 Управление каналами - добавление/редактирование/удаление каналов, импорт медиа с сервера, перечитывание config.yml" if bot_data.has_permission(user_id, "owner") else ""}
+{f"📈 Метрики - задержки обработчиков, записи на диск, очереди и вызовы API" if bot_data.has_permission(user_id, "owner") else ""}
+{f"📜 История постов - задержка p50/p95, доля сбоев и медленные часы по каналам" if bot_data.has_permission(user_id, "owner") else ""}
+{f"🔬 Профилировать (/profile N) - стеки всех потоков за N секунд и самые горячие функции" if bot_data.has_permission(user_id, "owner") else ""}
+{f"💾 /export - резервная копия пользователей, каналов, очередей и истории; /import - загрузка копии" if bot_data.has_permission(user_id, "owner") else ""}
 
 Система доступа:
 • Владелец и Администраторы: доступ ко всем каналам
@@ -543,22 +1305,194 @@ def help_command(message):
     
     bot.send_message(message.chat.id, help_text)
 
-@bot.message_handler(func=lambda message: message.text == "📊 Статус")
+@message_handler(func=lambda message: message.text == "📊 Статус")
 def status(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "moderator"):
         bot.reply_to(message, "⛔ Недостаточно прав")
         return
     
-    scheduler = PostScheduler(bot, bot_data)
-    status_text = scheduler.get_schedule_info(user_id)
+    send_view(message, "status")
+
+# Минимальная роль для постраничных представлений
+VIEW_ROLES = {"status": "moderator", "channels": "owner", "users": "admin", "history": "owner"}
+
+def send_view(message, view):
+    text, keyboard = paged_views.render(view, message.from_user.id)
+    bot.reply_to(message, text, reply_markup=keyboard)
+
+@callback_handler(func=lambda call: views.parse_callback(call.data) is not None)
+def view_page(call):
+    view, page = views.parse_callback(call.data)
+    if not bot_data.has_permission(call.from_user.id, VIEW_ROLES[view]):
+        bot.answer_callback_query(call.id, "⛔ Недостаточно прав")
+        return
+    
+    text, keyboard = paged_views.render(view, call.from_user.id, page)
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+    except apihelper.ApiTelegramException as e:
+        # Повторное нажатие на текущую страницу не меняет текст
+        if "message is not modified" not in str(e):
+            raise
+    bot.answer_callback_query(call.id)
+
+@message_handler(func=lambda message: message.text == "📜 История постов")
+def show_history(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    send_view(message, "history")
+
+@message_handler(func=lambda message: message.text == "📈 Метрики")
+def show_metrics(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    bot.reply_to(message, metrics.summary()[:4000])
+
+def start_profile(chat_id, seconds=None):
+    """Профилирует процесс в фоновом потоке и присылает стеки и сводку в chat_id"""
+    profiler_config = (app_settings.get("profiler") if app_settings else None) or {}
+    seconds = seconds or profiler_config.get("seconds", 30)
+    interval = profiler_config.get("interval_ms", 10) / 1000
+    
+    def run():
+        try:
+            profile = profiler.sample(seconds, interval)
+            document = io.BytesIO(profile.collapsed().encode("utf-8"))
+            document.name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed.txt"
+            bot.send_document(chat_id, document, caption="🔬 Стеки для flamegraph.pl или speedscope.app")
+            bot.send_message(chat_id, profile.summary()[:4000])
+        except profiler.ProfilerBusy as e:
+            bot.send_message(chat_id, f"⏳ {e}")
+        except Exception as e:
+            logger.error("Ошибка профилирования: %s", e, extra={"event": "profile"})
+        finally:
+            _background_jobs.discard(threading.current_thread())
+    
+    thread = threading.Thread(target=run, name="profiler", daemon=True)
+    _background_jobs.add(thread)
+    thread.start()
+    return seconds
+
+def _profile_on_signal(signum, frame):
+    logger.info("SIGUSR1: профилирование, отчет придет владельцу", extra={"event": "profile"})
+    start_profile(bot_data.admin_id)
+
+@message_handler(func=lambda message: message.text == "🔬 Профилировать" or (message.text or "").split()[:1] == ["/profile"])
+def profile_command(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    if profiler.running():
+        bot.reply_to(message, "⏳ Профилирование уже запущено")
+        return
+    
+    # /profile 60 - длительность в секундах
+    args = message.text.split()[1:] if message.text.startswith("/profile") else []
+    seconds = None
+    if args:
+        if not args[0].isdigit() or not 1 <= int(args[0]) <= 600:
+            bot.reply_to(message, "❌ Длительность - число секунд от 1 до 600: /profile 30")
+            return
+        seconds = int(args[0])
+    
+    seconds = start_profile(message.chat.id, seconds)
+    bot.reply_to(message, f"🔬 Профилирование {seconds}s запущено, отчет придет сюда")
+
+# Bot API принимает от ботов документы до 50 МБ и отдает им файлы до 20 МБ
+UPLOAD_LIMIT = 50 * 1024 * 1024
+DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+def _backup_dir():
+    folder = ((app_settings.get("backup") if app_settings else None) or {}).get("dir", "backups")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+@message_handler(func=lambda message: (message.text or "").split()[:1] == ["/export"])
+def export_command(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    bot.reply_to(message, "⏳ Снимаю резервную копию...")
     
-    if status_text:
-        bot.reply_to(message, status_text)
+    def run():
+        try:
+            report = backup.export_state(bot_data, backup.default_path(_backup_dir()), scheduler.history)
+            text = backup.format_export(report) + f"\nНа сервере: {report['path']}"
+            if report["bytes"] <= UPLOAD_LIMIT:
+                with open(report["path"], "rb") as f:
+                    bot.send_document(message.chat.id, f, caption=text)
+            else:
+                bot.reply_to(message, text)
+        except Exception as e:
+            logger.error("Ошибка резервного копирования: %s", e, extra={"event": "backup"})
+            bot.reply_to(message, f"❌ Ошибка резервного копирования: {e}")
+        finally:
+            _background_jobs.discard(threading.current_thread())
+    
+    thread = threading.Thread(target=run, name="export", daemon=True)
+    _background_jobs.add(thread)
+    thread.start()
+
+@message_handler(
+    content_types=["text", "document"],
+    func=lambda message: (message.text or message.caption or "").split()[:1] == ["/import"]
+)
+def import_command(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    document = message.document if message.content_type == "document" else None
+    if document is not None:
+        if document.file_size and document.file_size > DOWNLOAD_LIMIT:
+            bot.reply_to(message, "❌ Файл больше 20 МБ - положите его на сервер и пришлите /import путь")
+            return
+        # Имя по file_unique_id: повторно присланный файл продолжит прерванный импорт
+        path = os.path.join(_backup_dir(), f"import-{document.file_unique_id}.jsonl.gz")
     else:
-        bot.reply_to(message, "❌ Нет доступных каналов для просмотра")
+        args = message.text.split(maxsplit=1)[1:]
+        if not args:
+            bot.reply_to(message, "Пришлите файл копии с подписью /import или путь на сервере: /import /srv/backups/backup.jsonl.gz")
+            return
+        path = args[0].strip()
+        if not os.path.exists(path):
+            bot.reply_to(message, f"❌ {path} не существует")
+            return
+    
+    bot.reply_to(message, "⏳ Загружаю резервную копию...")
+    
+    # Скачивание, применение записей и сохранения не должны держать поток обработчиков
+    def run():
+        try:
+            if document is not None and not os.path.exists(path):
+                downloaded = bot.download_file(bot.get_file(document.file_id).file_path)
+                atomic_write(path, downloaded)
+            report = backup.import_state(bot_data, path, scheduler.history)
+            bot.reply_to(message, backup.format_import(report))
+        except backup.BackupError as e:
+            bot.reply_to(message, f"❌ {e}\nПовторите /import с тем же файлом - загрузка продолжится с последней отметки")
+        except Exception as e:
+            logger.error("Ошибка загрузки резервной копии: %s", e, extra={"event": "backup"})
+            bot.reply_to(message, f"❌ Ошибка загрузки копии: {e}")
+        finally:
+            _background_jobs.discard(threading.current_thread())
+    
+    thread = threading.Thread(target=run, name="import", daemon=True)
+    _background_jobs.add(thread)
+    thread.start()
 
-@bot.message_handler(func=lambda message: message.text == "📤 Добавить медиа")
+@message_handler(func=lambda message: message.text == "📤 Добавить медиа")
 def add_media_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "moderator"):
@@ -576,7 +1510,7 @@ def add_media_start(message):
         reply_markup=create_channels_keyboard(user_id)
     )
 
-@bot.message_handler(func=lambda message: message.text.startswith("📺") and message.text != "📺 Управление каналами")
+@message_handler(content_types=["text"], func=lambda message: message.text.startswith("📺") and message.text != "📺 Управление каналами")
 def select_channel(message):
     user_id = message.from_user.id
     channel_name = message.text[2:].strip()
@@ -606,6 +1540,14 @@ def select_channel(message):
             )
             bot_data.user_sessions[user_id]["current_channel"] = channel_id
         
+        elif session_state == "manage_queue":
+            bot_data.user_sessions[user_id]["current_channel"] = channel_id
+            bot.send_message(
+                message.chat.id,
+                views.queue_preview(bot_data.channels[channel_id]) + "\n\n" + QUEUE_HELP,
+                reply_markup=create_queue_keyboard()
+            )
+        
         elif session_state == "add_channel_to_moderator":
             target_user_id = bot_data.user_sessions[user_id].get("target_user_id")
             if target_user_id and bot_data.add_channel_access(target_user_id, channel_id):
@@ -631,7 +1573,7 @@ def select_channel(message):
             reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("✅ Завершить загрузку")
         )
 
-@bot.message_handler(func=lambda message: message.text == "✅ Завершить загрузку")
+@message_handler(func=lambda message: message.text == "✅ Завершить загрузку")
 def finish_upload(message):
     user_id = message.from_user.id
     
@@ -639,6 +1581,10 @@ def finish_upload(message):
         bot.reply_to(message, "❌ Нет активной сессии загрузки")
         return
     
+    if media_processor.pending(user_id):
+        bot.send_message(message.chat.id, "⏳ Дожидаюсь обработки загруженных файлов...")
+        media_processor.wait(user_id)
+    
     added_count = bot_data.finish_adding_session(user_id)
     
     bot.send_message(
@@ -647,7 +1593,7 @@ def finish_upload(message):
         reply_markup=create_main_keyboard(user_id)
     )
 
-@bot.message_handler(content_types=["photo", "video"])
+@message_handler(content_types=["photo", "video"])
 def handle_media(message):
     user_id = message.from_user.id
     
@@ -676,9 +1622,11 @@ def handle_media(message):
             file_type = "video"
             ext = "mp4"
         
-        downloaded = bot.download_file(file_info.file_path)
+        with metrics.TRANSFER_SECONDS.time(direction="download"):
+            downloaded = bot.download_file(file_info.file_path)
+        metrics.TRANSFER_BYTES.inc(len(downloaded), direction="download")
         
-        media_folder = bot_data.channels[channel_id]["media_folder"]
+        media_folder = bot_data.ensure_media_folder(channel_id)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         file_path = os.path.join(media_folder, f"{file_type}_{timestamp}_{file_info.file_id}.{ext}")
         
@@ -686,6 +1634,12 @@ def handle_media(message):
             f.write(downloaded)
         
         bot_data.add_temp_file(user_id, file_path, file_type)
+        logger.info(
+            "Загружен файл %s (%d байт)", file_path, len(downloaded),
+            extra={"channel_id": channel_id, "event": "media_upload"}
+        )
+        if media_processor.enabled:
+            submit_preprocessing(message, user_id, file_path, file_type)
         
         temp_count = len(session["temp_files"])
         bot.reply_to(message, f"✅ {file_type.capitalize()} добавлено (временное). Всего в сессии: {temp_count}")
@@ -693,7 +1647,25 @@ def handle_media(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка при добавлении: {e}")
 
-@bot.message_handler(func=lambda message: message.text == "👥 Управление пользователями")
+def submit_preprocessing(message, user_id, file_path, file_type):
+    """Отправляет файл сессии на предобработку; отклоненный файл убирается из сессии"""
+    def on_done(result, error):
+        if error is not None:
+            metrics.MEDIA_REJECTED.inc(type=file_type)
+            bot_data.discard_temp_file(user_id, file_path)
+            logger.warning("Файл %s отклонен: %s", file_path, error, extra={"user_id": user_id, "event": "media_rejected"})
+            bot.reply_to(message, f"❌ Файл отклонен: {error}")
+            return
+        metrics.PREPROCESS_SECONDS.observe(result.pop("seconds"), type=file_type)
+        metrics.MEDIA_BYTES_SAVED.inc(max(0, result.pop("original_size") - result["size"]), type=file_type)
+        new_path = result.pop("path")
+        if new_path != file_path:
+            result["path"] = new_path
+        bot_data.update_temp_file(user_id, file_path, **result)
+    
+    media_processor.submit(user_id, file_path, file_type, on_done)
+
+@message_handler(func=lambda message: message.text == "👥 Управление пользователями")
 def manage_users(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -706,7 +1678,7 @@ def manage_users(message):
         reply_markup=create_admin_keyboard()
     )
 
-@bot.message_handler(func=lambda message: message.text == "➕ Добавить модератора")
+@message_handler(func=lambda message: message.text == "➕ Добавить модератора")
 def add_moderator_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -716,6 +1688,7 @@ def add_moderator_start(message):
     msg = bot.reply_to(message, "Пришлите user_id пользователя для добавления модератором:")
     bot.register_next_step_handler(msg, add_moderator_finish)
 
+@metrics.timed_handler
 def add_moderator_finish(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -729,7 +1702,7 @@ def add_moderator_finish(message):
     except ValueError:
         bot.reply_to(message, "❌ Неверный user_id")
 
-@bot.message_handler(func=lambda message: message.text == "➕ Добавить администратора")
+@message_handler(func=lambda message: message.text == "➕ Добавить администратора")
 def add_admin_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -739,6 +1712,7 @@ def add_admin_start(message):
     msg = bot.reply_to(message, "Пришлите user_id пользователя для добавления администратором:")
     bot.register_next_step_handler(msg, add_admin_finish)
 
+@metrics.timed_handler
 def add_admin_finish(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -752,7 +1726,7 @@ def add_admin_finish(message):
     except ValueError:
         bot.reply_to(message, "❌ Неверный user_id")
 
-@bot.message_handler(func=lambda message: message.text == "🔧 Назначить каналы модератору")
+@message_handler(func=lambda message: message.text == "🔧 Назначить каналы модератору")
 def manage_moderator_channels_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -762,6 +1736,7 @@ def manage_moderator_channels_start(message):
     msg = bot.reply_to(message, "Пришлите user_id модератора для управления каналами:")
     bot.register_next_step_handler(msg, select_moderator_for_channels)
 
+@metrics.timed_handler
 def select_moderator_for_channels(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -789,7 +1764,7 @@ def select_moderator_for_channels(message):
     except ValueError:
         bot.reply_to(message, "❌ Неверный user_id")
 
-@bot.message_handler(func=lambda message: message.text == "➕ Добавить канал модератору")
+@message_handler(func=lambda message: message.text == "➕ Добавить канал модератору")
 def add_channel_to_moderator(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "manage_moderator_channels":
@@ -803,7 +1778,7 @@ def add_channel_to_moderator(message):
         reply_markup=create_all_channels_keyboard()
     )
 
-@bot.message_handler(func=lambda message: message.text == "➖ Удалить канал у модератора")
+@message_handler(func=lambda message: message.text == "➖ Удалить канал у модератора")
 def remove_channel_from_moderator(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "manage_moderator_channels":
@@ -835,7 +1810,7 @@ def remove_channel_from_moderator(message):
         reply_markup=keyboard
     )
 
-@bot.message_handler(func=lambda message: message.text == "📋 Показать каналы модератора")
+@message_handler(func=lambda message: message.text == "📋 Показать каналы модератора")
 def show_moderator_channels(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "manage_moderator_channels":
@@ -863,7 +1838,7 @@ def show_moderator_channels(message):
     
     bot.reply_to(message, text)
 
-@bot.message_handler(func=lambda message: message.text == "🗑️ Удалить пользователя")
+@message_handler(func=lambda message: message.text == "🗑️ Удалить пользователя")
 def remove_user_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -873,6 +1848,7 @@ def remove_user_start(message):
     msg = bot.reply_to(message, "Пришлите user_id пользователя для удаления из роли (нельзя удалить владельца):")
     bot.register_next_step_handler(msg, remove_user_finish)
 
+@metrics.timed_handler
 def remove_user_finish(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "admin"):
@@ -880,7 +1856,7 @@ def remove_user_finish(message):
     
     try:
         remove_id = int(message.text)
-        if remove_id == ADMIN_ID:
+        if remove_id == bot_data.admin_id:
             bot.reply_to(message, "❌ Нельзя удалить владельца бота")
             return
         
@@ -892,7 +1868,7 @@ def remove_user_finish(message):
     except ValueError:
         bot.reply_to(message, "❌ Неверный user_id")
 
-@bot.message_handler(func=lambda message: message.text == "📺 Управление каналами")
+@message_handler(func=lambda message: message.text == "📺 Управление каналами")
 def manage_channels(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -905,7 +1881,80 @@ def manage_channels(message):
         reply_markup=create_owner_keyboard()
     )
 
-@bot.message_handler(func=lambda message: message.text == "➕ Добавить канал")
+@message_handler(func=lambda message: message.text == "🗂 Очередь")
+def manage_queue_start(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "admin"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    bot_data.user_sessions[user_id] = {
+        "state": "manage_queue",
+        "current_channel": None
+    }
+    bot.send_message(
+        message.chat.id,
+        "Выберите канал, очередь которого нужно изменить:",
+        reply_markup=create_channels_keyboard(user_id)
+    )
+
+def _queue_channel(message):
+    """Канал из сессии управления очередью (None, если очередь не выбрана или нет прав)"""
+    user_id = message.from_user.id
+    session = bot_data.user_sessions.get(user_id)
+    if not bot_data.has_permission(user_id, "admin"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return None
+    if not session or session["state"] != "manage_queue" or session.get("current_channel") not in bot_data.channels:
+        bot.reply_to(message, "❌ Сначала выберите канал: 🗂 Очередь")
+        return None
+    if not bot_data.has_channel_access(user_id, session["current_channel"]):
+        bot.reply_to(message, "❌ Канал не найден или нет доступа")
+        return None
+    return session["current_channel"]
+
+QUEUE_POLICIES = {"➡️ По порядку": "fifo", "🔀 Перемешать": "shuffle", "🔁 Чередовать источники": "interleave"}
+
+@message_handler(func=lambda message: message.text in QUEUE_POLICIES)
+def set_queue_policy(message):
+    channel_id = _queue_channel(message)
+    if channel_id is None:
+        return
+    bot_data.set_queue_policy(channel_id, QUEUE_POLICIES[message.text])
+    bot.reply_to(message, views.queue_preview(bot_data.channels[channel_id]))
+
+@message_handler(commands=["bump", "move", "remove"])
+def edit_queue_item(message):
+    channel_id = _queue_channel(message)
+    if channel_id is None:
+        return
+    command, *args = message.text.split()
+    command = command.lstrip("/").split("@", 1)[0]
+    try:
+        if not args or not args[0].isdigit():
+            raise mediaqueue.QueueError("Укажите номер медиа из списка")
+        position = int(args[0])
+        if command == "bump":
+            item = bot_data.bump_queue_item(channel_id, position)
+        elif command == "remove":
+            item = bot_data.remove_queue_item(channel_id, position)
+        else:
+            options = [arg.lower() for arg in args[1:]]
+            lane = next((arg for arg in options if arg in mediaqueue.LANES), None)
+            where = next((arg for arg in options if arg in ("top", "bottom")), "bottom")
+            if set(options) - set(mediaqueue.LANES) - {"top", "bottom"} or not options:
+                raise mediaqueue.QueueError("Формат: /move N urgent|normal|filler [top|bottom]")
+            item = bot_data.move_queue_item(channel_id, position, lane, where)
+    except mediaqueue.QueueError as e:
+        bot.reply_to(message, f"❌ {e}")
+        return
+    verb = {"bump": "поднято в срочные", "move": "перенесено", "remove": "удалено"}[command]
+    bot.reply_to(
+        message,
+        f"✅ {os.path.basename(item['path'])} {verb}\n\n" + views.queue_preview(bot_data.channels[channel_id])
+    )
+
+@message_handler(func=lambda message: message.text == "➕ Добавить канал")
 def add_channel_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -915,6 +1964,7 @@ def add_channel_start(message):
     msg = bot.reply_to(message, "Пришлите ID канала (например: -1001234567890):")
     bot.register_next_step_handler(msg, add_channel_step2)
 
+@metrics.timed_handler
 def add_channel_step2(message):
     try:
         channel_id = int(message.text)
@@ -923,29 +1973,106 @@ def add_channel_step2(message):
     except ValueError:
         bot.reply_to(message, "❌ Неверный ID канала. Должен быть числом (например: -1001234567890)")
 
+@metrics.timed_handler
 def add_channel_step3(message, channel_id):
     channel_name = message.text
-    msg = bot.reply_to(message, "Пришлите текст для постов:")
+    msg = bot.reply_to(message, CAPTION_HELP)
     bot.register_next_step_handler(msg, add_channel_step4, channel_id, channel_name)
 
+@metrics.timed_handler
 def add_channel_step4(message, channel_id, channel_name):
     post_text = message.text
-    msg = bot.reply_to(message, "Пришлите время постов через запятую (например: 10:00, 15:00, 20:00):")
+    try:
+        captions.compile_caption(post_text, name=channel_name)
+    except captions.CaptionError as e:
+        msg = bot.reply_to(message, f"❌ Ошибка в тексте: {e}\nПришлите исправленный текст:")
+        bot.register_next_step_handler(msg, add_channel_step4, channel_id, channel_name)
+        return
+    msg = bot.reply_to(message, SCHEDULE_HELP)
     bot.register_next_step_handler(msg, add_channel_finish, channel_id, channel_name, post_text)
 
+@metrics.timed_handler
 def add_channel_finish(message, channel_id, channel_name, post_text):
     try:
-        times = [time.strip() for time in message.text.split(",")]
-        for t in times:
-            if not t.replace(':', '').isdigit() or len(t.split(':')) != 2:
-                raise ValueError(f"Неверный формат времени: {t}")
+        times = schedule.split_specs(message.text)
+        schedule.compile_schedule(times, scheduler.default_timezone)
         
         bot_data.add_channel(channel_id, channel_name, post_text, times)
-        bot.reply_to(message, f"✅ Канал '{channel_name}' успешно добавлен!\nID: {channel_id}\nТекст: {post_text}\nВремя: {', '.join(times)}")
+        bot.reply_to(message, f"✅ Канал '{channel_name}' успешно добавлен!\nID: {channel_id}\nТекст: {post_text}\nВремя: {'; '.join(times)}")
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка при добавлении канала: {e}")
 
-@bot.message_handler(func=lambda message: message.text == "✏️ Редактировать канал")
+@message_handler(func=lambda message: message.text == "📥 Импорт медиа")
+def import_media_start(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    msg = bot.reply_to(
+        message,
+        "Пришлите ID канала и путь к каталогу или архиву zip/tar на сервере через пробел:\n"
+        "-1001234567890 /srv/media/pack.zip"
+    )
+    bot.register_next_step_handler(msg, import_media_finish)
+
+@metrics.timed_handler
+def import_media_finish(message):
+    try:
+        channel_text, source = message.text.strip().split(maxsplit=1)
+        channel_id = int(channel_text)
+    except (ValueError, AttributeError):
+        bot.reply_to(message, "❌ Неверный формат. Пример: -1001234567890 /srv/media/pack.zip")
+        return
+    
+    if channel_id not in bot_data.channels:
+        bot.reply_to(message, "❌ Канал не найден")
+        return
+    if not os.path.exists(source):
+        bot.reply_to(message, f"❌ {source} не существует")
+        return
+    
+    bot.reply_to(message, f"⏳ Импорт в канал '{bot_data.channels[channel_id]['name']}' запущен...")
+    
+    # Импорт тысяч файлов занимает минуты - не держим поток обработчиков
+    def run_import():
+        try:
+            report = importer.import_media(bot_data, channel_id, source, processor=media_processor)
+            bot.reply_to(message, importer.format_report(report))
+        except Exception as e:
+            logger.error("Ошибка импорта в канал %s: %s", channel_id, e, extra={"channel_id": channel_id})
+            bot.reply_to(message, f"❌ Ошибка импорта: {e}")
+        finally:
+            _background_jobs.discard(threading.current_thread())
+    
+    thread = threading.Thread(target=run_import, name="import", daemon=True)
+    _background_jobs.add(thread)
+    thread.start()
+
+@message_handler(func=lambda message: message.text == "🔄 Перечитать конфиг")
+def reload_config_command(message):
+    user_id = message.from_user.id
+    if not bot_data.has_permission(user_id, "owner"):
+        bot.reply_to(message, "⛔ Недостаточно прав")
+        return
+    
+    try:
+        changed, restart = reload_config()
+    except settings.ConfigError as e:
+        bot.reply_to(message, f"❌ Конфигурация не применена, работает прежняя:\n{e}")
+        return
+    
+    if not changed and not restart:
+        bot.reply_to(message, "ℹ️ config.yml не изменился")
+        return
+    text = "✅ Конфигурация перечитана"
+    if changed:
+        text += "\nПрименено: " + ", ".join(sorted(changed))
+    if restart:
+        text += "\n⚠️ Требуют перезапуска: " + ", ".join(restart)
+    bot.reply_to(message, text)
+
+@message_handler(func=lambda message: message.text == "✏️ Редактировать канал")
 def edit_channel_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -968,7 +2095,7 @@ def edit_channel_start(message):
         reply_markup=create_all_channels_keyboard()
     )
 
-@bot.message_handler(func=lambda message: message.text == "📝 Изменить название")
+@message_handler(func=lambda message: message.text == "📝 Изменить название")
 def edit_channel_name(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "edit_channel":
@@ -981,14 +2108,21 @@ def edit_channel_name(message):
     msg = bot.reply_to(message, "Пришлите новое название канала:")
     bot.register_next_step_handler(msg, edit_channel_name_finish, channel_id)
 
+@metrics.timed_handler
 def edit_channel_name_finish(message, channel_id):
     new_name = message.text
-    if bot_data.update_channel(channel_id, name=new_name):
+    try:
+        updated = bot_data.update_channel(channel_id, name=new_name)
+    except captions.CaptionError as e:
+        # Название входит в подпись через {name} и может не уложиться в лимит
+        bot.reply_to(message, f"❌ Название не подходит к тексту постов: {e}")
+        return
+    if updated:
         bot.reply_to(message, f"✅ Название канала изменено на: {new_name}")
     else:
         bot.reply_to(message, "❌ Ошибка при изменении названия")
 
-@bot.message_handler(func=lambda message: message.text == "📝 Изменить текст")
+@message_handler(func=lambda message: message.text == "📝 Изменить текст")
 def edit_channel_text(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "edit_channel":
@@ -998,17 +2132,24 @@ def edit_channel_text(message):
     if not channel_id:
         return
     
-    msg = bot.reply_to(message, "Пришлите новый текст для постов:")
+    msg = bot.reply_to(message, CAPTION_HELP)
     bot.register_next_step_handler(msg, edit_channel_text_finish, channel_id)
 
+@metrics.timed_handler
 def edit_channel_text_finish(message, channel_id):
     new_text = message.text
-    if bot_data.update_channel(channel_id, post_text=new_text):
-        bot.reply_to(message, f"✅ Текст постов изменен")
+    try:
+        updated = bot_data.update_channel(channel_id, post_text=new_text)
+    except captions.CaptionError as e:
+        bot.reply_to(message, f"❌ Ошибка в тексте: {e}")
+        return
+    if updated:
+        compiled = bot_data.caption(channel_id)
+        bot.reply_to(message, f"✅ Текст постов изменен (до {compiled.max_length} из {captions.CAPTION_LIMIT} символов)")
     else:
         bot.reply_to(message, "❌ Ошибка при изменении текста")
 
-@bot.message_handler(func=lambda message: message.text == "⏰ Изменить время")
+@message_handler(func=lambda message: message.text == "⏰ Изменить время")
 def edit_channel_time(message):
     user_id = message.from_user.id
     if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "edit_channel":
@@ -1018,24 +2159,59 @@ def edit_channel_time(message):
     if not channel_id:
         return
     
-    msg = bot.reply_to(message, "Пришлите новое время постов через запятую (например: 10:00, 15:00, 20:00):")
+    msg = bot.reply_to(message, SCHEDULE_HELP)
     bot.register_next_step_handler(msg, edit_channel_time_finish, channel_id)
 
+@metrics.timed_handler
 def edit_channel_time_finish(message, channel_id):
     try:
-        times = [time.strip() for time in message.text.split(",")]
-        for t in times:
-            if not t.replace(':', '').isdigit() or len(t.split(':')) != 2:
-                raise ValueError(f"Неверный формат времени: {t}")
+        times = schedule.split_specs(message.text)
+        schedule.compile_schedule(times, scheduler.channel_timezone(channel_id))
         
         if bot_data.update_channel(channel_id, post_times=times):
-            bot.reply_to(message, f"✅ Время постов изменено на: {', '.join(times)}")
+            bot.reply_to(message, f"✅ Время постов изменено на: {'; '.join(times)}")
         else:
             bot.reply_to(message, "❌ Ошибка при изменении времени")
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка: {e}")
 
-@bot.message_handler(func=lambda message: message.text == "🗑️ Удалить канал")
+@message_handler(func=lambda message: message.text == "🌍 Изменить часовой пояс")
+def edit_channel_timezone(message):
+    user_id = message.from_user.id
+    if user_id not in bot_data.user_sessions or bot_data.user_sessions[user_id]["state"] != "edit_channel":
+        return
+    
+    channel_id = bot_data.user_sessions[user_id]["current_channel"]
+    if not channel_id:
+        return
+    
+    current = schedule.timezone_label(scheduler.channel_timezone(channel_id))
+    msg = bot.reply_to(
+        message,
+        f"Текущий часовой пояс: {current}\n"
+        "Пришлите часовой пояс IANA (например: Europe/Moscow) или смещение (UTC+3). "
+        "'-' - использовать пояс из конфига:"
+    )
+    bot.register_next_step_handler(msg, edit_channel_timezone_finish, channel_id)
+
+@metrics.timed_handler
+def edit_channel_timezone_finish(message, channel_id):
+    name = message.text.strip()
+    try:
+        if name == "-":
+            name = None
+        else:
+            schedule.compile_schedule(bot_data.channels[channel_id]["post_times"], schedule.get_timezone(name))
+        
+        if bot_data.update_channel(channel_id, timezone=name):
+            label = name or schedule.timezone_label(scheduler.default_timezone)
+            bot.reply_to(message, f"✅ Часовой пояс канала: {label}")
+        else:
+            bot.reply_to(message, "❌ Ошибка при изменении часового пояса")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {e}")
+
+@message_handler(func=lambda message: message.text == "🗑️ Удалить канал")
 def delete_channel_start(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -1058,7 +2234,7 @@ def delete_channel_start(message):
         reply_markup=keyboard
     )
 
-@bot.message_handler(func=lambda message: message.text.startswith("🗑️") and not message.text.startswith("🗑️ Удалить"))
+@message_handler(content_types=["text"], func=lambda message: message.text.startswith("🗑️") and not message.text.startswith("🗑️ Удалить"))
 def delete_channel_execute(message):
     user_id = message.from_user.id
     if not bot_data.has_permission(user_id, "owner"):
@@ -1083,7 +2259,7 @@ def delete_channel_execute(message):
     else:
         bot.reply_to(message, "❌ Ошибка при удалении канала")
 
-@bot.message_handler(func=lambda message: message.text in ["🔙 Назад", "📋 Список каналов", "📊 Список пользователей"])
+@message_handler(func=lambda message: message.text in ["🔙 Назад", "📋 Список каналов", "📊 Список пользователей"])
 def handle_back_and_lists(message):
     user_id = message.from_user.id
     
@@ -1122,37 +2298,93 @@ def handle_back_and_lists(message):
         if not bot_data.has_permission(user_id, "owner"):
             return
         
-        if not bot_data.channels:
-            bot.reply_to(message, "❌ Нет добавленных каналов")
-            return
-        
-        channels_list = "📋 Список всех каналов:\n\n"
-        for channel_id, channel_data in bot_data.channels.items():
-            channels_list += f"📺 {channel_data['name']}\n"
-            channels_list += f"   ID: {channel_id}\n"
-            channels_list += f"   Очередь: {len(channel_data['media_queue'])} медиа\n"
-            channels_list += f"   Время постов: {', '.join(channel_data['post_times'])}\n\n"
-        
-        bot.reply_to(message, channels_list)
+        send_view(message, "channels")
     
     elif message.text == "📊 Список пользователей":
         if not bot_data.has_permission(user_id, "admin"):
             return
         
-        users_list = "👥 Список пользователей:\n\n"
-        for uid, user_data in bot_data.users.items():
-            role_icon = "👑" if user_data['role'] == "owner" else "🛡️" if user_data['role'] == "admin" else "🛠️"
-            role_text = user_data['role']
-            
-            # Добавляем информацию о каналах для модераторов
-            if user_data['role'] == "moderator":
-                channel_count = len(user_data.get("channels", []))
-                role_text += f" ({channel_count} каналов)"
-            
-            users_list += f"{role_icon} {uid}: {role_text}\n"
+        send_view(message, "users")
+
+def main():
+    global app_settings
+    try:
+        app_settings = settings.Settings()
+    except Exception as e:
+        logger.error("Ошибка загрузки конфига: %s", e)
+        exit()
+    config = app_settings.data
+    
+    logsetup.setup_logging(config.get("logging"))
+    create_app(config)
+    state_file = config["storage"].get("scheduler_state")
+    if state_file and scheduler.load_state(state_file):
+        logger.info("Теплый старт: состояние планировщика восстановлено из %s", state_file)
+    bot_data.start_write_behind(config["storage"].get("flush_interval", 3))
+    app_settings.on_reload(
+        lambda old, new, changed: reconfigure_components(new, changed, scheduler, media_processor, bot_data, health_monitor)
+    )
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _reload_on_signal)
+    signal.signal(signal.SIGTERM, _stop_on_signal)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _profile_on_signal)
+    signal.signal(signal.SIGINT, _stop_on_signal)
+    
+    supervisor = None
+    scheduler_thread = None
+    sharding_config = config.get("sharding") or {}
+    if sharding_config.get("workers", 0) > 0:
+        # Каналы распределяются между процессами-воркерами, здесь остается только интерфейс
+        from sharding import ShardSupervisor
+        supervisor = ShardSupervisor(config, bot_data)
+        app_settings.on_reload(supervisor.reconfigure)
+        health_monitor.supervisor = supervisor
+        threading.Thread(
+            target=supervisor.run,
+            daemon=True
+        ).start()
+    else:
+        def start_scheduler():
+            # Поток демонический, чтобы зависшая отправка не держала процесс дольше таймаута остановки
+            thread = threading.Thread(
+                target=run_scheduler,
+                args=(scheduler,),
+                name="scheduler",
+                daemon=True
+            )
+            thread.start()
+            return thread
         
-        bot.reply_to(message, users_list)
+        health_monitor.start_scheduler = start_scheduler
+        health_monitor.scheduler_thread = start_scheduler()
+    
+    metrics_config = config.get("metrics") or {}
+    health_config = config.get("health") or {}
+    routes = health_monitor.routes() if health_config.get("enabled", True) else None
+    if metrics_config.get("enabled", True) or routes:
+        host, port = metrics_config.get("host", "127.0.0.1"), metrics_config.get("port", 9090)
+        registry = metrics.REGISTRY if metrics_config.get("enabled", True) else None
+        metrics.start_http_server(host, port, registry, routes)
+        logger.info(
+            "HTTP-эндпоинты на http://%s:%s: %s", host, port,
+            ", ".join((["/metrics"] if registry is not None else []) + sorted(routes or {}))
+        )
+    if health_config.get("enabled", True):
+        health_monitor.start()
+    capture_config = config.get("capture") or {}
+    update_recorder = None
+    if capture_config.get("file"):
+        update_recorder = recorder.capture_updates(
+            bot, capture_config["file"], config["telegram"]["admin_id"], capture_config.get("salt")
+        )
+    logger.info("Бот запущен...")
+    bot.infinity_polling()
+    health_monitor.stop()
+    if update_recorder is not None:
+        update_recorder.close()
+    # После перезапуска сторожем текущий поток цикла - уже не тот, что был запущен первым
+    graceful_shutdown(app_settings.data, scheduler_thread=health_monitor.scheduler_thread, supervisor=supervisor)
 
 if __name__ == "__main__":
-    logger.info("Бот запущен...")
-    bot.infinity_polling()
\ No newline at end of file
+    main()
@@ -0,0 +1,186 @@
+"""Шаблоны подписей к постам: разбор, компиляция и подстановка.
+
+Текст постов канала может содержать переменные в фигурных скобках:
+    {name}                 название канала
+    {date}, {date:%d.%m}   дата поста (по умолчанию 19.10.2026) или формат strftime
+    {time}                 время слота расписания (10:00)
+    {weekday}, {month}     день недели и месяц по-русски (понедельник, октября)
+    {number}, {remaining}  порядковый номер поста в канале и остаток очереди
+    {type}                 фото или видео
+    {width}, {height}, {duration}  размеры и длительность файла (пусто, если неизвестны)
+    {rotate:#a|#b|#c}      варианты по очереди, по номеру поста
+    {random:#a|#b|#c}      случайный вариант
+Фигурная скобка в тексте записывается двойной: {{ и }}.
+
+Шаблон компилируется один раз при сохранении текста в список готовых
+кусков и функций подстановки; при отправке остается только склеить строку.
+Наибольшая возможная длина подписи считается при компиляции, и шаблон,
+который может не уложиться в лимит Telegram, отклоняется сразу.
+"""
+import random
+import re
+from datetime import datetime, timedelta
+
+# Лимит подписи к фото и видео в Telegram (в UTF-16, как считает Bot API)
+CAPTION_LIMIT = 1024
+# Ширина, под которую резервируются числовые переменные
+NUMBER_WIDTH = 7
+
+WEEKDAY_NAMES = ("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье")
+MONTH_NAMES = (
+    "января", "февраля", "марта", "апреля", "мая", "июня",
+    "июля", "августа", "сентября", "октября", "ноября", "декабря",
+)
+TYPE_NAMES = {"photo": "фото", "video": "видео"}
+
+_TOKEN_RE = re.compile(r"\{\{|\}\}|\{([^{}]*)\}|[{}]")
+
+
+class CaptionError(ValueError):
+    pass
+
+
+def caption_length(text):
+    """Длина подписи так, как ее считает Telegram: в кодовых единицах UTF-16"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _number(key):
+    def render(context):
+        value = context.get(key)
+        return "" if value is None else str(value)
+    return render
+
+
+def _item_number(key):
+    def render(context):
+        value = (context.get("item") or {}).get(key)
+        return "" if value is None else str(int(value))
+    return render
+
+
+def _date_format(fmt):
+    def render(context):
+        return context["local"].strftime(fmt)
+    return render
+
+
+def _max_date_length(fmt):
+    # Дни високосного года с разными часами покрывают все названия дней и месяцев
+    day = datetime(2024, 1, 1, 0, 0)
+    longest = 0
+    for offset in range(366):
+        moment = day + timedelta(days=offset, hours=offset % 24, minutes=59)
+        longest = max(longest, caption_length(moment.strftime(fmt)))
+    return longest
+
+
+def _options(argument, name):
+    options = argument.split("|") if argument else []
+    if len(options) < 2:
+        raise CaptionError(f"{{{name}:...}}: нужно хотя бы два варианта через |")
+    return options
+
+
+# Переменные без аргумента: (функция подстановки, наибольшая длина)
+_VARIABLES = {
+    "date": (lambda context: context["local"].strftime("%d.%m.%Y"), 10),
+    "time": (lambda context: context["local"].strftime("%H:%M"), 5),
+    "weekday": (lambda context: WEEKDAY_NAMES[context["local"].weekday()], max(map(len, WEEKDAY_NAMES))),
+    "month": (lambda context: MONTH_NAMES[context["local"].month - 1], max(map(len, MONTH_NAMES))),
+    "number": (_number("number"), NUMBER_WIDTH),
+    "remaining": (_number("remaining"), NUMBER_WIDTH),
+    "type": (lambda context: TYPE_NAMES.get((context.get("item") or {}).get("type"), ""), max(map(len, TYPE_NAMES.values()))),
+    "width": (_item_number("width"), 5),
+    "height": (_item_number("height"), 5),
+    "duration": (_item_number("duration"), 5),
+}
+
+
+def _compile_variable(expression, static):
+    name, _, argument = expression.partition(":")
+    name = name.strip().lower()
+    if name in static and not argument:
+        return str(static[name]), None
+    if name in _VARIABLES and not argument:
+        return _VARIABLES[name]
+    if name == "date" and argument:
+        return _date_format(argument), _max_date_length(argument)
+    if name == "rotate":
+        options = _options(argument, name)
+        return (
+            lambda context: options[((context.get("number") or 1) - 1) % len(options)],
+            max(map(caption_length, options)),
+        )
+    if name == "random":
+        options = _options(argument, name)
+        return lambda context: random.choice(options), max(map(caption_length, options))
+    raise CaptionError(f"Неизвестная переменная: {{{expression}}}")
+
+
+class CompiledCaption:
+    def __init__(self, source, parts, max_length):
+        self.source = source
+        self.parts = tuple(parts)  # строки и функции подстановки вперемешку
+        self.max_length = max_length
+        # Шаблон без переменных подставляется без склейки
+        self.constant = parts[0] if len(parts) == 1 and isinstance(parts[0], str) else ("" if not parts else None)
+
+    def render(self, context):
+        """Подпись к посту; context: local (время слота), number, remaining, item"""
+        if self.constant is not None:
+            return self.constant
+        text = "".join(part if isinstance(part, str) else part(context) for part in self.parts)
+        # Числа длиннее зарезервированной ширины - единственный способ выйти за лимит
+        if caption_length(text) > CAPTION_LIMIT:
+            text = text.encode("utf-16-le")[:CAPTION_LIMIT * 2].decode("utf-16-le", "ignore")
+        return text
+
+
+def literal(text):
+    """Текст без разбора переменных (старые подписи, которые не компилируются)"""
+    return CompiledCaption(text, [text] if text else [], caption_length(text))
+
+
+def compile_caption(text, **static):
+    """Проверяет и компилирует шаблон подписи.
+
+    static - значения, известные при компиляции (name=название канала); они
+    вклеиваются в текст сразу. Бросает CaptionError при ошибке в шаблоне
+    или если подпись может оказаться длиннее CAPTION_LIMIT.
+    """
+    text = text or ""
+    parts = []
+    max_length = 0
+    position = 0
+    for match in _TOKEN_RE.finditer(text):
+        parts.append(text[position:match.start()])
+        position = match.end()
+        token = match.group(0)
+        if token in ("{{", "}}"):
+            parts.append(token[0])
+        elif match.group(1) is not None:
+            part, length = _compile_variable(match.group(1), static)
+            parts.append(part)
+            max_length += length or 0
+        else:
+            raise CaptionError(f"Непарная фигурная скобка в позиции {match.start() + 1} (для самой скобки пишите {token * 2})")
+    parts.append(text[position:])
+
+    # Соседние куски текста склеиваются заранее, при отправке остаются только подстановки
+    merged = []
+    for part in parts:
+        if not isinstance(part, str):
+            merged.append(part)
+        elif part:
+            max_length += caption_length(part)
+            if merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            else:
+                merged.append(part)
+
+    if max_length > CAPTION_LIMIT:
+        raise CaptionError(
+            f"Подпись может занять до {max_length} символов, Telegram допускает {CAPTION_LIMIT}"
+        )
+    return CompiledCaption(text, merged, max_length)
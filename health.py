@@ -0,0 +1,269 @@
+"""Живость и готовность бота: пульс планировщика и опроса, запись данных, очереди.
+
+Планировщик отмечает пульс на каждом проходе и перед каждым каналом, опрос -
+после каждого ответа getUpdates (он приходит и без новых сообщений, раз в
+long polling timeout). HTTP-эндпоинты на адресе метрик:
+    /health  200, если все пульсы свежие и данные пишутся, иначе 503 -
+             для liveness-проверки оркестратора
+    /ready   200, когда данные загружены, опрос запущен и бот не
+             останавливается - для readiness-проверки
+Сторож раз в check_interval секунд сверяет те же показатели: зависший цикл
+планировщика запускается заново (в шардах - перезапускается воркер), а
+владелец получает сообщение о проблеме и о ее исчезновении.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "scheduler_timeout": 600,
+    "polling_timeout": 180,
+    "check_interval": 30,
+    "restart_scheduler": True,
+    "alert_owner": True,
+}
+
+PROBLEM_TITLES = {
+    "polling": "опрос Telegram не отвечает",
+    "scheduler": "планировщик не отмечался",
+    "storage": "не удается записать файл данных",
+}
+
+
+class Heartbeat:
+    """Момент последнего пульса; до первого пульса возраст считается от создания"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last = None
+
+    def beat(self):
+        self.last = time.monotonic()
+
+    def seen(self):
+        return self.last is not None
+
+    def age(self):
+        return time.monotonic() - (self.last if self.last is not None else self.started)
+
+
+def watch_polling(bot, heartbeat):
+    """Отмечает пульс после каждого ответа getUpdates, включая пустые"""
+    process = bot.process_new_updates
+
+    def process_new_updates(updates):
+        heartbeat.beat()
+        return process(updates)
+
+    bot.process_new_updates = process_new_updates
+    return heartbeat
+
+
+class HealthMonitor:
+    def __init__(self, bot, bot_data, scheduler, processor=None, supervisor=None, config=None):
+        self.bot = bot
+        self.bot_data = bot_data
+        self.scheduler = scheduler
+        self.processor = processor
+        self.supervisor = supervisor  # sharding.ShardSupervisor: планировщики живут в воркерах
+        self.start_scheduler = None  # запускает новый поток цикла планировщика и возвращает его
+        self.scheduler_thread = None
+        self.polling = watch_polling(bot, Heartbeat())
+        self.started = time.monotonic()
+        self.restarts = 0
+        self.active = set()  # проблемы, о которых владелец уже знает
+        self._stop = threading.Event()
+        self.reconfigure(config)
+
+    def reconfigure(self, config):
+        self.config = {**DEFAULTS, **(config or {})}
+
+    # --- показатели ---
+
+    def scheduler_age(self):
+        """Секунды с последнего пульса планировщика; в шардах - самого давнего из воркеров"""
+        if self.supervisor is not None:
+            return max(self.supervisor.worker_ages().values(), default=0.0)
+        return self.scheduler.heartbeat.age()
+
+    def scheduler_status(self):
+        timeout = self.config["scheduler_timeout"]
+        if self.supervisor is not None:
+            ages = self.supervisor.worker_ages()
+            return {
+                "ok": all(age <= timeout for age in ages.values()),
+                "workers": {str(worker): round(age, 1) for worker, age in sorted(ages.items())},
+                "restarts": self.restarts,
+            }
+        age = self.scheduler.heartbeat.age()
+        sending = self.scheduler.sending
+        return {
+            "ok": age <= timeout,
+            "heartbeat_age": round(age, 1),
+            "sending": sending[0] if sending else None,
+            "restarts": self.restarts,
+        }
+
+    def polling_status(self):
+        age = self.polling.age()
+        return {
+            "ok": age <= self.config["polling_timeout"],
+            "started": self.polling.seen(),
+            "last_poll_age": round(age, 1),
+            "message_lag": round(metrics.POLLING_LAG.value(), 3),
+        }
+
+    def storage_status(self):
+        status = {
+            "ok": self.bot_data.write_error is None,
+            "last_write_age": round(time.monotonic() - self.bot_data.last_write, 1) if self.bot_data.last_write else None,
+            "error": self.bot_data.write_error,
+        }
+        try:
+            folder = os.path.dirname(os.path.abspath(self.bot_data.data_file))
+            status["free_bytes"] = shutil.disk_usage(folder).free
+        except OSError:
+            pass
+        return status
+
+    def queue_status(self):
+        now = self.scheduler.clock()
+        pool = getattr(self.bot, "worker_pool", None)
+        return {
+            # Срабатывания, время которых наступило, а пост еще не ушел
+            "due_posts": sum(
+                1 for plan in list(self.scheduler.plans.values())
+                if plan.get("planned") is not None and plan["planned"] <= now
+            ),
+            "handlers": pool.tasks.qsize() if pool is not None else 0,
+            "handlers_in_flight": int(metrics.HANDLERS_IN_FLIGHT.value()),
+            "media_processing": self.processor.total_pending() if self.processor is not None else 0,
+        }
+
+    def report(self):
+        checks = {
+            "polling": self.polling_status(),
+            "scheduler": self.scheduler_status(),
+            "storage": self.storage_status(),
+        }
+        problems = sorted(name for name, check in checks.items() if not check["ok"])
+        ready = (
+            self.bot_data._loaded and self.polling.seen()
+            and checks["storage"]["ok"] and not self.scheduler.stopping.is_set()
+        )
+        return {
+            "status": "fail" if problems else "ok",
+            "ready": bool(ready),
+            "problems": problems,
+            "uptime": round(time.monotonic() - self.started, 1),
+            **checks,
+            "queues": self.queue_status(),
+        }
+
+    def routes(self):
+        """Маршруты для metrics.start_http_server"""
+        def respond(field):
+            def route():
+                report = self.report()
+                ok = not report["problems"] if field == "health" else report["ready"]
+                return (200 if ok else 503), "application/json", json.dumps(report, ensure_ascii=False).encode("utf-8")
+            return route
+        return {"/health": respond("health"), "/ready": respond("ready")}
+
+    # --- сторож ---
+
+    def restart_scheduler(self):
+        """Запускает новый цикл планировщика; возвращает зависшую отправку (channel_id, occurrence, planned) или None.
+        
+        Зависший поток выйдет сам, когда вернется из вызова, и запишет в историю настоящий исход своего слота."""
+        scheduler = self.scheduler
+        sending = scheduler.sending
+        if sending is not None:
+            channel_id, occurrence, planned = sending
+            # Пост мог уйти: повторная отправка слота дала бы дубль в канале
+            scheduler.mark_sent(channel_id, occurrence.date_key, occurrence.label)
+        # Ни один поток не владеет циклом, пока новый не отметится в run_scheduler
+        scheduler.active_loop = 0
+        self.scheduler_thread = self.start_scheduler()
+        self.restarts += 1
+        metrics.WATCHDOG_RESTARTS.inc(target="scheduler")
+        return sending
+
+    def check(self):
+        """Один проход сторожа; возвращает отчет"""
+        report = self.report()
+        restarted = []
+        if "scheduler" in report["problems"] and self.config["restart_scheduler"]:
+            if self.supervisor is not None:
+                for worker, age in report["scheduler"]["workers"].items():
+                    if age > self.config["scheduler_timeout"] and self.supervisor.restart_worker(int(worker)):
+                        restarted.append(f"воркер {worker}")
+                        self.restarts += 1
+                        metrics.WATCHDOG_RESTARTS.inc(target="worker")
+            elif self.start_scheduler is not None:
+                sending = self.restart_scheduler()
+                if sending is not None:
+                    channel_id, occurrence, planned = sending
+                    restarted.append(
+                        f"планировщик (пост в {channel_id} по расписанию {occurrence.label} завис при отправке: "
+                        f"вышел ли он, неизвестно, слот не повторяется)"
+                    )
+                else:
+                    restarted.append("планировщик")
+
+        problems = set(report["problems"])
+        for name in sorted(problems - self.active):
+            logger.error("Проверка здоровья: %s", PROBLEM_TITLES[name], extra={"event": "health"})
+        for name in sorted(self.active - problems):
+            logger.info("Проверка здоровья: восстановлено - %s", name, extra={"event": "health"})
+        text = self.alert_text(problems - self.active, self.active - problems, restarted, report)
+        self.active = problems
+        if text and self.config["alert_owner"]:
+            try:
+                self.bot.send_message(self.bot_data.admin_id, text)
+            except Exception as e:
+                logger.warning("Не удалось отправить оповещение владельцу: %s", e)
+        return report
+
+    @staticmethod
+    def alert_text(new, resolved, restarted, report):
+        lines = []
+        for name in sorted(new):
+            details = report[name]
+            if name == "scheduler" and "heartbeat_age" in details:
+                lines.append(f"🚨 {PROBLEM_TITLES[name]} {details['heartbeat_age']:.0f}s")
+            elif name == "polling":
+                lines.append(f"🚨 {PROBLEM_TITLES[name]} {details['last_poll_age']:.0f}s")
+            elif name == "storage":
+                lines.append(f"🚨 {PROBLEM_TITLES[name]}: {details['error']}")
+            else:
+                lines.append(f"🚨 {PROBLEM_TITLES[name]}")
+        if restarted:
+            lines.append("🔁 Перезапущено: " + ", ".join(restarted))
+        for name in sorted(resolved):
+            lines.append(f"✅ Восстановлено: {PROBLEM_TITLES[name]}")
+        return "\n".join(lines)
+
+    def run(self):
+        while not self._stop.wait(self.config["check_interval"]):
+            if self.scheduler.stopping.is_set():
+                break
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Ошибка проверки здоровья: %s", e)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="watchdog", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
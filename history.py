@@ -0,0 +1,141 @@
+"""История постов: ограниченный кольцевой буфер с записью на диск.
+
+Каждая попытка поста (отправлен, ошибка, пустая очередь, пропущен) - одна
+строка JSON в файле истории. В памяти держатся последние capacity записей;
+файл только дописывается, а когда в нем набирается вдвое больше строк,
+он атомарно переписывается последними capacity записями - так и память,
+и диск ограничены. Воркеры шардов пишут каждый в свой файл (path.workerN),
+сводка для владельца объединяет их при просмотре.
+"""
+import glob
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ("sent", "failed", "empty", "missed")
+
+
+def percentile(sorted_values, q):
+    """Квантиль по ближайшему рангу из отсортированного списка (None для пустого)"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _read_lines(path, capacity):
+    entries = deque(maxlen=capacity)
+    lines = 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Оборванная последняя строка после сбоя - пропускаем
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries, lines
+
+
+class PostHistory:
+    def __init__(self, path, capacity=10000):
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries, self._file_lines = _read_lines(path, capacity)
+        self.version = 0  # растет с каждой записью; по ней кэшируется сводка
+
+    def record(self, entry):
+        """Добавляет запись в буфер и дописывает ее в файл"""
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._entries.append(entry)
+            self.version += 1
+            try:
+                if self._file_lines >= 2 * self.capacity:
+                    self._compact()
+                else:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                    self._file_lines += 1
+            except OSError as e:
+                logger.error("Не удалось записать историю постов %s: %s", self.path, e)
+
+    def _compact(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        os.replace(temp_path, self.path)
+        self._file_lines = len(self._entries)
+
+    def entries(self, include_workers=True):
+        """Записи по времени; при include_workers добавляются файлы воркеров шардов"""
+        with self._lock:
+            result = list(self._entries)
+        if include_workers:
+            for path in sorted(glob.glob(glob.escape(self.path) + ".worker*")):
+                if path.endswith(".tmp"):
+                    continue
+                result.extend(_read_lines(path, self.capacity)[0])
+            result.sort(key=lambda entry: entry.get("planned") or "")
+        return result
+
+    def worker_files_version(self):
+        """Изменение файлов воркеров тоже должно сбрасывать кэш сводки"""
+        stamps = []
+        for path in glob.glob(glob.escape(self.path) + ".worker*"):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stamps.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(stamps))
+
+
+def create_history(config, suffix=""):
+    """История из storage.history_file (None, если она отключена)"""
+    storage = config["storage"]
+    if not storage.get("history_file"):
+        return None
+    return PostHistory(storage["history_file"] + suffix, storage.get("history_size", 10000))
+
+
+def channel_stats(entries):
+    """Сводка по каналам: число попыток, доли ошибок, квантили задержки, медленные часы"""
+    stats = {}
+    for entry in entries:
+        channel = stats.setdefault(entry["channel_id"], {
+            "total": 0, "outcomes": dict.fromkeys(OUTCOMES, 0), "delays": [], "by_hour": {},
+            "upload": [], "bytes": 0,
+        })
+        channel["total"] += 1
+        outcome = entry.get("outcome", "sent")
+        channel["outcomes"][outcome] = channel["outcomes"].get(outcome, 0) + 1
+        if outcome != "sent":
+            continue
+        delay = entry.get("delay")
+        if delay is not None:
+            channel["delays"].append(delay)
+            hour = (entry.get("slot") or "00:00")[:2]
+            channel["by_hour"].setdefault(hour, []).append(delay)
+        if entry.get("upload_seconds") is not None:
+            channel["upload"].append(entry["upload_seconds"])
+        channel["bytes"] += entry.get("bytes") or 0
+
+    for channel in stats.values():
+        channel["delays"].sort()
+        channel["upload"].sort()
+        for delays in channel["by_hour"].values():
+            delays.sort()
+        failures = channel["total"] - channel["outcomes"]["sent"]
+        channel["failure_rate"] = failures / channel["total"] if channel["total"] else 0.0
+    return stats
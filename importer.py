@@ -0,0 +1,248 @@
+"""Массовый импорт медиа в очередь канала из каталога или архива (zip/tar).
+
+Файлы копируются в папку канала с одновременным подсчетом SHA-256 в пуле
+потоков, тип определяется по расширению через mimetypes. Дубликаты внутри
+импорта и уже известные каналу файлы пропускаются, очередь пополняется
+одной записью файла данных.
+
+Из командной строки (при остановленном боте - иначе он перезапишет файл данных):
+    python importer.py -1001234567890 /srv/media/pack.zip
+    python importer.py -1001234567890 /srv/media/folder --workers 8
+Во время работы бота владелец запускает импорт кнопкой "📥 Импорт медиа".
+"""
+import argparse
+import hashlib
+import logging
+import mimetypes
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MediaImportError(ValueError):
+    pass
+
+
+def detect_type(name):
+    """photo/video по расширению файла или None, если файл не подходит"""
+    mime, _ = mimetypes.guess_type(name)
+    if not mime:
+        return None
+    if mime.startswith("image/") and mime != "image/gif":
+        return "photo"
+    if mime.startswith("video/"):
+        return "video"
+    return None
+
+
+def _is_hidden(name):
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return any(part.startswith(".") or part == "__MACOSX" for part in parts)
+
+
+def _ingest(name, opener, folder):
+    """Копирует файл во временный файл папки канала, попутно считая хэш"""
+    file_type = detect_type(name)
+    if file_type is None:
+        return None
+    temp_path = os.path.join(folder, f".import_{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with opener() as source, open(temp_path, "wb") as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                target.write(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    ext = os.path.splitext(name)[1].lower() or mimetypes.guess_extension(mimetypes.guess_type(name)[0]) or ""
+    return {"name": name, "type": file_type, "sha256": digest.hexdigest(), "size": size, "temp": temp_path, "ext": ext}
+
+
+def _scan(source, folder, workers):
+    """Возвращает (результаты копирования, число пропущенных файлов)"""
+    if os.path.isdir(source):
+        entries = []
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not _is_hidden(d))
+            for file in sorted(f for f in files if not _is_hidden(f)):
+                full_path = os.path.join(root, file)
+                entries.append((os.path.relpath(full_path, source), lambda p=full_path: open(p, "rb")))
+        return _ingest_parallel(entries, folder, workers)
+
+    if zipfile.is_zipfile(source):
+        # ZipFile не потокобезопасен: у каждого потока свой дескриптор архива
+        local = threading.local()
+        handles = []
+        handles_lock = threading.Lock()
+
+        def archive():
+            if not hasattr(local, "archive"):
+                local.archive = zipfile.ZipFile(source)
+                with handles_lock:
+                    handles.append(local.archive)
+            return local.archive
+
+        with zipfile.ZipFile(source) as listing:
+            names = sorted(info.filename for info in listing.infolist() if not info.is_dir())
+        entries = [(name, lambda n=name: archive().open(n)) for name in names if not _is_hidden(name)]
+        try:
+            results, skipped = _ingest_parallel(entries, folder, workers)
+        finally:
+            for handle in handles:
+                handle.close()
+        return results, skipped + len(names) - len(entries)
+
+    if tarfile.is_tarfile(source):
+        # Сжатый tar читается только последовательно, поэтому без пула
+        results, skipped = [], 0
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if not member.isfile() or _is_hidden(member.name):
+                    skipped += member.isfile()
+                    continue
+                result = _ingest(member.name, lambda m=member: archive.extractfile(m), folder)
+                if result is None:
+                    skipped += 1
+                else:
+                    results.append(result)
+        results.sort(key=lambda r: r["name"])
+        return results, skipped
+
+    raise MediaImportError(f"{source}: не каталог и не архив zip/tar")
+
+
+def _ingest_parallel(entries, folder, workers):
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(lambda entry: _ingest(entry[0], entry[1], folder), entries):
+                results.append(result)
+    except Exception:
+        for result in results:
+            if result is not None and os.path.exists(result["temp"]):
+                os.remove(result["temp"])
+        raise
+    return [r for r in results if r is not None], sum(1 for r in results if r is None)
+
+
+def _source_of(source, name):
+    """Источник для политики interleave: подпапка верхнего уровня или сам импорт"""
+    top, _, rest = name.replace("\\", "/").partition("/")
+    return f"import:{os.path.basename(os.path.normpath(source))}" + (f"/{top}" if rest else "")
+
+
+def import_media(bot_data, channel_id, source, workers=4, processor=None):
+    """Импортирует каталог или архив в очередь канала и возвращает отчет"""
+    if channel_id not in bot_data.channels:
+        raise MediaImportError(f"Канал {channel_id} не найден")
+    if not os.path.exists(source):
+        raise MediaImportError(f"{source} не существует")
+
+    started = time.perf_counter()
+    folder = bot_data.ensure_media_folder(channel_id)
+    results, skipped = _scan(source, folder, workers)
+
+    known = bot_data.channel_hashes(channel_id)
+    items = []
+    duplicates = 0
+    for result in results:
+        if result["sha256"] in known:
+            os.remove(result["temp"])
+            duplicates += 1
+            continue
+        known.add(result["sha256"])
+        path = os.path.join(folder, f"{result['type']}_{result['sha256'][:16]}{result['ext']}")
+        os.replace(result["temp"], path)
+        items.append({
+            "path": path, "type": result["type"], "sha256": result["sha256"], "size": result["size"],
+            "source": _source_of(source, result["name"]),
+        })
+
+    rejected = 0
+    if processor is not None and processor.enabled and items:
+        key = ("import", channel_id)
+        outcomes = {}
+
+        def record(path):
+            return lambda result, error: outcomes.__setitem__(path, (result, error))
+
+        for item in items:
+            processor.submit(key, item["path"], item["type"], record(item["path"]))
+        processor.wait(key)
+        accepted = []
+        for item in items:
+            result, error = outcomes.get(item["path"], (None, None))
+            if error is not None:
+                rejected += 1
+                logger.warning("Импорт: %s отклонен: %s", item["path"], error, extra={"channel_id": channel_id})
+                if os.path.exists(item["path"]):
+                    os.remove(item["path"])
+                continue
+            if result:
+                result.pop("seconds", None)
+                result.pop("original_size", None)
+                item.update(result)
+            accepted.append(item)
+        items = accepted
+
+    added = bot_data.add_files_to_channel(channel_id, items)
+    return {
+        "added": added,
+        "duplicates": duplicates,
+        "skipped": skipped,
+        "rejected": rejected,
+        "bytes": sum(item.get("size", 0) for item in items),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def format_report(report):
+    return (
+        f"✅ Импорт завершен за {report['seconds']:.1f}s\n"
+        f"Добавлено: {report['added']} ({report['bytes'] / 1048576:.1f} МБ)\n"
+        f"Дубликаты: {report['duplicates']}\n"
+        f"Пропущено (не фото/видео): {report['skipped']}\n"
+        f"Отклонено предобработкой: {report['rejected']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("channel_id", type=int)
+    parser.add_argument("source", help="Каталог или архив zip/tar")
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Потоков копирования и хэширования")
+    args = parser.parse_args()
+
+    import bot
+    import media
+
+    config = bot.load_config(args.config)
+    bot_data = bot.BotData(config["storage"]["data_file"], config["telegram"]["admin_id"])
+    processor = media.MediaProcessor(config.get("media"))
+    try:
+        report = import_media(bot_data, args.channel_id, args.source, workers=args.workers, processor=processor)
+    except MediaImportError as e:
+        raise SystemExit(f"❌ {e}")
+    finally:
+        processor.shutdown()
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
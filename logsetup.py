@@ -0,0 +1,158 @@
+"""Неблокирующее логирование: QueueHandler в вызывающих потоках, запись в QueueListener.
+
+Потоки планировщика и обработчиков только кладут запись в очередь, в
+stdout или файл пишет отдельный поток. Записи выводятся в JSON (или текстом)
+с полями контекста: channel_id, user_id, handler, duration, event, worker.
+Частые события (загрузка каждого файла, завершение обработчика) можно
+прореживать: sample: {media_upload: 10} оставляет каждую десятую запись.
+"""
+import atexit
+import contextlib
+import contextvars
+import copy
+import itertools
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+CONTEXT_FIELDS = ("channel_id", "user_id", "handler", "duration", "event", "worker")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+_queue_handler = None
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Добавляет поля ко всем записям внутри блока (в текущем потоке)"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля log_context в запись, не перезаписывая переданные через extra"""
+
+    def __init__(self, static=None):
+        super().__init__()
+        self.static = static or {}
+
+    def filter(self, record):
+        for key, value in {**self.static, **_context.get()}.items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Оставляет каждую N-ю запись события из sample; предупреждения и ошибки не прореживаются"""
+
+    def __init__(self, sample=None):
+        super().__init__()
+        self.sample = {event: max(1, int(every)) for event, every in (sample or {}).items()}
+        self._counters = {event: itertools.count() for event in self.sample}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event not in self.sample or record.levelno >= logging.WARNING:
+            return True
+        return next(self._counters[event]) % self.sample[event] == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """Не блокируется при переполнении очереди и сохраняет traceback отдельно от сообщения"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение форматируется здесь, пока аргументы не изменились, - но только если запись прошла фильтры
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(config=None, **static_fields):
+    """Переключает корневой логгер на очередь; повторный вызов перенастраивает конвейер"""
+    global _listener, _queue_handler
+    config = config or {}
+    stop_logging()
+
+    if config.get("format", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        # Постоянные поля (например, номер воркера) в текстовом формате идут префиксом
+        prefix = "".join(f"{key}-{value} - " for key, value in static_fields.items())
+        formatter = logging.Formatter(f"%(asctime)s - {prefix}%(name)s - %(levelname)s - %(message)s")
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if config.get("file"):
+        handlers.append(logging.FileHandler(config["file"], encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.get("queue_size", 10000))
+    _queue_handler = _QueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter(static_fields))
+    _queue_handler.addFilter(SamplingFilter(config.get("sample")))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    # Проверка конфига принимает уровень в любом регистре, logging - только в верхнем
+    root.setLevel(str(config.get("level", "INFO")).upper())
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Дописывает записи из очереди и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def dropped():
+    """Сколько записей отброшено из-за переполненной очереди"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,275 @@
+"""Предобработка медиа перед постановкой в очередь.
+
+Файлы проверяются и оптимизируются в пуле процессов, чтобы не занимать
+потоки обработчиков: фото перекодируются в JPEG с заданным качеством и
+уменьшаются до max_side, метаданные удаляются; видео проверяются через
+ffprobe и пересобираются ffmpeg без метаданных (если они установлены).
+Битые и неподходящие для Bot API файлы отклоняются еще при загрузке.
+
+Модуль не импортирует bot.py - он загружается в дочерних процессах.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow необязателен: без него фото только проверяются по сигнатуре
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Bot API на отправку
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_DIMENSIONS = 10000  # сумма ширины и высоты
+PHOTO_MAX_RATIO = 20
+UPLOAD_MAX_BYTES = 50 * 1024 * 1024
+
+_SIGNATURES = {
+    "photo": (
+        (0, b"\xff\xd8\xff"),  # JPEG
+        (0, b"\x89PNG\r\n\x1a\n"),
+        (8, b"WEBP"),
+    ),
+    "video": (
+        (4, b"ftyp"),  # MP4/MOV
+        (0, b"\x1a\x45\xdf\xa3"),  # Matroska/WebM
+    ),
+}
+
+
+class MediaError(ValueError):
+    pass
+
+
+def _check_signature(path, file_type):
+    with open(path, "rb") as f:
+        head = f.read(16)
+    for offset, signature in _SIGNATURES[file_type]:
+        if head[offset:offset + len(signature)] == signature:
+            return
+    raise MediaError("неизвестный или поврежденный формат файла")
+
+
+def _process_photo(path, options):
+    result = {}
+    if Image is None:
+        _check_signature(path, "photo")
+        return result
+
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        with Image.open(path) as image:
+            has_metadata = bool(image.info.get("exif") or image.info.get("icc_profile") or image.info.get("xmp"))
+            # Поворачиваем по EXIF до того, как метаданные будут удалены
+            image = ImageOps.exif_transpose(image)
+            resized = False
+            max_side = options.get("max_side")
+            if max_side and max(image.size) > max_side:
+                image.thumbnail((max_side, max_side), Image.LANCZOS)
+                resized = True
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            output = os.path.splitext(path)[0] + ".jpg"
+            temp_path = output + ".tmp"
+            image.save(
+                temp_path, "JPEG",
+                quality=options.get("jpeg_quality", 85), optimize=True, progressive=True
+            )
+            width, height = image.size
+    except MediaError:
+        raise
+    except Exception as e:
+        raise MediaError(f"не удалось прочитать изображение: {e}")
+
+    # Оставляем оригинал, только если перекодирование ничего не дало
+    if resized or has_metadata or output != path or os.path.getsize(temp_path) < os.path.getsize(path):
+        os.replace(temp_path, output)
+        if output != path:
+            os.remove(path)
+        result["path"] = output
+    else:
+        os.remove(temp_path)
+
+    if width + height > PHOTO_MAX_DIMENSIONS:
+        raise MediaError(f"слишком большое разрешение {width}x{height}")
+    if max(width, height) > PHOTO_MAX_RATIO * min(width, height):
+        raise MediaError(f"недопустимое соотношение сторон {width}x{height}")
+    result.update(width=width, height=height)
+    return result
+
+
+def _probe_video(path, ffprobe):
+    completed = subprocess.run(
+        [ffprobe, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, timeout=120
+    )
+    if completed.returncode != 0:
+        raise MediaError(f"ffprobe: {completed.stderr.decode(errors='replace').strip()[:200]}")
+    info = json.loads(completed.stdout or b"{}")
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    if video is None:
+        raise MediaError("в файле нет видеопотока")
+    result = {"width": int(video.get("width") or 0), "height": int(video.get("height") or 0)}
+    duration = (info.get("format") or {}).get("duration") or video.get("duration")
+    if duration:
+        result["duration"] = int(round(float(duration)))
+    return result
+
+
+def _process_video(path, options):
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        _check_signature(path, "video")
+        return {}
+
+    result = _probe_video(path, ffprobe)
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg and options.get("strip_video_metadata", True):
+        # Пересборка без перекодирования: удаляет метаданные и переносит индекс в начало файла
+        temp_path = path + ".tmp.mp4"
+        completed = subprocess.run(
+            [ffmpeg, "-v", "error", "-y", "-i", path, "-map", "0", "-map_metadata", "-1",
+             "-c", "copy", "-movflags", "+faststart", temp_path],
+            capture_output=True, timeout=600
+        )
+        if completed.returncode == 0 and os.path.getsize(temp_path) > 0:
+            os.replace(temp_path, path)
+        else:
+            logger.warning("ffmpeg не смог пересобрать %s: %s", path, completed.stderr.decode(errors="replace")[:200])
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return result
+
+
+def process_file(path, file_type, options):
+    """Проверяет и оптимизирует файл; выполняется в дочернем процессе.
+
+    Возвращает словарь с итоговым path, size и, если удалось определить,
+    width/height/duration. При непригодном файле бросает MediaError.
+    """
+    start = time.perf_counter()
+    original_size = os.path.getsize(path)
+    if original_size == 0:
+        raise MediaError("пустой файл")
+
+    if file_type == "photo":
+        result = _process_photo(path, options)
+    elif file_type == "video":
+        result = _process_video(path, options)
+    else:
+        raise MediaError(f"неподдерживаемый тип {file_type}")
+
+    path = result.setdefault("path", path)
+    size = os.path.getsize(path)
+    limit = PHOTO_MAX_BYTES if file_type == "photo" else UPLOAD_MAX_BYTES
+    if size > limit:
+        raise MediaError(f"файл больше {limit // (1024 * 1024)} МБ")
+    result["size"] = size
+    result["original_size"] = original_size
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class MediaProcessor:
+    """Пул процессов предобработки и учет незавершенных задач по ключу (пользователю)"""
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.workers = config.get("workers", 2)
+        self.reconfigure(config)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending = {}
+
+    def reconfigure(self, config):
+        """Параметры обработки из конфига; число процессов меняется только перезапуском"""
+        config = config or {}
+        self.enabled = config.get("preprocess", False)
+        # Словарь заменяется целиком: уже отправленные задачи сохранят свои параметры
+        self.options = {
+            "max_side": config.get("max_side", 2560),
+            "jpeg_quality": config.get("jpeg_quality", 85),
+            "strip_video_metadata": config.get("strip_video_metadata", True),
+        }
+
+    @property
+    def executor(self):
+        # Процессы поднимаются при первой задаче, а не при запуске бота
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def submit(self, key, path, file_type, callback):
+        """Ставит файл в обработку; callback(result, error) вызывается по завершении"""
+        try:
+            future = self.executor.submit(process_file, path, file_type, self.options)
+        except BrokenProcessPool:
+            # Дочерний процесс упал (например, на вредоносном файле) - поднимаем пул заново
+            self.reset()
+            future = self.executor.submit(process_file, path, file_type, self.options)
+        with self._cond:
+            self._pending[key] = self._pending.get(key, 0) + 1
+
+        def done(future):
+            try:
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                callback(result, error)
+            except Exception as e:
+                logger.error("Ошибка обработки результата предобработки %s: %s", path, e)
+            finally:
+                with self._cond:
+                    self._pending[key] -= 1
+                    if not self._pending[key]:
+                        del self._pending[key]
+                    self._cond.notify_all()
+
+        future.add_done_callback(done)
+        return future
+
+    def pending(self, key):
+        with self._cond:
+            return self._pending.get(key, 0)
+
+    def total_pending(self):
+        with self._cond:
+            return sum(self._pending.values())
+
+    def wait(self, key, timeout=None):
+        """Ждет завершения всех задач ключа вместе с их обратными вызовами"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(key), timeout)
+
+    def drain(self, timeout=None):
+        """Ждет завершения всех задач; False, если не успели за timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
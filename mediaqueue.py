@@ -0,0 +1,263 @@
+"""Очередь медиа канала с полосами приоритета.
+
+Каждое медиа лежит в одной из полос: urgent (срочное), normal (обычное) или
+filler (заполнитель - уходит, только когда две другие пусты). Полоса - это
+двоичная куча по рангу, поэтому взять следующее медиа, добавить, поднять,
+перенести или убрать элемент стоит O(log n), без перезаписи всей очереди.
+Удаление ленивое: запись остается в куче, пока не окажется наверху, а
+когда таких записей набирается больше живых, кучи перестраиваются.
+
+Куда в полосе встает новое медиа, задает политика канала:
+    fifo        в конец, по времени добавления
+    shuffle     в случайное место полосы
+    interleave  по очереди из разных источников (модератор, папка импорта)
+Смена политики один раз переставляет уже стоящие в очереди медиа.
+
+Очередь меняют несколько потоков (планировщик, обработчики, импорт), поэтому
+изменения и снятие удаленных записей с куч идут под блокировкой очереди.
+"""
+import heapq
+import random
+import threading
+
+LANES = ("urgent", "normal", "filler")
+POLICIES = ("fifo", "shuffle", "interleave")
+DEFAULT_LANE = "normal"
+
+LANE_TITLES = {"urgent": "срочные", "normal": "обычные", "filler": "заполнители"}
+LANE_ICONS = {"urgent": "🔥", "normal": "📦", "filler": "🧩"}
+POLICY_TITLES = {"fifo": "по порядку", "shuffle": "вперемешку", "interleave": "чередуя источники"}
+
+
+class QueueError(ValueError):
+    pass
+
+
+def _check_lane(lane):
+    if lane not in LANES:
+        raise QueueError(f"Неизвестная полоса: {lane} (есть {', '.join(LANES)})")
+    return lane
+
+
+class MediaQueue:
+    """Очередь медиа канала; элементы - словари с ключом path, как раньше в списке media_queue"""
+
+    def __init__(self, items=(), policy="fifo"):
+        if policy not in POLICIES:
+            raise QueueError(f"Неизвестная политика: {policy}")
+        self.policy = policy
+        self._heaps = {lane: [] for lane in LANES}  # [ранг, номер, элемент, полоса]
+        self._entries = {}  # {path: запись из кучи}; запись, которой здесь нет, удалена
+        self._counts = dict.fromkeys(LANES, 0)
+        self._seq = 0
+        self._high = dict.fromkeys(LANES, -1)  # наибольший выданный ранг полосы
+        self._source_rank = {}  # {(полоса, источник): ранг последнего медиа источника}
+        self._stale = 0
+        self._lock = threading.RLock()
+        for item in items:
+            self.append(item)
+
+    def __getstate__(self):
+        # Очередь хранится в pickle файла данных: сохраняется ее согласованная копия, блокировка создается заново
+        with self._lock:
+            state = dict(self.__dict__)
+            state["_heaps"] = {lane: list(heap) for lane, heap in self._heaps.items()}
+            state["_entries"] = dict(self._entries)
+            for key in ("_counts", "_high", "_source_rank"):
+                state[key] = dict(state[key])
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __iter__(self):
+        return self.ordered()
+
+    def __repr__(self):
+        return f"MediaQueue({len(self)} items, policy={self.policy!r})"
+
+    def _push(self, item, lane, rank):
+        entry = [rank, self._seq, item, lane]
+        self._seq += 1
+        self._high[lane] = max(self._high[lane], rank)
+        self._entries[item["path"]] = entry
+        self._counts[lane] += 1
+        heapq.heappush(self._heaps[lane], entry)
+
+    def _head(self, lane):
+        """Живая запись наверху полосы; удаленные снимаются по пути"""
+        heap = self._heaps[lane]
+        while heap and self._entries.get(heap[0][2]["path"]) is not heap[0]:
+            heapq.heappop(heap)
+            self._stale -= 1
+        return heap[0] if heap else None
+
+    def _rank(self, lane, item):
+        head = self._head(lane)
+        if self.policy == "shuffle" and head is not None:
+            return random.uniform(head[0], self._high[lane] + 1)
+        if self.policy == "interleave":
+            # k-е медиа источника встает в k-й круг, но не раньше текущей головы полосы
+            floor = int(head[0]) if head is not None else 0
+            key = (lane, item.get("source") or "")
+            rank = max(self._source_rank.get(key, floor - 1) + 1, floor)
+            self._source_rank[key] = rank
+            return rank
+        return int(self._high[lane]) + 1
+
+    def _discard(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._counts[entry[3]] -= 1
+            self._stale += 1
+            if self._stale > len(self._entries) + 64:
+                self._compact()
+        return entry
+
+    def _compact(self):
+        for lane in LANES:
+            heap = [entry for entry in self._heaps[lane] if self._entries.get(entry[2]["path"]) is entry]
+            heapq.heapify(heap)
+            self._heaps[lane] = heap
+        self._stale = 0
+
+    def append(self, item, lane=DEFAULT_LANE):
+        """Добавляет медиа по политике канала; False, если этот путь уже в очереди"""
+        _check_lane(lane)
+        with self._lock:
+            if item["path"] in self._entries:
+                return False
+            self._push(item, lane, self._rank(lane, item))
+            return True
+
+    def extend(self, items, lane=DEFAULT_LANE):
+        with self._lock:
+            return sum(1 for item in items if self.append(item, lane))
+
+    def restore(self, entries):
+        """Ставит (полоса, медиа) в конец полос как есть, в обход политики - порядок из резервной копии"""
+        added = 0
+        with self._lock:
+            for lane, item in entries:
+                _check_lane(lane)
+                if item["path"] not in self._entries:
+                    self._push(item, lane, int(self._high[lane]) + 1)
+                    added += 1
+        return added
+
+    def peek(self):
+        with self._lock:
+            for lane in LANES:
+                head = self._head(lane)
+                if head is not None:
+                    return head[2]
+        return None
+
+    def pop(self):
+        """Следующее медиа: голова первой непустой полосы (None, если очередь пуста)"""
+        with self._lock:
+            for lane in LANES:
+                head = self._head(lane)
+                if head is not None:
+                    heapq.heappop(self._heaps[lane])
+                    del self._entries[head[2]["path"]]
+                    self._counts[lane] -= 1
+                    return head[2]
+        return None
+
+    def remove(self, path):
+        """Убирает медиа из очереди; возвращает его или None"""
+        with self._lock:
+            entry = self._discard(path)
+        return entry[2] if entry is not None else None
+
+    def remove_paths(self, paths):
+        with self._lock:
+            return sum(1 for path in paths if self._discard(path) is not None)
+
+    def lane_of(self, path):
+        entry = self._entries.get(path)
+        return entry[3] if entry is not None else None
+
+    def move(self, path, lane=None, position="bottom"):
+        """Переносит медиа в начало (top) или конец (bottom) полосы lane (по умолчанию - своей)"""
+        if position not in ("top", "bottom"):
+            raise QueueError(f"Неизвестная позиция: {position}")
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                raise QueueError("Медиа нет в очереди")
+            lane = _check_lane(lane or entry[3])
+            self._discard(path)
+            if position == "top":
+                head = self._head(lane)
+                rank = head[0] - 1 if head is not None else 0
+            else:
+                rank = self._high[lane] + 1
+            self._push(entry[2], lane, rank)
+        return entry[2]
+
+    def bump(self, path):
+        """Поднимает медиа в срочную полосу: уйдет после уже стоящих там срочных"""
+        return self.move(path, "urgent", "bottom")
+
+    def ordered(self, lanes=LANES):
+        """Медиа в порядке выдачи; каждый следующий элемент стоит O(log n)"""
+        for lane in lanes:
+            with self._lock:
+                heap = list(self._heaps[lane])
+            while heap:
+                entry = heapq.heappop(heap)
+                if self._entries.get(entry[2]["path"]) is entry:
+                    yield entry[2]
+
+    def entries(self):
+        """(полоса, медиа) в порядке выдачи - для списков и экспорта"""
+        for lane in LANES:
+            for item in self.ordered((lane,)):
+                yield lane, item
+
+    def at(self, position):
+        """Медиа на позиции position (с 1) в порядке выдачи"""
+        if position >= 1:
+            for index, item in enumerate(self.ordered(), 1):
+                if index == position:
+                    return item
+        raise QueueError(f"В очереди нет позиции {position}")
+
+    def lane_counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def set_policy(self, policy):
+        """Меняет политику и один раз переставляет стоящие в полосах медиа"""
+        if policy not in POLICIES:
+            raise QueueError(f"Неизвестная политика: {policy} (есть {', '.join(POLICIES)})")
+        with self._lock:
+            lanes = {lane: list(self.ordered((lane,))) for lane in LANES}
+            self.policy = policy
+            self._heaps = {lane: [] for lane in LANES}
+            self._entries = {}
+            self._counts = dict.fromkeys(LANES, 0)
+            self._high = dict.fromkeys(LANES, -1)
+            self._source_rank = {}
+            self._stale = 0
+            for lane, items in lanes.items():
+                if policy == "shuffle":
+                    random.shuffle(items)
+                for index, item in enumerate(items):
+                    if policy == "interleave":
+                        self._push(item, lane, self._rank(lane, item))
+                    else:
+                        self._push(item, lane, index)
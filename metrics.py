@@ -0,0 +1,427 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import logsetup
+
+handler_logger = logging.getLogger("handlers")
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # callback возвращает {кортеж_меток: значение} и вызывается только при чтении
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def items(self):
+        if self.callback is not None:
+            try:
+                return list(self.callback().items())
+            except Exception:
+                return []
+        with self._lock:
+            return list(self._values.items())
+
+    def collect(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики по корзинам (+Inf последней), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(state[0]), state[1], state[2]) for key, state in self._values.items()}
+
+    def quantile(self, q, key=None):
+        """Оценивает квантиль по корзинам (верхняя граница корзины)"""
+        snapshot = self.snapshot()
+        states = [snapshot[key]] if key is not None and key in snapshot else list(snapshot.values())
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0
+        for bucket_counts, _, count in states:
+            total += count
+            for i, c in enumerate(bucket_counts):
+                counts[i] += c
+        if not total:
+            return None
+        rank = q * total
+        running = 0
+        for i, c in enumerate(counts):
+            running += c
+            if running >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def collect(self):
+        lines = []
+        for key, (bucket_counts, total, count) in self.snapshot().items():
+            running = 0
+            for bound, c in zip(self.buckets, bucket_counts):
+                running += c
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {running}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Выгружает все метрики в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Метрики горячих путей бота
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_seconds", "Длительность обработчиков сообщений", ("handler",)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)
+)
+SAVE_DURATION = REGISTRY.histogram(
+    "bot_save_data_seconds", "Длительность save_data"
+)
+SAVE_BYTES = REGISTRY.counter(
+    "bot_save_data_bytes_total", "Байт записано save_data"
+)
+SAVE_FSYNCS = REGISTRY.counter(
+    "bot_save_data_fsyncs_total", "Вызовы fsync при записи файла данных"
+)
+POST_DELAY = REGISTRY.histogram(
+    "bot_post_delay_seconds", "Отклонение фактического времени поста от запланированного",
+    ("channel",), buckets=(1, 5, 15, 30, 60, 120, 300, 900)
+)
+MISSED_POSTS = REGISTRY.counter(
+    "bot_missed_posts_total", "Посты, не отправленные в окно срабатывания", ("channel",)
+)
+TRANSFER_BYTES = REGISTRY.counter(
+    "bot_transfer_bytes_total", "Байт передано через Bot API", ("direction",)
+)
+TRANSFER_SECONDS = REGISTRY.histogram(
+    "bot_transfer_seconds", "Длительность загрузки/скачивания медиа", ("direction",)
+)
+API_CALLS = REGISTRY.counter(
+    "bot_api_calls_total", "Исходящие вызовы Bot API", ("method", "status")
+)
+API_THROTTLED = REGISTRY.counter(
+    "bot_api_throttled_total", "Ответы 429 от Bot API", ("method",)
+)
+PREPROCESS_SECONDS = REGISTRY.histogram(
+    "bot_media_preprocess_seconds", "Длительность предобработки медиа", ("type",)
+)
+MEDIA_REJECTED = REGISTRY.counter(
+    "bot_media_rejected_total", "Медиа, отклоненные при предобработке", ("type",)
+)
+MEDIA_BYTES_SAVED = REGISTRY.counter(
+    "bot_media_bytes_saved_total", "Байт сэкономлено перекодированием медиа", ("type",)
+)
+SEND_POOL_SENDS = REGISTRY.counter(
+    "bot_send_pool_sends_total", "Посты, отправленные ботами пула", ("bot",)
+)
+SEND_POOL_FAILOVERS = REGISTRY.counter(
+    "bot_send_pool_failovers_total", "Переключения на другой бот пула", ("bot", "reason")
+)
+CONFIG_RELOADS = REGISTRY.counter(
+    "bot_config_reloads_total", "Перечитывания конфигурации", ("result",)
+)
+SCHEDULER_LAG = REGISTRY.gauge(
+    "bot_scheduler_lag_seconds", "Опоздание итерации планировщика относительно интервала"
+)
+POLLING_LAG = REGISTRY.gauge(
+    "bot_polling_lag_seconds", "Задержка между отправкой сообщения и его обработкой"
+)
+HANDLERS_IN_FLIGHT = REGISTRY.gauge(
+    "bot_handlers_in_flight", "Обработчики, выполняющиеся прямо сейчас"
+)
+WATCHDOG_RESTARTS = REGISTRY.counter(
+    "bot_watchdog_restarts_total", "Перезапуски зависшего планировщика или воркера сторожем", ("target",)
+)
+
+
+def timed_handler(func):
+    """Оборачивает обработчик замером длительности и подсчетом ошибок"""
+    name = func.__name__
+
+    def wrapper(message, *args, **kwargs):
+        start = time.perf_counter()
+        date = getattr(message, "date", None)
+        if date:
+            POLLING_LAG.set(max(0.0, time.time() - date))
+        user = getattr(message, "from_user", None)
+        HANDLERS_IN_FLIGHT.inc()
+        with logsetup.log_context(handler=name, user_id=getattr(user, "id", None)):
+            try:
+                return func(message, *args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                handler_logger.exception("Ошибка в обработчике %s", name)
+                raise
+            finally:
+                HANDLERS_IN_FLIGHT.inc(-1)
+                duration = time.perf_counter() - start
+                HANDLER_LATENCY.observe(duration, handler=name)
+                handler_logger.debug(
+                    "Обработчик %s: %.1f мс", name, duration * 1000,
+                    extra={"event": "handler", "duration": round(duration, 4)}
+                )
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = func.__doc__
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+_sessions = threading.local()
+
+
+def instrumented_request(method, url, **kwargs):
+    """Отправитель запросов для apihelper.CUSTOM_REQUEST_SENDER со счетчиками вызовов"""
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    api_method = url.rsplit("/", 1)[-1]
+    response = session.request(method, url, **kwargs)
+    API_CALLS.inc(method=api_method, status=response.status_code)
+    if response.status_code == 429:
+        API_THROTTLED.inc(method=api_method)
+    return response
+
+
+def summary():
+    """Краткая сводка метрик для владельца"""
+    lines = ["📈 Метрики"]
+
+    handler_snapshot = HANDLER_LATENCY.snapshot()
+    if handler_snapshot:
+        lines.append("")
+        lines.append("⏱ Обработчики (вызовов, p50/p99):")
+        for key, (_, total, count) in sorted(handler_snapshot.items(), key=lambda x: -x[1][2])[:10]:
+            p50 = HANDLER_LATENCY.quantile(0.5, key)
+            p99 = HANDLER_LATENCY.quantile(0.99, key)
+            lines.append(f"   {key[0]}: {count}, ≤{p50}s / ≤{p99}s")
+
+    save_count = sum(state[2] for state in SAVE_DURATION.snapshot().values())
+    lines.append("")
+    lines.append(
+        f"💾 save_data: {save_count} раз, fsync {SAVE_FSYNCS.total()}, "
+        f"{SAVE_BYTES.total() / 1024:.1f} КБ, p99 ≤{SAVE_DURATION.quantile(0.99)}s"
+    )
+
+    delay_snapshot = POST_DELAY.snapshot()
+    if delay_snapshot:
+        lines.append("")
+        lines.append("📬 Отклонение постов (p50/p99), худшие каналы:")
+        # Каналов может быть сотни, а сообщение Telegram - не длиннее 4096 символов
+        worst = sorted(
+            ((key, POST_DELAY.quantile(0.5, key), POST_DELAY.quantile(0.99, key)) for key in delay_snapshot),
+            key=lambda row: (-(row[2] or 0), -(row[1] or 0))
+        )
+        for key, p50, p99 in worst[:10]:
+            lines.append(f"   {key[0]}: ≤{p50}s / ≤{p99}s")
+        if len(worst) > 10:
+            lines.append(f"   ...и еще {len(worst) - 10} каналов (все - в /metrics)")
+
+    lines.append("")
+    lines.append(
+        f"📡 Bot API: {API_CALLS.total()} вызовов, 429: {API_THROTTLED.total()}, "
+        f"скачано {TRANSFER_BYTES.value(direction='download') / 1048576:.1f} МБ, "
+        f"выгружено {TRANSFER_BYTES.value(direction='upload') / 1048576:.1f} МБ"
+    )
+
+    pool_sends = SEND_POOL_SENDS.items()
+    if pool_sends:
+        failovers = {}
+        for (bot, _), value in SEND_POOL_FAILOVERS.items():
+            failovers[bot] = failovers.get(bot, 0) + value
+        lines.append("🤖 Пул ботов (постов / переключений):")
+        for (bot,), value in sorted(pool_sends):
+            lines.append(f"   {bot}: {value} / {failovers.get(bot, 0)}")
+
+    queue_depth = REGISTRY.get("bot_queue_depth")
+    if queue_depth is not None:
+        depths = queue_depth.items()
+        if depths:
+            lines.append(f"📦 Очереди: всего {sum(v for _, v in depths)} медиа в {len(depths)} каналах")
+
+    for key, value in SCHEDULER_LAG.items():
+        lines.append(f"🧵 Лаг планировщика: {value:.2f}s")
+    for key, value in POLLING_LAG.items():
+        lines.append(f"🧵 Лаг обработки сообщений: {value:.2f}s")
+
+    return "\n".join(lines)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+    routes = {}  # {путь: callable() -> (статус, Content-Type, тело в байтах)}
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics" and self.registry is not None:
+            status, content_type = 200, "text/plain; version=0.0.4; charset=utf-8"
+            body = self.registry.render().encode("utf-8")
+        elif path in self.routes:
+            status, content_type, body = self.routes[path]()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(host="127.0.0.1", port=9090, registry=REGISTRY, routes=None):
+    """Запускает локальный HTTP-эндпоинт /metrics (без registry - только routes) в фоновом потоке"""
+    handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry, "routes": routes or {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
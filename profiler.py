@@ -0,0 +1,160 @@
+"""Семплирующий профилировщик для работающего бота.
+
+Раз в interval секунд снимаются стеки всех потоков (sys._current_frames):
+поток опроса, обработчики, планировщик, отложенная запись. Инструментирования
+кода нет, поэтому накладные расходы малы и не зависят от числа вызовов.
+
+Результат - файл в формате collapsed stacks ("поток;файл:функция;... N"),
+который открывается flamegraph.pl, speedscope или inferno, и сводка самых
+частых функций. Запускается владельцем (/profile 30 или "🔬 Профилировать")
+или сигналом SIGUSR1 - тогда отчет приходит владельцу в личные сообщения.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_DEPTH = 64
+
+# Листовые кадры, в которых поток ждет ввода-вывода или блокировки, а не работает
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("connection.py", "wait"),
+}
+
+# Точки входа потоков есть в каждом стеке и в сводке только мешают
+ENTRY_FRAMES = {"threading.py:_bootstrap", "threading.py:_bootstrap_inner", "threading.py:run", "util.py:run"}
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profile:
+    """Результат профилирования: {(поток, (кадры от корня к листу)): число семплов}"""
+
+    def __init__(self, stacks, samples, seconds, interval):
+        self.stacks = stacks
+        self.samples = samples
+        self.seconds = seconds
+        self.interval = interval
+
+    def collapsed(self):
+        """Строки collapsed stacks, готовые для flamegraph.pl"""
+        lines = [
+            ";".join((thread,) + frames) + f" {count}"
+            for (thread, frames), count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def idle_samples(self):
+        return sum(count for (_, frames), count in self.stacks.items() if _is_idle(frames))
+
+    def top(self, limit=15):
+        """Функции по собственным семплам и по семплам со вложенными вызовами (без ожидания)"""
+        own = Counter()
+        total = Counter()
+        for (_, frames), count in self.stacks.items():
+            if _is_idle(frames):
+                continue
+            own[frames[-1]] += count
+            # Рекурсивная функция учитывается в семпле один раз
+            for label in set(frames) - ENTRY_FRAMES:
+                total[label] += count
+        return own.most_common(limit), total.most_common(limit)
+
+    def summary(self, limit=15):
+        busy = sum(self.stacks.values()) - self.idle_samples()
+        lines = [
+            f"🔬 Профиль за {self.seconds:.0f}s: {self.samples} проходов по {self.interval * 1000:.0f} мс, "
+            f"стеков в работе {busy}, в ожидании {self.idle_samples()}"
+        ]
+        threads = Counter()
+        for (thread, frames), count in self.stacks.items():
+            if not _is_idle(frames):
+                threads[thread] += count
+        if threads:
+            lines.append("")
+            lines.append("🧵 Потоки (семплов в работе):")
+            for thread, count in threads.most_common():
+                lines.append(f"   {thread}: {count}")
+
+        own, total = self.top(limit)
+        if own:
+            lines.append("")
+            lines.append("🔥 Собственное время:")
+            for label, count in own:
+                lines.append(f"   {count / max(busy, 1):6.1%}  {label}")
+        if total:
+            lines.append("")
+            lines.append("📚 С вложенными вызовами:")
+            for label, count in total:
+                lines.append(f"   {count / max(busy, 1):6.1%}  {label}")
+        return "\n".join(lines)
+
+
+def _is_idle(frames):
+    if not frames:
+        return True
+    filename, _, name = frames[-1].partition(":")
+    return (filename, name) in IDLE_FRAMES
+
+
+def _thread_names():
+    # Номера пула обработчиков (WorkerThread1, WorkerThread2...) сливаются в одну вершину графа
+    return {thread.ident: re.sub(r"\d+$", "", thread.name) for thread in threading.enumerate()}
+
+
+def sample(seconds=30, interval=0.01):
+    """Снимает стеки всех потоков в течение seconds; одновременно идет только один профиль"""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("профилирование уже запущено")
+    try:
+        own = threading.get_ident()
+        stacks = Counter()
+        names = _thread_names()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_tick = started
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = _thread_names()
+                frames = []
+                while frame is not None and len(frames) < MAX_DEPTH:
+                    frames.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                frames.reverse()
+                stacks[(names.get(ident, f"thread-{ident}"), tuple(frames))] += 1
+            samples += 1
+            # Равномерная сетка: время на снятие стеков не растягивает интервал
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        return Profile(stacks, samples, time.perf_counter() - started, interval)
+    finally:
+        _running.release()
+
+
+def running():
+    return _running.locked()
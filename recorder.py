@@ -0,0 +1,226 @@
+"""Запись входящих апдейтов для воспроизведения (bench/replay.py).
+
+Каждый апдейт - строка JSON с моментом прихода от начала записи; первая
+строка - заголовок с версией формата и псевдонимом владельца. Данные
+пользователей обезличиваются при записи:
+    - user_id и id личных чатов заменяются псевдонимами (HMAC с солью,
+      одинаковыми для одного id в пределах записи) - так же и в тексте
+      сообщения, состоящем из одного числа (user_id модератора в диалоге);
+    - имена, username, язык, подписи к медиа, контакты, геопозиция,
+      пересылки и ответы выбрасываются;
+    - file_id медиа заменяются хэшем.
+Соль не попадает в файл: без нее псевдонимы не сопоставить с настоящими id.
+В заголовке хранится только ее отпечаток. Дописывать можно лишь запись с той
+же солью; без capture.salt соль случайная, поэтому после перезапуска бот
+начинает новый файл рядом с прежним, а не смешивает в одном разные псевдонимы.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "bot-updates"
+VERSION = 1
+
+# Виды апдейтов, которые обрабатывает бот
+UPDATE_KINDS = ("message", "edited_message", "callback_query")
+
+MESSAGE_FIELDS = ("message_id", "date", "text", "entities", "media_group_id")
+MEDIA_FIELDS = ("width", "height", "duration", "file_size", "mime_type")
+_USER_ID_TEXT_RE = re.compile(r"^\s*\d{5,}\s*$")
+
+
+class Anonymizer:
+    def __init__(self, salt=None):
+        self.salt = (salt if salt is not None else os.urandom(16).hex()).encode("utf-8")
+
+    def _digest(self, value):
+        return hmac.new(self.salt, str(value).encode("utf-8"), hashlib.sha256).digest()
+
+    def user_id(self, user_id):
+        """Псевдоним в диапазоне настоящих user_id (положительные id каналов и групп не бывают)"""
+        if not isinstance(user_id, int) or user_id <= 0:
+            return user_id
+        return 1_000_000_000 + int.from_bytes(self._digest(user_id)[:4], "big") % 8_000_000_000
+
+    def fingerprint(self):
+        """Отпечаток соли для заголовка: по нему сверяется соль, но саму соль не восстановить"""
+        return self.token("salt-fingerprint")[:16]
+
+    def token(self, value):
+        return self._digest(value).hex()[:24]
+
+    def user(self, user):
+        return {"id": self.user_id(user["id"]), "is_bot": user.get("is_bot", False), "first_name": "User"}
+
+    def chat(self, chat):
+        result = {"id": self.user_id(chat["id"]), "type": chat.get("type", "private")}
+        if chat.get("type") in ("channel", "group", "supergroup"):
+            result["title"] = "Chat"
+        return result
+
+    def media(self, media):
+        result = {key: media[key] for key in MEDIA_FIELDS if key in media}
+        result["file_id"] = self.token(media["file_id"])
+        result["file_unique_id"] = self.token(media.get("file_unique_id") or media["file_id"])
+        return result
+
+    def message(self, message):
+        result = {key: message[key] for key in MESSAGE_FIELDS if key in message}
+        result["chat"] = self.chat(message["chat"])
+        if "from" in message:
+            result["from"] = self.user(message["from"])
+        if "text" in result and _USER_ID_TEXT_RE.match(result["text"]):
+            result["text"] = str(self.user_id(int(result["text"])))
+        if "entities" in result:
+            # Упоминания несут user, ссылки - url; оставляем только разметку
+            result["entities"] = [
+                {"type": entity["type"], "offset": entity["offset"], "length": entity["length"]}
+                for entity in result["entities"]
+            ]
+        if "photo" in message:
+            result["photo"] = [self.media(size) for size in message["photo"]]
+        for kind in ("video", "document", "animation"):
+            if kind in message:
+                result[kind] = self.media(message[kind])
+        return result
+
+    def callback_query(self, query):
+        result = {
+            "id": self.token(query["id"]),
+            "chat_instance": self.token(query.get("chat_instance", "")),
+            "from": self.user(query["from"]),
+        }
+        if "data" in query:
+            result["data"] = query["data"]
+        if query.get("message"):
+            result["message"] = self.message(query["message"])
+        return result
+
+    def update(self, update_id, kind, payload):
+        if kind == "callback_query":
+            return {"update_id": update_id, kind: self.callback_query(payload)}
+        return {"update_id": update_id, kind: self.message(payload)}
+
+
+class UpdateRecorder:
+    """Дописывает обезличенные апдейты в файл; вызывается из потока опроса"""
+
+    def __init__(self, path, owner_id, salt=None):
+        self.path = path
+        self.anonymizer = Anonymizer(salt)
+        self.started = time.monotonic()
+        self.count = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header, entries = read_recording(path)
+            offset = 0.0
+            for entry in entries:
+                offset = entry["t"]
+            if header.get("salt_fingerprint") == self.anonymizer.fingerprint():
+                # Дописываем в существующую запись: время продолжается после ее последней строки
+                self.started -= offset
+            else:
+                # С другой солью те же пользователи получили бы другие псевдонимы
+                self.path = _fresh_path(path)
+                logger.warning(
+                    "Запись %s сделана с другой солью (задайте capture.salt), апдейты пишутся в %s", path, self.path
+                )
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() == 0:
+            self._write({
+                "format": FORMAT, "version": VERSION,
+                "owner": self.anonymizer.user_id(owner_id),
+                "salt_fingerprint": self.anonymizer.fingerprint(),
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            })
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def record(self, updates):
+        offset = round(time.monotonic() - self.started, 3)
+        lines = []
+        for update in updates:
+            for kind in UPDATE_KINDS:
+                payload = getattr(update, kind, None)
+                if payload is not None and getattr(payload, "json", None):
+                    lines.append({"t": offset, "update": self.anonymizer.update(update.update_id, kind, payload.json)})
+                    break
+        if not lines:
+            return
+        with self._lock:
+            try:
+                for line in lines:
+                    self._write(line)
+                self._file.flush()
+                self.count += len(lines)
+            except (OSError, ValueError) as e:
+                logger.error("Не удалось записать апдейты в %s: %s", self.path, e)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _fresh_path(path):
+    """Свободное имя рядом с path: capture-20240131-120000.jsonl"""
+    base, ext = os.path.splitext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    candidate = f"{base}-{stamp}{ext}"
+    index = 1
+    while os.path.exists(candidate):
+        index += 1
+        candidate = f"{base}-{stamp}-{index}{ext}"
+    return candidate
+
+
+def capture_updates(bot, path, owner_id, salt=None):
+    """Пишет все апдейты, которые получает бот, до их обработки"""
+    recorder = UpdateRecorder(path, owner_id, salt)
+    process = bot.process_new_updates
+
+    def process_new_updates(updates):
+        try:
+            recorder.record(updates)
+        except Exception as e:
+            logger.error("Ошибка записи апдейтов: %s", e)
+        return process(updates)
+
+    bot.process_new_updates = process_new_updates
+    logger.info("Апдейты записываются в %s (обезличенно)", recorder.path)
+    return recorder
+
+
+def read_recording(path):
+    """(заголовок, генератор записей {"t", "update"}); битые строки пропускаются"""
+    f = open(path, "r", encoding="utf-8")
+    try:
+        header = json.loads(f.readline() or "{}")
+    except ValueError:
+        header = {}
+    if header.get("format") != FORMAT:
+        f.close()
+        raise ValueError(f"{path}: не запись апдейтов")
+    if header.get("version", 0) > VERSION:
+        f.close()
+        raise ValueError(f"{path}: версия формата {header['version']} новее поддерживаемой {VERSION}")
+
+    def entries():
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после сбоя
+                    continue
+                if "update" in entry:
+                    yield entry
+
+    return header, entries()
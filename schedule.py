@@ -0,0 +1,340 @@
+"""Расписания каналов: разбор, компиляция и расчет следующего срабатывания.
+
+Поддерживаемые записи (по одной на строку или через ';'):
+    10:00                          каждый день
+    пн-пт 10:00 / mon,wed 18:30    по дням недели
+    каждые 2ч 09:00-21:00          интервал внутри окна (также every 30m ...)
+    cron: 0 9,18 * * 1-5           cron-выражение из пяти полей
+
+Расписание компилируется один раз в отсортированные минуты суток по дням
+недели; следующее срабатывание после момента t ищется бинарным поиском.
+"""
+import re
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python 3.8: доступны только фиксированные смещения
+    ZoneInfo = None
+    ZoneInfoNotFoundError = KeyError
+
+DAY_MINUTES = 24 * 60
+
+WEEKDAYS = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+    "пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6,
+}
+
+_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})$")
+_EVERY_RE = re.compile(
+    r"^(?:every|каждые|каждый|каждую)\s+(\d+)\s*(h|m|ч|м|мин)\s+(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})$"
+)
+_OFFSET_RE = re.compile(r"^(?:utc|gmt)?\s*([+-])(\d{1,2})(?::(\d{2}))?$")
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+def split_specs(text):
+    """Делит ввод пользователя на записи: по строкам и ';', иначе по запятым.
+
+    Запятые внутри списка дней недели (mon,wed 18:30) запись не делят.
+    """
+    if "\n" in text or ";" in text or "cron" in text.lower():
+        parts = re.split(r"[\n;]", text)
+        return [part.strip() for part in parts if part.strip()]
+
+    specs = []
+    days = []  # дни недели, ждущие записи со временем
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if _is_weekdays(part):
+            days.append(part)
+            continue
+        specs.append(",".join(days + [part]))
+        days = []
+    if days:
+        raise ScheduleError(f"Не указано время для дней недели: {','.join(days)}")
+    return specs
+
+
+def _is_weekdays(value):
+    try:
+        _parse_weekdays(value)
+    except ScheduleError:
+        return False
+    return True
+
+
+def get_timezone(name):
+    """Возвращает tzinfo по имени IANA (Europe/Moscow) или смещению (UTC+3)"""
+    if isinstance(name, (int, float)):
+        return timezone(timedelta(hours=name))
+    match = _OFFSET_RE.match(name.strip().lower())
+    if match:
+        sign, hours, minutes = match.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(-delta if sign == "-" else delta)
+    if ZoneInfo is None:
+        raise ScheduleError(f"Часовые пояса IANA требуют Python 3.9+: {name}")
+    try:
+        return ZoneInfo(name.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ScheduleError(f"Неизвестный часовой пояс: {name}")
+
+
+def timezone_label(tz):
+    key = getattr(tz, "key", None)
+    if key:
+        return key
+    offset = tz.utcoffset(None)
+    if not offset:
+        return "UTC"
+    total = int(offset.total_seconds() // 60)
+    sign = "+" if total >= 0 else "-"
+    hours, minutes = divmod(abs(total), 60)
+    return f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else "")
+
+
+def _parse_time(value):
+    match = _TIME_RE.match(value)
+    if not match:
+        raise ScheduleError(f"Неверный формат времени: {value}")
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        raise ScheduleError(f"Неверный формат времени: {value}")
+    return hour * 60 + minute
+
+
+def _parse_weekdays(value):
+    days = set()
+    for part in value.split(","):
+        part = part.strip().lower()
+        if "-" in part:
+            first, last = (p.strip() for p in part.split("-", 1))
+            if first not in WEEKDAYS or last not in WEEKDAYS:
+                raise ScheduleError(f"Неизвестный день недели: {part}")
+            day = WEEKDAYS[first]
+            while True:
+                days.add(day)
+                if day == WEEKDAYS[last]:
+                    break
+                day = (day + 1) % 7
+        elif part in WEEKDAYS:
+            days.add(WEEKDAYS[part])
+        else:
+            raise ScheduleError(f"Неизвестный день недели: {part}")
+    return days
+
+
+def _parse_cron_field(value, low, high, names=None):
+    values = set()
+    for part in value.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ScheduleError(f"Неверный шаг cron: {value}")
+            step = int(step_text)
+        if part == "*":
+            first, last = low, high
+        elif "-" in part:
+            first, last = (_cron_number(p, names) for p in part.split("-", 1))
+        else:
+            first = last = _cron_number(part, names)
+            if step != 1:
+                last = high
+        if first < low or last > high or first > last:
+            raise ScheduleError(f"Значение cron вне диапазона: {value}")
+        values.update(range(first, last + 1, step))
+    return values
+
+
+def _cron_number(value, names):
+    value = value.strip().lower()
+    if names and value in names:
+        return names[value]
+    if not value.isdigit():
+        raise ScheduleError(f"Неверное значение cron: {value}")
+    return int(value)
+
+
+_CRON_WEEKDAYS = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+
+
+class _Rule:
+    """Минуты суток по дням недели и необязательный фильтр дней месяца/месяцев"""
+
+    def __init__(self, days=None, months=None, match_any_day=False):
+        self.minutes = [set() for _ in range(7)]
+        self.days = days
+        self.months = months
+        # В cron при заданных и дне месяца, и дне недели достаточно совпадения любого
+        self.match_any_day = match_any_day
+        self.weekday_mask = set(range(7))
+
+    def day_minutes(self, date):
+        if self.months is not None and date.month not in self.months:
+            return ()
+        weekday_ok = date.weekday() in self.weekday_mask
+        if self.days is None:
+            return self.compiled[date.weekday()] if weekday_ok else ()
+        day_ok = date.day in self.days
+        if (weekday_ok or day_ok) if self.match_any_day else (weekday_ok and day_ok):
+            return self.compiled[7]
+        return ()
+
+    def compile(self):
+        self.compiled = [sorted(minutes) for minutes in self.minutes]
+        # Для правил с фильтром дня минуты одинаковы для всех дней недели
+        self.compiled.append(sorted(set().union(*self.minutes)))
+        return self
+
+
+def _parse_spec(spec):
+    text = " ".join(spec.strip().split())
+    lowered = text.lower()
+
+    if lowered.startswith("cron:"):
+        fields = lowered[5:].split()
+        if len(fields) != 5:
+            raise ScheduleError(f"cron-выражение должно содержать 5 полей: {spec}")
+        minutes = _parse_cron_field(fields[0], 0, 59)
+        hours = _parse_cron_field(fields[1], 0, 23)
+        days = None if fields[2] == "*" else _parse_cron_field(fields[2], 1, 31)
+        months = None if fields[3] == "*" else _parse_cron_field(fields[3], 1, 12)
+        # В cron воскресенье - 0 или 7, в Python понедельник - 0
+        weekdays = {(day - 1) % 7 for day in _parse_cron_field(fields[4], 0, 7, _CRON_WEEKDAYS)}
+        day_minutes = {h * 60 + m for h in hours for m in minutes}
+
+        if days is None and months is None:
+            rule = _Rule()
+            for day in weekdays:
+                rule.minutes[day] = set(day_minutes)
+            return rule
+
+        rule = _Rule(days=days, months=months, match_any_day=days is not None and fields[4] != "*")
+        if fields[4] != "*":
+            rule.weekday_mask = weekdays
+        for day in range(7):
+            rule.minutes[day] = set(day_minutes)
+        return rule
+
+    weekdays = set(range(7))
+    parts = lowered.split(" ", 1)
+    if len(parts) == 2 and not _TIME_RE.match(parts[0]) and not _EVERY_RE.match(lowered):
+        try:
+            weekdays = _parse_weekdays(parts[0])
+            lowered = parts[1]
+        except ScheduleError:
+            pass
+
+    every = _EVERY_RE.match(lowered)
+    if every:
+        amount, unit, start, end = every.groups()
+        step = int(amount) * (60 if unit in ("h", "ч") else 1)
+        if step <= 0:
+            raise ScheduleError(f"Интервал должен быть больше нуля: {spec}")
+        first, last = _parse_time(start), _parse_time(end)
+        if last < first:
+            last += DAY_MINUTES
+        day_minutes = {minute % DAY_MINUTES for minute in range(first, last + 1, step)}
+    elif _is_weekdays(lowered):
+        raise ScheduleError(f"Не указано время для дней недели: {spec}")
+    else:
+        day_minutes = {_parse_time(lowered)}
+
+    rule = _Rule()
+    for day in weekdays:
+        rule.minutes[day] = set(day_minutes)
+    return rule
+
+
+class Occurrence:
+    __slots__ = ("fire_at", "local", "label")
+
+    def __init__(self, fire_at, local):
+        self.fire_at = fire_at  # момент срабатывания в UTC
+        self.local = local  # то же время в часовом поясе канала
+        self.label = local.strftime("%H:%M")
+
+    @property
+    def date_key(self):
+        return self.local.date()
+
+
+class CompiledSchedule:
+    def __init__(self, rules, tz, specs):
+        self.rules = rules
+        self.tz = tz
+        self.specs = tuple(specs)
+        self.slots_per_day = max((len(rule.compiled[7]) for rule in rules), default=0)
+
+    def __bool__(self):
+        return any(rule.compiled[7] for rule in self.rules)
+
+    def _localize(self, date, minute):
+        hour, minute = divmod(minute, 60)
+        # fold=0: в неоднозначный час (перевод назад) срабатываем один раз, в первый;
+        # несуществующее время (перевод вперед) смещается вперед на величину перевода
+        local = datetime(date.year, date.month, date.day, hour, minute, tzinfo=self.tz)
+        fire_at = local.astimezone(timezone.utc)
+        return Occurrence(fire_at, fire_at.astimezone(self.tz))
+
+    def next_after(self, moment, max_days=400):
+        """Первое срабатывание строго после moment (aware datetime)"""
+        if not self:
+            return None
+        local = moment.astimezone(self.tz)
+        date = local.date()
+        current = local.hour * 60 + local.minute
+        for _ in range(max_days):
+            while True:
+                best = None
+                for rule in self.rules:
+                    minutes = rule.day_minutes(date)
+                    index = bisect_right(minutes, current)
+                    if index < len(minutes) and (best is None or minutes[index] < best):
+                        best = minutes[index]
+                if best is None:
+                    break
+                occurrence = self._localize(date, best)
+                if occurrence.fire_at > moment:
+                    return occurrence
+                # Время из сдвинутого переводом часа оказалось не позже moment - ищем дальше
+                current = best
+            date += timedelta(days=1)
+            current = -1
+        return None
+
+    def occurrences(self, start, end):
+        """Все срабатывания в полуинтервале [start, end)"""
+        result = []
+        occurrence = self.next_after(start - timedelta(microseconds=1))
+        while occurrence is not None and occurrence.fire_at < end:
+            result.append(occurrence)
+            occurrence = self.next_after(occurrence.fire_at)
+        return result
+
+
+def compile_schedule(specs, tz):
+    """Проверяет и компилирует список записей расписания"""
+    if isinstance(specs, str):
+        specs = split_specs(specs)
+    if not specs:
+        raise ScheduleError("Расписание пустое")
+    plain = _Rule()
+    rules = []
+    for spec in specs:
+        rule = _parse_spec(spec)
+        if rule.days is None and rule.months is None and rule.weekday_mask == set(range(7)):
+            for day in range(7):
+                plain.minutes[day] |= rule.minutes[day]
+        else:
+            rules.append(rule)
+    rules.insert(0, plain)
+    return CompiledSchedule([rule.compile() for rule in rules], tz, specs)
@@ -0,0 +1,209 @@
+"""Пул ботов для отправки постов.
+
+Лимиты Bot API действуют на каждого бота отдельно, поэтому дополнительные
+токены (каждый бот - администратор целевых каналов) поднимают общую
+пропускную способность. Канал закреплен за "своим" ботом (channel_id % N),
+а при исчерпании его лимита отправка переходит на следующий свободный бот
+пула. После ошибки на другого бота переключаемся, только если пост точно
+не вышел: ответ 429, нет прав в канале, соединение не установлено. Таймаут
+чтения, обрыв соединения или 5xx могут прийти уже после публикации - такая
+ошибка пробрасывается, и слот считается неудачным, а не отправляется дважды.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+import telebot
+from telebot import apihelper
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Пауза для бота после сетевой или неизвестной ошибки
+ERROR_COOLDOWN = 30
+# Через сколько снова пробовать бота в канале, где у него не было прав
+FORBIDDEN_RETRY = 3600
+
+_FORBIDDEN_MARKERS = ("chat not found", "not enough rights", "need administrator rights", "chat_write_forbidden")
+
+
+def _not_delivered(error):
+    """True, если запрос не дошел до Telegram: соединение не было установлено"""
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.ProxyError, requests.exceptions.SSLError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        # Обрыв уже установленного соединения (ProtocolError) ничего не доказывает
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+class _Slot:
+    """Бот пула и учет его лимитов"""
+
+    def __init__(self, bot, index):
+        self.bot = bot
+        self.index = index
+        # Метка для логов и метрик - числовой id бота из токена, без секретной части
+        self.label = bot.token.split(":", 1)[0] if getattr(bot, "token", None) else f"bot{index}"
+        self.sent = deque()  # моменты отправок за последнюю секунду
+        self.sent_by_chat = {}  # {chat_id: deque моментов отправок за последнюю минуту}
+        self.blocked_until = 0.0
+        self.forbidden = {}  # {chat_id: до какого момента бот не публикует в канал}
+
+    def wait_time(self, chat_id, now, per_second, per_chat_per_minute):
+        """Через сколько секунд бот сможет отправить в чат (0 - сразу)"""
+        while self.sent and now - self.sent[0] >= 1:
+            self.sent.popleft()
+        chat_sent = self.sent_by_chat.get(chat_id)
+        while chat_sent and now - chat_sent[0] >= 60:
+            chat_sent.popleft()
+
+        wait = max(0.0, self.blocked_until - now)
+        if len(self.sent) >= per_second:
+            wait = max(wait, 1 - (now - self.sent[0]))
+        if chat_sent and len(chat_sent) >= per_chat_per_minute:
+            wait = max(wait, 60 - (now - chat_sent[0]))
+        return wait
+
+    def block(self, seconds):
+        """Пауза бота на seconds секунд; уже назначенная более длинная не укорачивается (вызывать под _lock)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def record(self, chat_id, now):
+        self.sent.append(now)
+        self.sent_by_chat.setdefault(chat_id, deque()).append(now)
+
+
+class SendPool:
+    def __init__(self, bots, per_second=30, per_chat_per_minute=20, max_wait=60):
+        self.slots = [_Slot(bot, index) for index, bot in enumerate(bots)]
+        self.per_second = per_second
+        self.per_chat_per_minute = per_chat_per_minute
+        self.max_wait = max_wait
+        self._lock = threading.Lock()  # под ним меняются лимиты и пометки всех ботов пула
+
+    def reconfigure(self, pool_config):
+        """Новые лимиты из перечитанного конфига; набор ботов меняется только перезапуском"""
+        pool_config = pool_config or {}
+        with self._lock:
+            self.per_second = pool_config.get("per_second", 30)
+            self.per_chat_per_minute = pool_config.get("per_chat_per_minute", 20)
+            self.max_wait = pool_config.get("max_wait", 60)
+
+    def _acquire(self, chat_id, exclude):
+        """Выбирает бота для отправки и резервирует за ним слот лимита"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                candidates = [
+                    slot for slot in self.slots
+                    if slot.index not in exclude and slot.forbidden.get(chat_id, 0) <= now
+                ]
+                if not candidates:
+                    return None
+                # Сначала закрепленный за каналом бот, затем остальные по кругу
+                preferred = abs(chat_id) % len(self.slots)
+                candidates.sort(key=lambda slot: (slot.index - preferred) % len(self.slots))
+                waits = [(slot.wait_time(chat_id, now, self.per_second, self.per_chat_per_minute), slot) for slot in candidates]
+                wait, slot = min(waits, key=lambda item: item[0])
+                if wait <= 0:
+                    # min() оставляет первого из свободных - закрепленного бота, если он свободен
+                    slot.record(chat_id, now)
+                    return slot
+            if now + wait > deadline:
+                return None
+            time.sleep(min(wait, 1.0))
+
+    def call(self, method, chat_id, **kwargs):
+        """Вызывает метод TeleBot (send_photo, send_video...) через свободный бот пула"""
+        excluded = set()
+        last_error = None
+        for _ in range(3 * len(self.slots)):
+            slot = self._acquire(chat_id, excluded)
+            if slot is None:
+                break
+            # При повторной попытке файл нужно отправить с начала
+            for value in kwargs.values():
+                if hasattr(value, "seek"):
+                    value.seek(0)
+            try:
+                result = getattr(slot.bot, method)(chat_id=chat_id, **kwargs)
+                metrics.SEND_POOL_SENDS.inc(bot=slot.label)
+                return result
+            except apihelper.ApiTelegramException as e:
+                last_error = e
+                reason = self._handle_api_error(slot, chat_id, e)
+                if reason is None:
+                    raise
+            except Exception as e:
+                last_error = e
+                with self._lock:
+                    slot.block(ERROR_COOLDOWN)
+                if not _not_delivered(e):
+                    # Таймаут чтения или обрыв: пост мог выйти, повтор другим ботом его задублирует
+                    raise
+                reason = "unreachable"
+            if reason != "throttled":
+                # После 429 бот снова доступен, когда истечет retry_after
+                excluded.add(slot.index)
+            metrics.SEND_POOL_FAILOVERS.inc(bot=slot.label, reason=reason)
+            logger.warning(
+                "Бот %s не отправил в %s (%s): %s", slot.label, chat_id, reason, last_error,
+                extra={"channel_id": chat_id, "event": "send_failover"}
+            )
+        raise last_error or RuntimeError(f"Нет доступных ботов для отправки в {chat_id}")
+
+    def _handle_api_error(self, slot, chat_id, error):
+        """Помечает бота по ошибке; None - на другого бота не переключаемся"""
+        description = str(error.description).lower()
+        with self._lock:
+            if error.error_code == 429:
+                retry_after = (error.result_json.get("parameters") or {}).get("retry_after", 1)
+                slot.block(retry_after)
+                return "throttled"
+            if error.error_code == 403 or any(marker in description for marker in _FORBIDDEN_MARKERS):
+                # Бот не администратор канала - в этом канале пробуем других
+                slot.forbidden[chat_id] = time.monotonic() + FORBIDDEN_RETRY
+                return "forbidden"
+            if error.error_code != 400:
+                # 5xx и прочее: неизвестно, вышел ли пост; бот отдыхает, ошибка пробрасывается
+                slot.block(ERROR_COOLDOWN)
+        # 400 - ошибка в самом запросе (подпись, файл), другой бот получит ту же
+        return None
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self.call("send_photo", chat_id, photo=photo, **kwargs)
+
+    def send_video(self, chat_id, video, **kwargs):
+        return self.call("send_video", chat_id, video=video, **kwargs)
+
+    def status(self):
+        """Состояние ботов пула: [(метка, заблокирован еще секунд, каналов без прав)]"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (slot.label, max(0.0, slot.blocked_until - now), sum(1 for until in slot.forbidden.values() if until > now))
+                for slot in self.slots
+            ]
+
+
+def create_sender(config, bot):
+    """Пул из основного и дополнительных ботов или сам основной бот, если токенов нет"""
+    pool_config = config.get("send_pool") or {}
+    tokens = pool_config.get("tokens") or []
+    if not tokens:
+        return bot
+    bots = [bot] + [telebot.TeleBot(token) for token in tokens]
+    logger.info("Пул отправки: %d ботов", len(bots))
+    return SendPool(
+        bots,
+        per_second=pool_config.get("per_second", 30),
+        per_chat_per_minute=pool_config.get("per_chat_per_minute", 20),
+        max_wait=pool_config.get("max_wait", 60),
+    )
@@ -0,0 +1,235 @@
+"""Конфигурация с перечитыванием без перезапуска.
+
+config.yml загружается в объект Settings; по SIGHUP или кнопке владельца
+"🔄 Перечитать конфиг" файл читается заново, проверяется целиком и только
+после успешной проверки подменяет текущую конфигурацию. Подписчики получают
+список изменившихся ключей и пересчитывают только зависящее от них
+состояние (например, расписания каналов без собственного часового пояса).
+Ключи из RESTART_KEYS применяются только после перезапуска.
+"""
+import logging
+import threading
+
+import yaml
+
+import schedule
+
+logger = logging.getLogger(__name__)
+
+# Изменения этих ключей (и всего, что под ними) требуют перезапуска процесса
+RESTART_KEYS = (
+    "telegram.token",
+    "telegram.admin_id",
+    "storage.data_file",
+    "storage.history_file",
+    "storage.history_size",
+    "metrics.enabled",
+    "metrics.host",
+    "metrics.port",
+    "health.enabled",
+    "capture",
+    "sharding",
+    "media.workers",
+    "send_pool.tokens",
+)
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def load_config(path="config.yml"):
+    """Загружает config.yml"""
+    with open(path, "r", encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def _number(errors, section, key, minimum=None, maximum=None, integer=False, required=False):
+    name = f"{key[0]}.{key[1]}"
+    value = (section or {}).get(key[1])
+    if value is None:
+        if required:
+            errors.append(f"{name}: не задан")
+        return
+    kind = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kind):
+        errors.append(f"{name}: ожидается {'целое ' if integer else ''}число, получено {value!r}")
+    elif (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        errors.append(f"{name}: {value} вне диапазона [{minimum}, {maximum}]")
+
+
+def validate(config):
+    """Проверяет конфигурацию целиком; при ошибках бросает ConfigError со списком всех проблем"""
+    if not isinstance(config, dict):
+        raise ConfigError("config.yml пуст или не является словарем")
+    errors = []
+    for section in ("telegram", "posts", "storage"):
+        if not isinstance(config.get(section), dict):
+            errors.append(f"{section}: обязательный раздел")
+    for section in ("metrics", "sharding", "media", "send_pool", "logging", "shutdown", "profiler", "health", "capture", "backup"):
+        if config.get(section) is not None and not isinstance(config[section], dict):
+            errors.append(f"{section}: ожидается словарь")
+    if errors:
+        raise ConfigError("; ".join(errors))
+
+    telegram = config["telegram"]
+    if not isinstance(telegram.get("token"), str) or not telegram["token"].strip():
+        errors.append("telegram.token: не задан")
+    _number(errors, telegram, ("telegram", "admin_id"), integer=True, required=True)
+
+    posts = config["posts"]
+    _number(errors, posts, ("posts", "timezone_offset"), -12, 14, required=True)
+    _number(errors, posts, ("posts", "random_offset_minutes"), 0, 720, integer=True, required=True)
+    if posts.get("timezone"):
+        try:
+            schedule.get_timezone(posts["timezone"])
+        except schedule.ScheduleError as e:
+            errors.append(f"posts.timezone: {e}")
+
+    storage = config["storage"]
+    if not isinstance(storage.get("data_file"), str) or not storage["data_file"]:
+        errors.append("storage.data_file: не задан")
+    _number(errors, storage, ("storage", "flush_interval"), 0.1, 3600)
+    if storage.get("history_file") is not None and not isinstance(storage["history_file"], str):
+        errors.append("storage.history_file: ожидается путь к файлу")
+    _number(errors, storage, ("storage", "history_size"), 10, 10_000_000, integer=True)
+    if storage.get("scheduler_state") is not None and not isinstance(storage["scheduler_state"], str):
+        errors.append("storage.scheduler_state: ожидается путь к файлу")
+    _number(errors, config.get("shutdown"), ("shutdown", "timeout"), 1, 3600)
+    _number(errors, config.get("profiler"), ("profiler", "seconds"), 1, 600)
+    _number(errors, config.get("profiler"), ("profiler", "interval_ms"), 1, 1000)
+    _number(errors, config.get("health"), ("health", "scheduler_timeout"), 30, 86400)
+    _number(errors, config.get("health"), ("health", "polling_timeout"), 30, 86400)
+    _number(errors, config.get("health"), ("health", "check_interval"), 1, 3600)
+    capture = config.get("capture") or {}
+    if capture.get("file") is not None and not isinstance(capture["file"], str):
+        errors.append("capture.file: ожидается путь к файлу")
+    if capture.get("salt") is not None and not isinstance(capture["salt"], str):
+        errors.append("capture.salt: ожидается строка")
+    backup_dir = (config.get("backup") or {}).get("dir")
+    if backup_dir is not None and (not isinstance(backup_dir, str) or not backup_dir):
+        errors.append("backup.dir: ожидается путь к каталогу")
+
+    metrics_config = config.get("metrics") or {}
+    _number(errors, metrics_config, ("metrics", "port"), 1, 65535, integer=True)
+
+    sharding = config.get("sharding") or {}
+    _number(errors, sharding, ("sharding", "workers"), 0, 256, integer=True)
+    _number(errors, sharding, ("sharding", "lease_seconds"), 10, 86400)
+
+    media_config = config.get("media") or {}
+    _number(errors, media_config, ("media", "workers"), 1, 64, integer=True)
+    _number(errors, media_config, ("media", "max_side"), 64, 10000, integer=True)
+    _number(errors, media_config, ("media", "jpeg_quality"), 1, 95, integer=True)
+
+    pool = config.get("send_pool") or {}
+    if not isinstance(pool.get("tokens") or [], list):
+        errors.append("send_pool.tokens: ожидается список")
+    _number(errors, pool, ("send_pool", "per_second"), 1, 1000, integer=True)
+    _number(errors, pool, ("send_pool", "per_chat_per_minute"), 1, 1000, integer=True)
+    _number(errors, pool, ("send_pool", "max_wait"), 0, 3600)
+
+    logging_config = config.get("logging") or {}
+    if str(logging_config.get("level", "INFO")).upper() not in LOG_LEVELS:
+        errors.append(f"logging.level: неизвестный уровень {logging_config['level']!r}")
+    if logging_config.get("format", "json") not in ("json", "text"):
+        errors.append(f"logging.format: ожидается json или text, получено {logging_config['format']!r}")
+    if not isinstance(logging_config.get("sample") or {}, dict):
+        errors.append("logging.sample: ожидается словарь")
+
+    if errors:
+        raise ConfigError("; ".join(errors))
+    return config
+
+
+def changed_keys(old, new, prefix=""):
+    """Пути листьев, значения которых различаются: {"posts.random_offset_minutes", ...}"""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return set() if old == new else {prefix}
+    changed = set()
+    for key in set(old) | set(new):
+        path = f"{prefix}.{key}" if prefix else str(key)
+        changed |= changed_keys(old.get(key), new.get(key), path)
+    return changed
+
+
+def requires_restart(changed):
+    return sorted(key for key in changed if any(key == k or key.startswith(k + ".") for k in RESTART_KEYS))
+
+
+def _carry_over(old, new, path):
+    """Оставляет в new значение old по пути path (или удаляет его, если в old ключа не было)"""
+    *parents, leaf = path.split(".")
+    source, target = old, new
+    for part in parents:
+        source = source.get(part) if isinstance(source, dict) else None
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if isinstance(source, dict) and leaf in source:
+        target[leaf] = source[leaf]
+    else:
+        target.pop(leaf, None)
+
+
+class Settings:
+    """Текущая конфигурация; чтение как у словаря, подмена - только через reload"""
+
+    def __init__(self, path="config.yml", data=None):
+        self.path = path
+        self.data = validate(data if data is not None else load_config(path))
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def section(self, name):
+        return self.data.get(name) or {}
+
+    def on_reload(self, callback):
+        """callback(old, new, changed) вызывается после подмены конфигурации"""
+        self._listeners.append(callback)
+
+    def reload(self):
+        """Перечитывает файл; возвращает (изменившиеся ключи, ключи, требующие перезапуска).
+
+        При ошибке чтения или проверки бросает ConfigError, текущая
+        конфигурация остается прежней.
+        """
+        with self._lock:
+            try:
+                new = validate(load_config(self.path))
+            except ConfigError:
+                raise
+            except Exception as e:
+                raise ConfigError(f"не удалось прочитать {self.path}: {e}")
+
+            changed = changed_keys(self.data, new)
+            restart = requires_restart(changed)
+            # Пока процесс не перезапущен, в силе остаются прежние значения этих ключей
+            for path in restart:
+                _carry_over(self.data, new, path)
+            changed -= set(restart)
+            if not changed:
+                if restart:
+                    logger.warning("Вступят в силу после перезапуска: %s", ", ".join(restart))
+                return changed, restart
+            old, self.data = self.data, new
+            for callback in self._listeners:
+                try:
+                    callback(old, new, changed)
+                except Exception as e:
+                    logger.error("Ошибка применения конфигурации в %s: %s", getattr(callback, "__name__", callback), e)
+            logger.info(
+                "Конфигурация перечитана, изменено: %s", ", ".join(sorted(changed)),
+                extra={"event": "config_reload"}
+            )
+            if restart:
+                logger.warning("Вступят в силу после перезапуска: %s", ", ".join(restart))
+            return changed, restart
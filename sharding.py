@@ -0,0 +1,417 @@
+"""Распределение каналов между процессами-воркерами с арендой через SQLite.
+
+Каждый воркер запускает свой PostScheduler только для каналов, аренду которых
+он держит. Аренда продлевается на каждом проходе; если воркер умер, его каналы
+после истечения аренды забирает другой воркер. Файл данных пишет только
+основной процесс: воркеры отмечают отправленные медиа в таблице consumed,
+а основной процесс удаляет их из очередей и сохраняет состояние.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import threading
+import time
+
+import telebot
+
+import bot as app
+import history
+import sendpool
+import logsetup
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить отметки об отправленных медиа и слотах после их применения
+CONSUMED_RETENTION = 600
+SENT_RETENTION = 3 * 24 * 3600
+
+
+def shard_of(channel_id, workers):
+    """Предпочтительный воркер канала"""
+    return abs(channel_id) % workers
+
+
+class LeaseStore:
+    def __init__(self, path, lease_seconds=90):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS leases (
+                channel_id INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS heartbeats (
+                worker INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                seen_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS consumed (
+                channel_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                consumed_at REAL NOT NULL,
+                applied INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (channel_id, path)
+            );
+            CREATE TABLE IF NOT EXISTS sent_slots (
+                channel_id INTEGER NOT NULL,
+                slot TEXT NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (channel_id, slot)
+            );
+        """)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self._conn.close()
+
+    # --- аренда каналов ---
+
+    def heartbeat(self, worker, owner):
+        self._execute(
+            "INSERT INTO heartbeats (worker, owner, seen_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(worker) DO UPDATE SET owner = excluded.owner, seen_at = excluded.seen_at",
+            (worker, owner, time.time()),
+        )
+
+    def heartbeats(self):
+        """{номер воркера: момент последнего пульса (time.time())}"""
+        return {row[0]: row[1] for row in self._execute("SELECT worker, seen_at FROM heartbeats")}
+
+    def live_workers(self):
+        cutoff = time.time() - self.lease_seconds
+        return {row[0] for row in self._execute("SELECT worker FROM heartbeats WHERE seen_at >= ?", (cutoff,))}
+
+    def claim(self, owner, worker, workers, channel_ids, failover=True):
+        """Продлевает свои аренды и берет свободные каналы; возвращает множество своих каналов.
+
+        failover=False запрещает брать чужие каналы - пока остальные воркеры
+        после запуска еще не успели отметиться.
+        """
+        now = time.time()
+        expires_at = now + self.lease_seconds
+        live = self.live_workers()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                leases = {
+                    row[0]: (row[1], row[2])
+                    for row in conn.execute("SELECT channel_id, owner, expires_at FROM leases")
+                }
+                owned = set()
+                for channel_id in channel_ids:
+                    preferred = shard_of(channel_id, workers)
+                    holder, lease_expires = leases.get(channel_id, (None, 0))
+
+                    if holder == owner:
+                        # Возвращаем чужой канал, когда его предпочтительный воркер снова жив
+                        if preferred != worker and preferred in live:
+                            conn.execute("DELETE FROM leases WHERE channel_id = ? AND owner = ?", (channel_id, owner))
+                            continue
+                    elif holder is not None and lease_expires > now:
+                        continue
+                    elif preferred != worker:
+                        # Чужие каналы забираем, только если их воркер мертв, а аренда истекла с запасом
+                        if not failover or preferred in live or lease_expires > now - self.lease_seconds:
+                            continue
+
+                    conn.execute(
+                        "INSERT INTO leases (channel_id, owner, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(channel_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at",
+                        (channel_id, owner, expires_at),
+                    )
+                    owned.add(channel_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return owned
+
+    def release(self, owner):
+        self._execute("DELETE FROM leases WHERE owner = ?", (owner,))
+
+    def leases(self):
+        return {row[0]: (row[1], row[2]) for row in self._execute("SELECT channel_id, owner, expires_at FROM leases")}
+
+    # --- отправленные медиа и слоты ---
+
+    def mark_consumed(self, channel_id, path):
+        self._execute(
+            "INSERT OR IGNORE INTO consumed (channel_id, path, consumed_at) VALUES (?, ?, ?)",
+            (channel_id, path, time.time()),
+        )
+
+    def consumed_paths(self, channel_id):
+        return {row[0] for row in self._execute("SELECT path FROM consumed WHERE channel_id = ?", (channel_id,))}
+
+    def pending_consumed(self):
+        return self._execute("SELECT channel_id, path FROM consumed WHERE applied = 0")
+
+    def mark_applied(self, rows):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE consumed SET applied = 1 WHERE channel_id = ? AND path = ?", rows
+            )
+            # Отметки держим, пока все воркеры гарантированно не перечитали файл данных
+            self._conn.execute(
+                "DELETE FROM consumed WHERE applied = 1 AND consumed_at < ?",
+                (time.time() - CONSUMED_RETENTION,),
+            )
+
+    def mark_sent(self, channel_id, slot):
+        self._execute(
+            "INSERT OR IGNORE INTO sent_slots (channel_id, slot, sent_at) VALUES (?, ?, ?)",
+            (channel_id, slot, time.time()),
+        )
+
+    def was_sent(self, channel_id, slot):
+        return bool(self._execute(
+            "SELECT 1 FROM sent_slots WHERE channel_id = ? AND slot = ?", (channel_id, slot)
+        ))
+
+    def purge_sent(self):
+        self._execute("DELETE FROM sent_slots WHERE sent_at < ?", (time.time() - SENT_RETENTION,))
+
+
+class ShardView:
+    """BotData воркера: видит только каналы шарда и не изменяет файл данных"""
+
+    def __init__(self, bot_data, store):
+        self.bot_data = bot_data
+        self.store = store
+        self.owned = set()
+
+    @property
+    def channels(self):
+        channels = self.bot_data.channels
+        return {cid: channels[cid] for cid in self.owned if cid in channels}
+
+    @property
+    def users(self):
+        return self.bot_data.users
+
+    def has_permission(self, user_id, required_role):
+        return self.bot_data.has_permission(user_id, required_role)
+
+    def has_channel_access(self, user_id, channel_id):
+        return self.bot_data.has_channel_access(user_id, channel_id)
+
+    def caption(self, channel_id):
+        return self.bot_data.caption(channel_id)
+
+    def _consumed_in_queue(self, channel_id):
+        """Сколько медиа очереди воркеры уже отправили, а основной процесс еще не применил; O(отметок), не O(очереди)"""
+        queue = self.bot_data.channels[channel_id]["media_queue"]
+        return sum(1 for path in self.store.consumed_paths(channel_id) if path in queue)
+
+    def post_number(self, channel_id):
+        # Отправленные воркерами медиа попадают в post_count, только когда основной процесс их применит
+        return self.bot_data.channels[channel_id].get("post_count", 0) + self._consumed_in_queue(channel_id)
+
+    def queue_length(self, channel_id):
+        return len(self.bot_data.channels[channel_id]["media_queue"]) - self._consumed_in_queue(channel_id)
+
+    def get_next_file_from_channel(self, channel_id, remove=True):
+        if channel_id not in self.owned or channel_id not in self.bot_data.channels:
+            return None
+
+        consumed = self.store.consumed_paths(channel_id)
+        for item in self.bot_data.channels[channel_id]["media_queue"]:
+            if item["path"] not in consumed:
+                if remove:
+                    self.store.mark_consumed(channel_id, item["path"])
+                return item
+        return None
+
+
+class ShardScheduler(app.PostScheduler):
+    """Планировщик шарда: отметки об отправленных слотах хранятся в общей базе"""
+
+    def __init__(self, bot, view, store, **kwargs):
+        super().__init__(bot, view, **kwargs)
+        self.store = store
+
+    def was_sent(self, channel_id, date_key, msk_time):
+        return (
+            super().was_sent(channel_id, date_key, msk_time)
+            or self.store.was_sent(channel_id, f"{date_key}|{msk_time}")
+        )
+
+    def mark_sent(self, channel_id, date_key, msk_time):
+        super().mark_sent(channel_id, date_key, msk_time)
+        self.store.mark_sent(channel_id, f"{date_key}|{msk_time}")
+
+
+def run_worker(config, worker, workers, interval=30, updates=None):
+    """Точка входа процесса-воркера; через updates приходят перечитанные конфиги"""
+    logsetup.setup_logging(config.get("logging"), worker=worker)
+    sharding = config.get("sharding") or {}
+    store = LeaseStore(sharding.get("db", "shards.db"), sharding.get("lease_seconds", 90))
+    owner = f"worker-{worker}-{os.getpid()}"
+
+    bot_data = app.BotData(config["storage"]["data_file"], config["telegram"]["admin_id"], read_only=True)
+    view = ShardView(bot_data, store)
+    worker_bot = telebot.TeleBot(config["telegram"]["token"])
+    scheduler = ShardScheduler(
+        worker_bot, view, store,
+        timezone_offset=config["posts"]["timezone_offset"],
+        random_offset=config["posts"]["random_offset_minutes"],
+        default_timezone=config["posts"].get("timezone"),
+        sender=sendpool.create_sender(config, worker_bot),
+        # Свой файл у каждого воркера: основной процесс объединяет их при просмотре
+        history=history.create_history(config, suffix=f".worker{worker}")
+    )
+
+    # SIGTERM от супервизора: доотправить текущий пост, освободить аренду и выйти
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stopping.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C в терминале получает вся группа процессов
+    logger.info("Воркер %s запущен", owner)
+    started = time.monotonic()
+    try:
+        while not scheduler.stopping.is_set():
+            try:
+                config = _apply_updates(config, updates, scheduler, worker)
+                bot_data.reload_if_changed()
+                store.heartbeat(worker, owner)
+                owned = store.claim(
+                    owner, worker, workers, list(bot_data.channels.keys()),
+                    failover=time.monotonic() - started >= store.lease_seconds
+                )
+                if owned != view.owned:
+                    logger.info("Воркер %s обслуживает каналы: %s", owner, sorted(owned))
+                view.owned = owned
+                scheduler.check_posts()
+            except Exception as e:
+                logger.error("Ошибка воркера %s: %s", owner, e)
+            scheduler.stopping.wait(interval)
+    finally:
+        store.release(owner)
+        logger.info("Воркер %s остановлен", owner)
+        logsetup.stop_logging()
+
+
+def _apply_updates(config, updates, scheduler, worker):
+    """Применяет последний присланный супервизором конфиг, не теряя last_sent планировщика"""
+    if updates is None:
+        return config
+    while True:
+        try:
+            new, changed = updates.get_nowait()
+        except queue.Empty:
+            return config
+        app.reconfigure_components(new, changed, scheduler, worker=worker)
+        config = new
+
+
+def apply_consumed(bot_data, store):
+    """Удаляет из очередей медиа, отправленные воркерами, и сохраняет состояние"""
+    rows = store.pending_consumed()
+    if not rows:
+        return 0
+
+    by_channel = {}
+    for channel_id, path in rows:
+        by_channel.setdefault(channel_id, set()).add(path)
+
+    bot_data.ensure_loaded()
+    with bot_data.changing():
+        for channel_id, paths in by_channel.items():
+            channel = bot_data.channels.get(channel_id)
+            if channel is not None:
+                channel["post_count"] = channel.get("post_count", 0) + channel["media_queue"].remove_paths(paths)
+
+    bot_data.save_data()
+    store.mark_applied(rows)
+    return len(rows)
+
+
+class ShardSupervisor:
+    """Основной процесс: запускает воркеров, перезапускает упавших и применяет их отметки"""
+
+    def __init__(self, config, bot_data):
+        sharding = config.get("sharding") or {}
+        self.config = config
+        self.bot_data = bot_data
+        self.workers = sharding.get("workers", 0)
+        self.apply_interval = sharding.get("apply_interval", 5)
+        self.store = LeaseStore(sharding.get("db", "shards.db"), sharding.get("lease_seconds", 90))
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.started = {}  # {воркер: time.time() запуска процесса}
+        self.updates = {}
+        self.stopping = threading.Event()
+
+    def spawn(self, worker):
+        self.updates[worker] = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker, args=(self.config, worker, self.workers),
+            kwargs={"updates": self.updates[worker]},
+            name=f"shard-worker-{worker}", daemon=True
+        )
+        process.start()
+        self.processes[worker] = process
+        self.started[worker] = time.time()
+
+    def worker_ages(self):
+        """Секунды с последнего пульса каждого запущенного воркера (с момента запуска, если пульса еще не было)"""
+        seen = self.store.heartbeats()
+        now = time.time()
+        return {
+            worker: now - max(seen.get(worker, 0), self.started.get(worker, now))
+            for worker in self.processes
+        }
+
+    def restart_worker(self, worker):
+        """Завершает зависший воркер; цикл run запустит его заново"""
+        process = self.processes.get(worker)
+        if process is None or not process.is_alive() or self.stopping.is_set():
+            return False
+        logger.error("Воркер %s не отмечался, перезапуск", worker)
+        process.kill()
+        return True
+
+    def reconfigure(self, old, new, changed):
+        """Передает перечитанный конфиг воркерам; перезапущенные воркеры сразу получат новый"""
+        self.config = new
+        for worker, updates in list(self.updates.items()):
+            updates.put((new, changed))
+
+    def run(self):
+        for worker in range(self.workers):
+            self.spawn(worker)
+        logger.info("Запущено воркеров: %d", self.workers)
+
+        while not self.stopping.is_set():
+            try:
+                for worker, process in list(self.processes.items()):
+                    if not process.is_alive() and not self.stopping.is_set():
+                        logger.error("Воркер %s завершился (код %s), перезапуск", worker, process.exitcode)
+                        self.spawn(worker)
+                apply_consumed(self.bot_data, self.store)
+                self.store.purge_sent()
+            except Exception as e:
+                logger.error("Ошибка супервизора шардов: %s", e)
+            self.stopping.wait(self.apply_interval)
+
+    def stop(self, timeout=30):
+        """Останавливает воркеров, дожидаясь текущих отправок, и применяет их последние отметки"""
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for worker, process in self.processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Воркер %s не остановился за %ss", worker, timeout)
+        apply_consumed(self.bot_data, self.store)
@@ -0,0 +1,286 @@
+"""Симуляция расписания на виртуальных часах для планирования емкости.
+
+Прогоняет PostScheduler на дни и недели вперед за секунды: с разбросом
+RANDOM_OFFSET, временем выгрузки медиа и пополнением очередей. Отправка
+заглушена, файлы не читаются, сообщения не уходят.
+
+Примеры:
+    python simulate.py --days 7                      # каналы из файла данных
+    python simulate.py --days 14 --channels 40 --slots 6 --queue 100 \\
+        --avg-size-mb 8 --bandwidth-mbit 20 --refill 10@09:00
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+import bot
+import mediaqueue
+
+# Ограничения Bot API: сообщений в секунду на бота и в минуту в один чат
+GLOBAL_LIMIT_PER_SECOND = 30
+CHAT_LIMIT_PER_MINUTE = 20
+
+
+class SimulatedScheduler(bot.PostScheduler):
+    """PostScheduler, у которого отправка заменена учетом виртуального времени выгрузки"""
+
+    def __init__(self, simulation, bot_data, **kwargs):
+        super().__init__(None, bot_data, clock=simulation.now, **kwargs)
+        self.simulation = simulation
+
+    def send_scheduled_post(self, channel_id, occurrence=None):
+        plan = self.plans[channel_id]
+        return self.simulation.send(channel_id, plan["next"].label, plan["planned"])
+
+
+class Simulation:
+    def __init__(self, bot_data, start, days, bandwidth_mbit, api_overhead, avg_size,
+                 interval=30, window=60, late_seconds=60, refills=(), **scheduler_kwargs):
+        self.bot_data = bot_data
+        self.start = start
+        self.end = start + timedelta(days=days)
+        self.days = days
+        self.bandwidth = bandwidth_mbit * 1_000_000 / 8  # байт в секунду
+        self.api_overhead = api_overhead
+        self.avg_size = avg_size
+        self.interval = interval
+        self.window = window
+        self.late_seconds = late_seconds
+        self.refills = refills
+        self.scheduler = SimulatedScheduler(self, bot_data, **scheduler_kwargs)
+
+        self.tick_start = start
+        self.elapsed = 0.0
+        self.posts = []
+        self.failed = Counter()
+        self.exhausted = {}
+        self.sends_per_tick = Counter()
+        self.overrun_ticks = 0
+        self._refill_seq = 0
+        self._last_refill_day = {}
+
+    def now(self):
+        return self.tick_start + timedelta(seconds=self.elapsed)
+
+    def item_size(self, file_info):
+        size = file_info.get("size")
+        if size is None and os.path.exists(file_info["path"]):
+            size = os.path.getsize(file_info["path"])
+        return size if size is not None else self.avg_size
+
+    def send(self, channel_id, msk_time, post_time):
+        file_info = self.bot_data.get_next_file_from_channel(channel_id)
+        if not file_info:
+            self.failed[channel_id] += 1
+            self.exhausted.setdefault(channel_id, self.now())
+            return False
+
+        started = self.now()
+        duration = self.api_overhead + self.item_size(file_info) / self.bandwidth
+        self.elapsed += duration
+        self.posts.append({
+            "channel": channel_id,
+            "slot": msk_time,
+            "planned": post_time,
+            "started": started,
+            "finished": self.now(),
+            "waited": (started - self.tick_start).total_seconds(),
+            "tick": self.tick_start,
+        })
+        self.sends_per_tick[self.tick_start] += 1
+        return True
+
+    def apply_refills(self, until):
+        """Добавляет медиа в очереди по расписанию пополнения до момента until"""
+        for count, refill_time in self.refills:
+            day = self._last_refill_day.get(refill_time, self.start.date() - timedelta(days=1))
+            while True:
+                next_day = day + timedelta(days=1)
+                moment = datetime.combine(next_day, refill_time, tzinfo=self.scheduler.default_timezone)
+                if moment > until:
+                    break
+                for channel_id, channel in self.bot_data.channels.items():
+                    for _ in range(count):
+                        self._refill_seq += 1
+                        channel["media_queue"].append({
+                            "path": f"refill_{self._refill_seq}",
+                            "type": "photo",
+                            "size": self.random_size(),
+                        })
+                day = next_day
+            self._last_refill_day[refill_time] = day
+
+    def random_size(self):
+        return int(self.avg_size * random.uniform(0.5, 1.5))
+
+    def run(self):
+        while self.tick_start < self.end:
+            self.apply_refills(self.tick_start)
+            self.elapsed = 0.0
+            self.scheduler.check_posts()
+            if self.elapsed > self.window:
+                self.overrun_ticks += 1
+            # run_scheduler ждет интервал после завершения проверки
+            self.tick_start += timedelta(seconds=self.elapsed + self.interval)
+        return self.report()
+
+    def report(self):
+        channels = {}
+        by_channel = defaultdict(list)
+        for post in self.posts:
+            by_channel[post["channel"]].append(post)
+
+        for channel_id, channel in self.bot_data.channels.items():
+            posts = by_channel.get(channel_id, [])
+            expected = len(self.scheduler.get_plan(channel_id)["schedule"].occurrences(self.start, self.end))
+            lateness = [(p["finished"] - p["planned"]).total_seconds() for p in posts]
+            channels[channel_id] = {
+                "name": channel["name"],
+                "expected": expected,
+                "sent": len(posts),
+                "missed": max(0, expected - len(posts)),
+                "late": sum(1 for value in lateness if value > self.late_seconds),
+                "collisions": sum(1 for p in posts if p["waited"] > 0),
+                "max_wait_s": round(max((p["waited"] for p in posts), default=0.0), 1),
+                "failed_empty_queue": self.failed.get(channel_id, 0),
+                "queue_exhausted_at": self.exhausted[channel_id].isoformat(timespec="minutes")
+                if channel_id in self.exhausted else None,
+                "queue_left": len(channel["media_queue"]),
+            }
+
+        per_second = Counter(p["started"].replace(microsecond=0) for p in self.posts)
+        per_chat_minute = Counter((p["channel"], p["started"].replace(second=0, microsecond=0)) for p in self.posts)
+        return {
+            "days": self.days,
+            "posts": len(self.posts),
+            "peak_sends_per_tick": max(self.sends_per_tick.values(), default=0),
+            "ticks_with_collisions": sum(1 for count in self.sends_per_tick.values() if count > 1),
+            "window_overruns": self.overrun_ticks,
+            "peak_sends_per_second": max(per_second.values(), default=0),
+            "peak_sends_per_chat_minute": max(per_chat_minute.values(), default=0),
+            "rate_limit_exceeded": max(per_second.values(), default=0) > GLOBAL_LIMIT_PER_SECOND
+            or max(per_chat_minute.values(), default=0) > CHAT_LIMIT_PER_MINUTE,
+            "channels": channels,
+        }
+
+
+def synthetic_bot_data(path, admin_id, channels, slots, queue, avg_size, stagger):
+    """Строит набор каналов с равномерным расписанием между 09:00 и 21:00"""
+    bot_data = bot.BotData(path, admin_id, read_only=True)  # на диск симуляция не пишет
+    step = 12 * 60 // max(1, slots - 1) if slots > 1 else 0
+    for i in range(channels):
+        channel_id = -1000000000000 - i
+        times = []
+        for k in range(slots):
+            minute = (9 * 60 + k * step + i * stagger) % (24 * 60)
+            times.append(f"{minute // 60:02d}:{minute % 60:02d}")
+        bot_data.channels[channel_id] = {
+            "name": f"sim_{i}",
+            "media_folder": "",
+            "post_text": "",
+            "post_times": times,
+            "media_queue": mediaqueue.MediaQueue(
+                {"path": f"sim_{i}_{j}", "type": "photo", "size": int(avg_size * random.uniform(0.5, 1.5))}
+                for j in range(queue)
+            ),
+            "used_files": set(),
+            "used_hashes": set(),
+        }
+    return bot_data
+
+
+def parse_refill(value):
+    count, at = value.split("@")
+    hour, minute = map(int, at.split(":"))
+    return int(count), datetime.min.replace(hour=hour, minute=minute).time()
+
+
+def print_report(report):
+    print(f"Симуляция: {report['days']} дн., постов {report['posts']}")
+    print(f"  Пик отправок за один проход: {report['peak_sends_per_tick']}")
+    print(f"  Проходов с коллизиями: {report['ticks_with_collisions']}")
+    print(f"  Проходов дольше окна срабатывания: {report['window_overruns']}")
+    print(f"  Пик отправок в секунду: {report['peak_sends_per_second']} (лимит {GLOBAL_LIMIT_PER_SECOND})")
+    print(f"  Пик отправок в чат за минуту: {report['peak_sends_per_chat_minute']} (лимит {CHAT_LIMIT_PER_MINUTE})")
+    if report["rate_limit_exceeded"]:
+        print("  ⚠️ Лимиты Telegram будут превышены")
+    print()
+    header = f"{'канал':<20}{'ожид.':>7}{'отпр.':>7}{'пропуск':>9}{'опозд.':>8}{'коллиз.':>9}{'ожид.,с':>9}  очередь закончится"
+    print(header)
+    for channel in report["channels"].values():
+        print(
+            f"{channel['name'][:19]:<20}{channel['expected']:>7}{channel['sent']:>7}{channel['missed']:>9}"
+            f"{channel['late']:>8}{channel['collisions']:>9}{channel['max_wait_s']:>9}  "
+            f"{channel['queue_exhausted_at'] or '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yml")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--start", help="Начало симуляции, YYYY-MM-DD (по умолчанию сегодня)")
+    parser.add_argument("--channels", type=int, help="Синтетические каналы вместо файла данных")
+    parser.add_argument("--slots", type=int, default=4, help="Слотов в день у синтетического канала")
+    parser.add_argument("--stagger", type=int, default=0, help="Сдвиг слотов между синтетическими каналами, мин")
+    parser.add_argument("--queue", type=int, default=50, help="Медиа в очереди синтетического канала")
+    parser.add_argument("--avg-size-mb", type=float, default=5.0, help="Средний размер медиа, МБ")
+    parser.add_argument("--bandwidth-mbit", type=float, default=20.0, help="Пропускная способность выгрузки, Мбит/с")
+    parser.add_argument("--api-overhead", type=float, default=0.3, help="Накладные расходы на вызов API, с")
+    parser.add_argument("--random-offset", type=int, help="Разброс времени, мин (по умолчанию из конфига)")
+    parser.add_argument("--late-seconds", type=int, default=60, help="Порог опоздания поста, с")
+    parser.add_argument("--refill", action="append", default=[], help="Ежедневное пополнение: N@HH:MM")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести отчет в JSON")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(args.seed)
+
+    config = bot.load_config(args.config)
+    random_offset = args.random_offset if args.random_offset is not None else config["posts"]["random_offset_minutes"]
+    avg_size = int(args.avg_size_mb * 1024 * 1024)
+
+    workdir = tempfile.mkdtemp(prefix="bot-sim-")
+    try:
+        state_path = os.path.join(workdir, "bot_data.pkl")
+        admin_id = config["telegram"]["admin_id"]
+        if args.channels:
+            bot_data = synthetic_bot_data(state_path, admin_id, args.channels, args.slots, args.queue, avg_size, args.stagger)
+        else:
+            # Работаем с копией, чтобы симуляция не изменила настоящий файл данных
+            if os.path.exists(config["storage"]["data_file"]):
+                shutil.copyfile(config["storage"]["data_file"], state_path)
+            bot_data = bot.BotData(state_path, admin_id, read_only=True)
+
+        start_date = datetime.strptime(args.start, "%Y-%m-%d").date() if args.start else datetime.now(timezone.utc).date()
+        start = datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc)
+        simulation = Simulation(
+            bot_data, start, args.days,
+            bandwidth_mbit=args.bandwidth_mbit,
+            api_overhead=args.api_overhead,
+            avg_size=avg_size,
+            late_seconds=args.late_seconds,
+            refills=[parse_refill(value) for value in args.refill],
+            timezone_offset=config["posts"]["timezone_offset"],
+            default_timezone=config["posts"].get("timezone"),
+            random_offset=random_offset,
+        )
+        report = simulation.run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
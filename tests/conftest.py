@@ -0,0 +1,17 @@
+"""Общие настройки тестов: модули бота и bench импортируются из корня репозитория"""
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, "bench")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Временный рабочий каталог: файлы данных и папки каналов создаются относительно него"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
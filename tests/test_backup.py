@@ -0,0 +1,130 @@
+"""Резервная копия: экспорт, оборванный импорт и его продолжение"""
+import gzip
+
+import pytest
+
+import backup
+import bot
+import history
+import mediaqueue
+
+
+@pytest.fixture
+def source(workdir):
+    bot_data = bot.BotData(str(workdir / "source.pkl"), admin_id=1)
+    bot_data.ensure_loaded()
+    bot_data.add_channel(-100, "Котики", "{name} {date}", ["10:00", "пн,ср 18:30"])
+    bot_data.add_channel(-200, "Собаки", "", ["12:00"])
+    queue = bot_data.channels[-100]["media_queue"]
+    queue.extend({"path": f"media/{i}.jpg", "type": "photo", "size": i} for i in range(1200))
+    queue.bump("media/700.jpg")
+    queue.append({"path": "media/filler.jpg", "type": "photo"}, "filler")
+    bot_data.channels[-100]["used_files"].update(f"media/old_{i}.jpg" for i in range(30))
+    bot_data.users[2] = {"role": "moderator", "channels": [-200]}
+    bot_data.save_data()
+
+    post_history = history.PostHistory(str(workdir / "source_history.jsonl"))
+    for i in range(1200):
+        post_history.record({"channel_id": -100, "planned": f"2024-03-04T10:{i % 60:02d}", "status": "sent"})
+    return bot_data, post_history
+
+
+def export(source, workdir):
+    bot_data, post_history = source
+    path = str(workdir / "backup.jsonl.gz")
+    report = backup.export_state(bot_data, path, post_history)
+    return path, report
+
+
+def truncate(path, workdir, keep):
+    """Копия, оборванная после keep записей: без записи end"""
+    truncated = str(workdir / "truncated.jsonl.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = f.readlines()
+    with gzip.open(truncated, "wt", encoding="utf-8") as f:
+        f.writelines(lines[:keep + 1])
+    return truncated
+
+
+def queues(bot_data):
+    return {cid: (channel["media_queue"].policy, list(channel["media_queue"].entries()))
+            for cid, channel in bot_data.channels.items()}
+
+
+def test_export_report(source, workdir):
+    path, report = export(source, workdir)
+    assert report["channels"] == 2
+    assert report["queue"] == 1201
+    assert report["history"] == 1200
+    header, records = backup.read_backup(path)
+    assert header["counts"]["queue"] == 1201
+    assert list(records)[-1] == {"type": "end", "records": report["records"]}
+
+
+def test_resumed_import_round_trip(source, workdir):
+    bot_data, post_history = source
+    path, report = export(source, workdir)
+    target = bot.BotData(str(workdir / "target.pkl"), admin_id=1)
+    target_history = history.PostHistory(str(workdir / "target_history.jsonl"))
+
+    # Копия оборвалась посреди истории: часть записей уже применена и отмечена
+    truncated = truncate(path, workdir, report["records"] - 1)
+    progress = str(workdir / "import.progress")
+    with pytest.raises(backup.BackupError, match="end"):
+        backup.import_state(target, truncated, target_history, replace=True, progress_path=progress, checkpoint=0)
+    assert backup._read_progress(progress)["records"] == report["records"] - 1
+
+    result = backup.import_state(target, path, target_history, replace=True, progress_path=progress, checkpoint=0)
+    assert result["resumed_from"] == report["records"] - 1
+    assert result["records"] == report["records"]
+
+    # Файл данных после импорта совпадает с исходным состоянием
+    restored = bot.BotData(target.data_file, admin_id=1)
+    assert queues(restored) == queues(bot_data)
+    assert restored.channels[-100]["media_queue"].lane_of("media/700.jpg") == "urgent"
+    assert restored.channels[-100]["used_files"] == bot_data.channels[-100]["used_files"]
+    assert restored.channels[-100]["post_times"] == ["10:00", "пн,ср 18:30"]
+    assert restored.users[2] == {"role": "moderator", "channels": [-200]}
+    assert sorted(restored.users[1]["channels"]) == [-200, -100]
+    # История не задублировалась при повторе
+    assert len(target_history.entries()) == 1200
+
+
+def test_corrupted_gzip_is_reported(source, workdir):
+    path, _ = export(source, workdir)
+    with open(path, "rb") as f:
+        data = f.read()
+    broken = str(workdir / "broken.jsonl.gz")
+    with open(broken, "wb") as f:
+        f.write(data[:len(data) // 2])
+
+    target = bot.BotData(str(workdir / "target.pkl"), admin_id=1)
+    with pytest.raises(backup.BackupError):
+        backup.import_state(target, broken, progress_path=str(workdir / "broken.progress"))
+
+
+def test_not_a_backup(workdir):
+    path = workdir / "notes.gz"
+    with gzip.open(path, "wt") as f:
+        f.write('{"format": "other"}\n')
+    with pytest.raises(backup.BackupError, match="не резервная копия"):
+        backup.read_backup(str(path))
+
+
+def test_export_refused_during_import(source, workdir):
+    bot_data, _ = source
+    with backup._import_lock:
+        with pytest.raises(backup.BackupError, match="идет импорт"):
+            backup.snapshot(bot_data)
+
+
+def test_policy_survives_round_trip(source, workdir):
+    bot_data, _ = source
+    bot_data.channels[-200]["media_queue"] = mediaqueue.MediaQueue(
+        [{"path": "a", "type": "photo", "source": "x"}, {"path": "b", "type": "photo", "source": "y"}],
+        policy="interleave",
+    )
+    path, _ = export(source, workdir)
+    target = bot.BotData(str(workdir / "target.pkl"), admin_id=1)
+    backup.import_state(target, path, progress_path=str(workdir / "import.progress"))
+    assert queues(target)[-200] == queues(bot_data)[-200]
@@ -0,0 +1,79 @@
+"""Хранилище BotData: отложенная запись (write-behind) и ее блокировки"""
+import pickle
+import threading
+
+import bot
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def make_data(workdir):
+    bot_data = bot.BotData(str(workdir / "bot_data.pkl"), admin_id=1)
+    bot_data.ensure_loaded()  # создает владельца и записывает файл
+    return bot_data
+
+
+def test_flush_writes_only_dirty_state(workdir):
+    bot_data = make_data(workdir)
+    assert not bot_data.flush()
+
+    bot_data.user_sessions[1] = {"state": "adding_media"}
+    bot_data.mark_dirty()
+    assert bot_data.flush()
+    assert load(bot_data.data_file)["user_sessions"] == {1: {"state": "adding_media"}}
+    assert not bot_data.flush()
+
+
+def test_flush_waits_for_pending_change(workdir):
+    bot_data = make_data(workdir)
+    bot_data.mark_dirty()
+    flushed = threading.Event()
+
+    with bot_data.changing():
+        thread = threading.Thread(target=lambda: bot_data.flush() and flushed.set())
+        thread.start()
+        # Пока изменение не закончено, запись не сериализует данные наполовину
+        assert not flushed.wait(0.2)
+        bot_data.user_sessions[1] = {"state": "edit_channel"}
+    thread.join(5)
+
+    assert flushed.is_set()
+    assert load(bot_data.data_file)["user_sessions"] == {1: {"state": "edit_channel"}}
+
+
+def test_write_behind_stops(workdir):
+    bot_data = make_data(workdir)
+    thread = bot_data.start_write_behind(0.05)
+    bot_data.user_sessions[1] = {"state": "adding_media"}
+    bot_data.mark_dirty()
+
+    bot_data.stop_write_behind()
+    thread.join(1)
+    assert not thread.is_alive()
+
+
+def test_write_behind_flushes_periodically(workdir):
+    bot_data = make_data(workdir)
+    thread = bot_data.start_write_behind(0.05)
+    try:
+        bot_data.user_sessions[1] = {"state": "adding_media"}
+        bot_data.mark_dirty()
+        for _ in range(40):
+            if load(bot_data.data_file)["user_sessions"]:
+                break
+            threading.Event().wait(0.05)
+        assert load(bot_data.data_file)["user_sessions"] == {1: {"state": "adding_media"}}
+    finally:
+        bot_data.stop_write_behind()
+        thread.join(1)
+
+
+def test_read_only_never_writes(workdir):
+    bot_data = bot.BotData(str(workdir / "bot_data.pkl"), admin_id=1, read_only=True)
+    bot_data.ensure_loaded()
+    bot_data.mark_dirty()
+    bot_data.flush()
+    assert not (workdir / "bot_data.pkl").exists()
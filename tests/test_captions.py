@@ -0,0 +1,107 @@
+"""Шаблоны подписей: подстановка, лимит Telegram в UTF-16, старые тексты"""
+from datetime import datetime
+
+import pytest
+
+import bot
+import captions
+
+
+def context(**fields):
+    return {"local": datetime(2024, 3, 4, 10, 30), "number": 3, "remaining": 7, **fields}
+
+
+def test_render_variables():
+    compiled = captions.compile_caption(
+        "{name}: {date} {time}, {weekday} {date:%d} {month} - №{number}, осталось {remaining}, {type}",
+        name="Котики",
+    )
+    text = compiled.render(context(item={"type": "photo"}))
+    assert text == "Котики: 04.03.2024 10:30, понедельник 04 марта - №3, осталось 7, фото"
+
+
+def test_rotate_by_post_number():
+    compiled = captions.compile_caption("{rotate:#a|#b|#c}")
+    assert [compiled.render(context(number=n)) for n in (1, 2, 3, 4)] == ["#a", "#b", "#c", "#a"]
+
+
+def test_escaped_braces_and_constant():
+    compiled = captions.compile_caption("{{текст}}")
+    assert compiled.constant == "{текст}"
+    assert compiled.render({}) == "{текст}"
+
+
+@pytest.mark.parametrize("text, message", [
+    ("{неизвестно}", "Неизвестная переменная"),
+    ("скобка { без пары", "Непарная фигурная скобка"),
+    ("{rotate:один}", "два варианта"),
+])
+def test_template_errors(text, message):
+    with pytest.raises(captions.CaptionError, match=message):
+        captions.compile_caption(text)
+
+
+def test_length_counts_utf16_units():
+    assert captions.caption_length("abc") == 3
+    assert captions.caption_length("я") == 1
+    assert captions.caption_length("😀") == 2
+
+
+def test_limit_in_utf16():
+    # 512 эмодзи - 512 символов Python, но 1024 единицы UTF-16: ровно лимит
+    assert captions.compile_caption("😀" * 512).max_length == captions.CAPTION_LIMIT
+    with pytest.raises(captions.CaptionError, match="1026"):
+        captions.compile_caption("😀" * 513)
+
+
+def test_limit_reserves_variable_width():
+    text = "x" * (captions.CAPTION_LIMIT - captions.NUMBER_WIDTH)
+    captions.compile_caption(text + "{number}")
+    with pytest.raises(captions.CaptionError):
+        captions.compile_caption(text + "!{number}")
+
+
+def test_render_truncates_oversized_number():
+    text = "x" * (captions.CAPTION_LIMIT - captions.NUMBER_WIDTH)
+    rendered = captions.compile_caption(text + "{number}").render(context(number=10 ** 12))
+    assert captions.caption_length(rendered) == captions.CAPTION_LIMIT
+
+
+def test_literal_keeps_text():
+    assert captions.literal("{старый текст}").render({}) == "{старый текст}"
+
+
+@pytest.fixture
+def bot_data(workdir):
+    data = bot.BotData(str(workdir / "bot_data.pkl"), admin_id=1)
+    data.ensure_loaded()
+    return data
+
+
+def add_legacy_channel(bot_data, channel_id, post_text):
+    # Канал из данных, сохраненных до появления шаблонов: текст не проверялся
+    bot_data.channels[channel_id] = {
+        "name": "старое", "media_folder": "", "post_text": post_text, "post_times": ["10:00"],
+        "timezone": None, "media_queue": [], "used_files": set(), "used_hashes": set(), "post_count": 0,
+    }
+
+
+def test_rename_keeps_legacy_caption(bot_data):
+    add_legacy_channel(bot_data, -100, "Цены {от 100}")
+    assert bot_data.update_channel(-100, name="новое")
+    assert bot_data.channels[-100]["name"] == "новое"
+    assert bot_data.caption(-100).render(context()) == "Цены {от 100}"
+
+
+def test_new_text_is_still_validated(bot_data):
+    add_legacy_channel(bot_data, -100, "Цены {от 100}")
+    with pytest.raises(captions.CaptionError):
+        bot_data.update_channel(-100, post_text="{неизвестно}")
+    assert bot_data.channels[-100]["post_text"] == "Цены {от 100}"
+
+
+def test_rename_over_limit_is_rejected(bot_data):
+    add_legacy_channel(bot_data, -100, "x" * 1000 + "{name}")
+    with pytest.raises(captions.CaptionError):
+        bot_data.update_channel(-100, name="я" * 100)
+    assert bot_data.channels[-100]["name"] == "старое"
@@ -0,0 +1,54 @@
+import pytest
+import telebot
+from telebot import apihelper
+
+from fake_api import FakeTelegramAPI
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server = FakeTelegramAPI(file_size=1024, seed=1).start()
+    monkeypatch.setattr(apihelper, "API_URL", server.api_url)
+    monkeypatch.setattr(apihelper, "FILE_URL", server.file_url)
+    yield server
+    server.stop()
+
+
+def test_send_message_is_recorded(api):
+    bot = telebot.TeleBot("123456:TEST")
+    message = bot.send_message(42, "привет")
+    assert message.chat.id == 42
+    assert message.text == "привет"
+    assert api.calls["sendMessage"] == 1
+    assert api.sent[0][:2] == ("sendMessage", 42)
+
+
+def test_get_updates_returns_pushed_updates_in_order(api):
+    bot = telebot.TeleBot("123456:TEST")
+    first = api.push_update({"message": {"message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "text": "a"}})
+    api.push_update({"message": {"message_id": 2, "date": 0, "chat": {"id": 7, "type": "private"}, "text": "b"}})
+    updates = bot.get_updates(offset=0, timeout=1)
+    assert [update.message.text for update in updates] == ["a", "b"]
+    assert updates[0].update_id == first
+    api.push_update({"message": {"message_id": 3, "date": 0, "chat": {"id": 7, "type": "private"}, "text": "c"}})
+    # offset подтверждает уже полученные апдейты
+    assert [update.message.text for update in bot.get_updates(offset=updates[-1].update_id + 1, timeout=1)] == ["c"]
+
+
+def test_message_over_limit_is_rejected(api):
+    bot = telebot.TeleBot("123456:TEST")
+    with pytest.raises(apihelper.ApiTelegramException) as error:
+        bot.send_message(42, "x" * 5000)
+    assert error.value.error_code == 400
+
+
+def test_throttling_answers_429_with_retry_after(monkeypatch):
+    server = FakeTelegramAPI(throttle_rate=1.0, retry_after=3, seed=1).start()
+    monkeypatch.setattr(apihelper, "API_URL", server.api_url)
+    try:
+        with pytest.raises(apihelper.ApiTelegramException) as error:
+            telebot.TeleBot("123456:TEST").send_message(42, "x")
+        assert error.value.error_code == 429
+        assert error.value.result_json["parameters"]["retry_after"] == 3
+    finally:
+        server.stop()
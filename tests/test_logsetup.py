@@ -0,0 +1,55 @@
+"""Настройка логирования через очередь"""
+import json
+import logging
+
+import pytest
+
+import logsetup
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    logsetup.stop_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+@pytest.mark.parametrize("level, expected", [("info", logging.INFO), ("Warning", logging.WARNING), ("DEBUG", logging.DEBUG)])
+def test_level_in_any_case(root_logger, tmp_path, level, expected):
+    logsetup.setup_logging({"level": level, "file": str(tmp_path / "bot.log")})
+    assert root_logger.level == expected
+
+
+def test_records_reach_file_with_context(root_logger, tmp_path):
+    path = tmp_path / "bot.log"
+    logsetup.setup_logging({"level": "info", "file": str(path)}, worker=2)
+    with logsetup.log_context(channel_id=-100):
+        logging.getLogger("test").info("пост %s", "отправлен", extra={"event": "post_sent"})
+    logging.getLogger("test").debug("не попадет в лог")
+    logsetup.stop_logging()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 1
+    assert records[0]["msg"] == "пост отправлен"
+    assert records[0]["channel_id"] == -100
+    assert records[0]["worker"] == 2
+    assert records[0]["event"] == "post_sent"
+
+
+def test_sampling_keeps_warnings(root_logger, tmp_path):
+    path = tmp_path / "bot.log"
+    logsetup.setup_logging({"file": str(path), "sample": {"media_upload": 10}})
+    logger = logging.getLogger("test")
+    for _ in range(20):
+        logger.info("загрузка", extra={"event": "media_upload"})
+    logger.warning("ошибка загрузки", extra={"event": "media_upload"})
+    logsetup.stop_logging()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
@@ -0,0 +1,125 @@
+"""Очередь медиа: порядок полос, ленивое удаление, смена политики"""
+import pickle
+import random
+
+import pytest
+
+import mediaqueue
+
+
+def media(path, source=None):
+    item = {"path": path, "type": "photo"}
+    if source:
+        item["source"] = source
+    return item
+
+
+def paths(queue):
+    return [item["path"] for item in queue]
+
+
+def test_lane_order():
+    queue = mediaqueue.MediaQueue()
+    queue.append(media("filler"), "filler")
+    queue.append(media("a"))
+    queue.append(media("b"))
+    queue.append(media("urgent"), "urgent")
+
+    assert paths(queue) == ["urgent", "a", "b", "filler"]
+    assert [queue.pop()["path"] for _ in range(4)] == ["urgent", "a", "b", "filler"]
+    assert queue.pop() is None
+
+
+def test_duplicate_path_is_ignored():
+    queue = mediaqueue.MediaQueue([media("a")])
+    assert not queue.append(media("a"), "urgent")
+    assert queue.lane_counts() == {"urgent": 0, "normal": 1, "filler": 0}
+
+
+def test_unknown_lane_and_policy():
+    with pytest.raises(mediaqueue.QueueError):
+        mediaqueue.MediaQueue().append(media("a"), "later")
+    with pytest.raises(mediaqueue.QueueError):
+        mediaqueue.MediaQueue(policy="lifo")
+
+
+def test_move_and_bump():
+    queue = mediaqueue.MediaQueue(media(str(i)) for i in range(4))
+    queue.move("3", position="top")
+    queue.move("0", position="bottom")
+    queue.bump("2")
+
+    assert paths(queue) == ["2", "3", "1", "0"]
+    assert queue.lane_of("2") == "urgent"
+    assert queue.at(2)["path"] == "3"
+
+
+def test_lazy_removal():
+    queue = mediaqueue.MediaQueue(media(str(i)) for i in range(5))
+    assert queue.remove("0")["path"] == "0"
+    assert queue.remove("0") is None
+    assert queue.remove_paths(["2", "4", "missing"]) == 2
+
+    # Удаленные записи еще лежат в куче, но не выдаются и не считаются
+    assert len(queue._heaps["normal"]) == 5
+    assert len(queue) == 2
+    assert "2" not in queue
+    assert paths(queue) == ["1", "3"]
+    assert queue.pop()["path"] == "1"
+
+
+def test_compaction_drops_stale_entries():
+    queue = mediaqueue.MediaQueue(media(str(i)) for i in range(200))
+    queue.remove_paths(str(i) for i in range(1, 200, 2))
+    queue.remove_paths(str(i) for i in range(0, 180, 2))
+
+    # Удаленных стало больше живых (с запасом 64) - кучи перестроены
+    assert len(queue) == 10
+    assert len(queue._heaps["normal"]) < 100
+    assert paths(queue) == [str(i) for i in range(180, 200, 2)]
+
+
+def test_set_policy_interleave():
+    queue = mediaqueue.MediaQueue(
+        [media("a1", "a"), media("a2", "a"), media("a3", "a"), media("b1", "b"), media("b2", "b")]
+    )
+    queue.set_policy("interleave")
+    assert paths(queue) == ["a1", "b1", "a2", "b2", "a3"]
+
+    queue.append(media("c1", "c"))
+    assert paths(queue) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_set_policy_shuffle_keeps_lanes():
+    random.seed(3)
+    queue = mediaqueue.MediaQueue(media(str(i)) for i in range(20))
+    queue.append(media("urgent"), "urgent")
+    queue.set_policy("shuffle")
+
+    order = paths(queue)
+    assert order[0] == "urgent"
+    assert sorted(order[1:]) == sorted(str(i) for i in range(20))
+
+    queue.set_policy("fifo")
+    assert paths(queue) == order
+    queue.append(media("last"))
+    assert paths(queue)[-1] == "last"
+
+
+def test_pickle_round_trip():
+    queue = mediaqueue.MediaQueue((media(str(i)) for i in range(5)), policy="interleave")
+    queue.append(media("urgent"), "urgent")
+    queue.remove("2")
+
+    copy = pickle.loads(pickle.dumps(queue))
+    assert copy.policy == "interleave"
+    assert list(copy.entries()) == list(queue.entries())
+    copy.append(media("new"))
+    assert "new" not in queue
+
+
+def test_restore_bypasses_policy():
+    queue = mediaqueue.MediaQueue(policy="shuffle")
+    entries = [("normal", media(str(i))) for i in range(10)] + [("filler", media("f"))]
+    assert queue.restore(entries) == 11
+    assert list(queue.entries()) == entries
@@ -0,0 +1,104 @@
+"""Разбор и компиляция расписаний, расчет следующего срабатывания"""
+from datetime import datetime, timezone
+
+import pytest
+
+import schedule
+
+UTC = timezone.utc
+
+
+@pytest.fixture
+def berlin():
+    try:
+        return schedule.get_timezone("Europe/Berlin")
+    except schedule.ScheduleError:
+        pytest.skip("нет базы часовых поясов IANA")
+
+
+@pytest.mark.parametrize("text, specs", [
+    ("10:00, 14:00", ["10:00", "14:00"]),
+    ("mon,wed 18:30", ["mon,wed 18:30"]),
+    ("пн,ср 10:00, 12:00", ["пн,ср 10:00", "12:00"]),
+    ("пн-пт 09:00, сб,вс 12:00", ["пн-пт 09:00", "сб,вс 12:00"]),
+    ("10:00; cron: 0 9,18 * * 1-5", ["10:00", "cron: 0 9,18 * * 1-5"]),
+])
+def test_split_specs(text, specs):
+    assert schedule.split_specs(text) == specs
+
+
+@pytest.mark.parametrize("text", ["10:00, mon", "пн,ср"])
+def test_split_specs_rejects_bare_weekdays(text):
+    with pytest.raises(schedule.ScheduleError, match="Не указано время"):
+        schedule.split_specs(text)
+
+
+def test_compile_rejects_bare_weekdays():
+    with pytest.raises(schedule.ScheduleError, match="Не указано время"):
+        schedule.compile_schedule(["mon"], UTC)
+
+
+def test_weekday_list():
+    compiled = schedule.compile_schedule("mon,wed 18:30", UTC)
+    # 2024-03-04 - понедельник
+    fired = compiled.occurrences(datetime(2024, 3, 4, tzinfo=UTC), datetime(2024, 3, 11, tzinfo=UTC))
+    assert [o.fire_at for o in fired] == [
+        datetime(2024, 3, 4, 18, 30, tzinfo=UTC),
+        datetime(2024, 3, 6, 18, 30, tzinfo=UTC),
+    ]
+
+
+def test_weekday_range_wraps_week():
+    compiled = schedule.compile_schedule("сб-пн 09:00", UTC)
+    fired = compiled.occurrences(datetime(2024, 3, 4, tzinfo=UTC), datetime(2024, 3, 11, tzinfo=UTC))
+    assert [o.local.weekday() for o in fired] == [0, 5, 6]
+
+
+def test_next_after_is_strict():
+    compiled = schedule.compile_schedule("10:00, 14:00", UTC)
+    moment = datetime(2024, 3, 4, 10, 0, tzinfo=UTC)
+    assert compiled.next_after(moment).fire_at == datetime(2024, 3, 4, 14, 0, tzinfo=UTC)
+    assert compiled.next_after(datetime(2024, 3, 4, 14, 0, tzinfo=UTC)).fire_at == datetime(2024, 3, 5, 10, 0, tzinfo=UTC)
+
+
+def test_interval_window():
+    compiled = schedule.compile_schedule(["каждые 2ч 09:00-15:00"], UTC)
+    assert compiled.slots_per_day == 4
+
+
+def test_cron_weekdays():
+    compiled = schedule.compile_schedule(["cron: 0 9 * * 1-5"], UTC)
+    fired = compiled.occurrences(datetime(2024, 3, 4, tzinfo=UTC), datetime(2024, 3, 11, tzinfo=UTC))
+    assert len(fired) == 5
+    assert all(o.local.weekday() < 5 for o in fired)
+
+
+def test_fixed_offset_timezone():
+    compiled = schedule.compile_schedule("10:00", schedule.get_timezone("UTC+3"))
+    occurrence = compiled.next_after(datetime(2024, 3, 4, tzinfo=UTC))
+    assert occurrence.fire_at == datetime(2024, 3, 4, 7, 0, tzinfo=UTC)
+    assert occurrence.label == "10:00"
+
+
+def test_dst_gap_moves_forward(berlin):
+    # 2024-03-31 в Берлине часы переводятся с 02:00 на 03:00: 02:30 не существует
+    compiled = schedule.compile_schedule("02:30", berlin)
+    occurrence = compiled.next_after(datetime(2024, 3, 30, 12, 0, tzinfo=UTC))
+    assert occurrence.fire_at == datetime(2024, 3, 31, 1, 30, tzinfo=UTC)
+    assert occurrence.label == "03:30"
+    following = compiled.next_after(occurrence.fire_at)
+    assert following.fire_at == datetime(2024, 4, 1, 0, 30, tzinfo=UTC)
+
+
+def test_dst_gap_does_not_duplicate_slot(berlin):
+    # 02:30 сдвигается на 03:30 и совпадает с отдельной записью 03:30 - срабатывание одно
+    compiled = schedule.compile_schedule("02:30, 03:30", berlin)
+    fired = compiled.occurrences(datetime(2024, 3, 31, tzinfo=UTC), datetime(2024, 3, 31, 12, tzinfo=UTC))
+    assert [o.fire_at for o in fired] == [datetime(2024, 3, 31, 1, 30, tzinfo=UTC)]
+
+
+def test_dst_fold_fires_once(berlin):
+    # 2024-10-27 час 02:00-03:00 повторяется дважды; срабатываем в первый раз
+    compiled = schedule.compile_schedule("02:30", berlin)
+    fired = compiled.occurrences(datetime(2024, 10, 26, 12, tzinfo=UTC), datetime(2024, 10, 27, 12, tzinfo=UTC))
+    assert [o.fire_at for o in fired] == [datetime(2024, 10, 27, 0, 30, tzinfo=UTC)]
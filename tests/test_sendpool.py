@@ -0,0 +1,117 @@
+"""Пул ботов: переключение на другого бота только если пост точно не вышел"""
+import pytest
+import requests
+from telebot import apihelper
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import sendpool
+
+CHAT_ID = -1000000000000  # закреплен за первым ботом пула
+
+
+def api_error(code, description, parameters=None):
+    class Response:
+        status_code = code
+        text = ""
+
+    result = {"ok": False, "error_code": code, "description": description, "parameters": parameters or {}}
+    return apihelper.ApiTelegramException("sendPhoto", Response(), result)
+
+
+def connection_refused():
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused")))
+
+
+class FakeBot:
+    def __init__(self, index, error=None):
+        self.token = f"{index}:secret"
+        self.error = error
+        self.calls = 0
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return "sent"
+
+
+def make_pool(first_error):
+    bots = [FakeBot(0, first_error), FakeBot(1)]
+    return sendpool.SendPool(bots, max_wait=0), bots
+
+
+@pytest.mark.parametrize("error, expected", [
+    (requests.exceptions.ConnectTimeout("connect timeout"), True),
+    (requests.exceptions.ProxyError("proxy"), True),
+    (requests.exceptions.SSLError("handshake"), True),
+    (connection_refused(), True),
+    (requests.exceptions.ConnectionError(ProtocolError("Connection aborted.")), False),
+    (requests.exceptions.ConnectionError(), False),
+    (requests.exceptions.ReadTimeout("read timeout"), False),
+    (ValueError("other"), False),
+])
+def test_not_delivered(error, expected):
+    assert sendpool._not_delivered(error) is expected
+
+
+@pytest.mark.parametrize("error, reason", [
+    (api_error(429, "Too Many Requests", {"retry_after": 100}), "throttled"),
+    (api_error(403, "Forbidden: bot is not a member"), "forbidden"),
+    (api_error(400, "Bad Request: need administrator rights in the channel chat"), "forbidden"),
+    (api_error(400, "Bad Request: can't parse entities"), None),
+    (api_error(502, "Bad Gateway"), None),
+])
+def test_handle_api_error(error, reason):
+    pool, _ = make_pool(None)
+    assert pool._handle_api_error(pool.slots[0], CHAT_ID, error) == reason
+
+
+def test_handle_api_error_marks_slot():
+    pool, _ = make_pool(None)
+    slot = pool.slots[0]
+
+    pool._handle_api_error(slot, CHAT_ID, api_error(429, "Too Many Requests", {"retry_after": 100}))
+    assert pool.status()[0][1] > 90
+
+    pool._handle_api_error(slot, CHAT_ID, api_error(403, "Forbidden"))
+    assert CHAT_ID in slot.forbidden
+
+
+def test_block_keeps_longer_pause():
+    pool, _ = make_pool(None)
+    slot = pool.slots[0]
+    slot.block(100)
+    slot.block(1)
+    assert pool.status()[0][1] > 90
+
+
+@pytest.mark.parametrize("error", [
+    api_error(429, "Too Many Requests", {"retry_after": 100}),
+    api_error(403, "Forbidden"),
+    connection_refused(),
+])
+def test_failover_when_not_delivered(error):
+    pool, bots = make_pool(error)
+    assert pool.call("send_photo", CHAT_ID, photo=None) == "sent"
+    assert [bot.calls for bot in bots] == [1, 1]
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ReadTimeout("read timeout"),
+    requests.exceptions.ConnectionError(ProtocolError("Connection aborted.")),
+    api_error(502, "Bad Gateway"),
+    api_error(400, "Bad Request: can't parse entities"),
+])
+def test_reraise_when_maybe_delivered(error):
+    pool, bots = make_pool(error)
+    with pytest.raises(type(error)):
+        pool.call("send_photo", CHAT_ID, photo=None)
+    # Второй бот не пробовали: пост мог уже выйти
+    assert [bot.calls for bot in bots] == [1, 0]
+
+
+def test_preferred_bot_is_used_first():
+    pool, bots = make_pool(None)
+    pool.call("send_photo", CHAT_ID, photo=None)
+    pool.call("send_photo", CHAT_ID - 1, photo=None)
+    assert [bot.calls for bot in bots] == [1, 1]
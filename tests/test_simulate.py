@@ -0,0 +1,49 @@
+"""Симуляция на виртуальных часах: число постов совпадает с числом слотов"""
+import random
+from datetime import datetime, timezone
+
+import simulate
+
+
+def run_simulation(workdir, channels, slots, queue, days=2, stagger=0):
+    random.seed(1)
+    bot_data = simulate.synthetic_bot_data(
+        str(workdir / "bot_data.pkl"), 1, channels, slots, queue, avg_size=1024, stagger=stagger
+    )
+    start = datetime(2024, 3, 4, tzinfo=timezone.utc)
+    simulation = simulate.Simulation(
+        bot_data, start, days, bandwidth_mbit=100, api_overhead=0.1, avg_size=1024,
+        timezone_offset=3, random_offset=0,
+    )
+    return simulation.run()
+
+
+def test_every_slot_is_posted(workdir):
+    report = run_simulation(workdir, channels=3, slots=4, queue=50, stagger=5)
+
+    assert report["posts"] == 3 * 4 * 2
+    for channel in report["channels"].values():
+        assert channel["expected"] == 4 * 2
+        assert channel["sent"] == 4 * 2
+        assert channel["missed"] == 0
+        assert channel["queue_left"] == 50 - 4 * 2
+    assert not report["rate_limit_exceeded"]
+
+
+def test_exhausted_queue_is_reported(workdir):
+    report = run_simulation(workdir, channels=1, slots=4, queue=3)
+
+    channel = next(iter(report["channels"].values()))
+    assert channel["sent"] == 3
+    assert channel["missed"] == 4 * 2 - 3
+    # пустая очередь повторяется в пределах окна срабатывания
+    assert channel["failed_empty_queue"] >= 4 * 2 - 3
+    assert channel["queue_exhausted_at"] is not None
+
+
+def test_same_slot_posts_collide(workdir):
+    report = run_simulation(workdir, channels=4, slots=2, queue=10, days=1)
+
+    assert report["posts"] == 4 * 2
+    assert report["peak_sends_per_tick"] == 4
+    assert report["ticks_with_collisions"] == 2
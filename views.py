@@ -0,0 +1,284 @@
+"""Постраничные представления: статус, список каналов и список пользователей.
+
+Сообщение Telegram ограничено 4096 символами, поэтому длинные списки делятся
+на страницы с инлайн-кнопками ◀️/▶️. Разбиение на страницы и тексты блоков
+кэшируются по набору доступных каналов и версии BotData (она растет при
+каждом изменении данных); ближайшие срабатывания канала пересчитываются,
+только когда меняется его план.
+"""
+import os
+import threading
+from datetime import timedelta
+from itertools import islice
+
+from telebot import types
+
+import history
+import mediaqueue
+import schedule
+
+PAGE_LIMIT = 3500  # запас до 4096 на заголовок страницы
+MAX_SCHEDULE_ROWS = 12  # строк расписания на канал в статусе
+CALLBACK_PREFIX = "page"
+
+TITLES = {
+    "status": "📊 Статус",
+    "channels": "📋 Список всех каналов",
+    "users": "👥 Список пользователей",
+    "history": "📜 История постов (сначала проблемные каналы)",
+}
+
+EMPTY = {
+    "status": "❌ Нет доступных каналов для просмотра",
+    "channels": "❌ Нет добавленных каналов",
+    "users": "❌ Нет пользователей",
+    "history": "❌ История постов пуста или отключена (storage.history_file)",
+}
+
+SLOW_HOURS = 2  # сколько самых медленных часов суток показывать по каналу
+QUEUE_PREVIEW = 15  # сколько первых медиа показывать в очереди канала
+
+
+def queue_summary(queue):
+    """'120 медиа (срочные 2, заполнители 30; вперемешку)'"""
+    counts = queue.lane_counts()
+    lanes = [f"{mediaqueue.LANE_TITLES[lane]} {counts[lane]}" for lane in ("urgent", "filler") if counts[lane]]
+    details = "; ".join(filter(None, [", ".join(lanes), mediaqueue.POLICY_TITLES[queue.policy]]))
+    return f"{len(queue)} медиа ({details})"
+
+
+def queue_preview(channel_data, limit=QUEUE_PREVIEW):
+    """Первые limit медиа канала в порядке выдачи с номерами для команд /bump, /move, /remove"""
+    queue = channel_data["media_queue"]
+    counts = queue.lane_counts()
+    lines = [
+        f"🗂 Очередь '{channel_data['name']}': {len(queue)} медиа, {mediaqueue.POLICY_TITLES[queue.policy]}",
+        "   " + ", ".join(f"{mediaqueue.LANE_ICONS[lane]} {mediaqueue.LANE_TITLES[lane]}: {counts[lane]}" for lane in mediaqueue.LANES),
+    ]
+    for index, (lane, item) in enumerate(islice(queue.entries(), limit), 1):
+        lines.append(f"{index}. {mediaqueue.LANE_ICONS[lane]} {item['type']} {os.path.basename(item['path'])}")
+    if len(queue) > limit:
+        lines.append(f"… еще {len(queue) - limit}")
+    return "\n".join(lines)
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+
+class PagedViews:
+    def __init__(self, bot_data, scheduler, page_limit=PAGE_LIMIT):
+        self.bot_data = bot_data
+        self.scheduler = scheduler
+        self.page_limit = page_limit
+        self._lock = threading.Lock()
+        self._pages = {}  # {(view, ключ доступа): (версия, [[id, ...], ...])}
+        self._blocks = {}  # {(view, id): (версия, текст)} для представлений без времени
+        self._rows = {}  # {channel_id: (ключ плана, действует до, [(метка, момент)])}
+        self._stats = (None, {})  # (версия истории, history.channel_stats)
+
+    def access_key(self, view, user_id):
+        """Пользователи с одинаковым набором доступных каналов делят кэш страниц"""
+        if view == "status" and not self.bot_data.has_permission(user_id, "admin"):
+            return frozenset(self.bot_data.get_accessible_channels(user_id))
+        return "all"
+
+    def version(self, view):
+        """Ключ актуальности кэша: история меняется без изменения BotData"""
+        if view != "history":
+            return self.bot_data.version
+        post_history = self.scheduler.history
+        if post_history is None:
+            return (self.bot_data.version, None)
+        return (self.bot_data.version, post_history.version, post_history.worker_files_version())
+
+    def history_stats(self):
+        version = self.version("history")
+        if self._stats[0] != version:
+            post_history = self.scheduler.history
+            entries = post_history.entries() if post_history is not None else []
+            self._stats = (version, history.channel_stats(entries))
+        return self._stats[1]
+
+    def items(self, view, access_key):
+        if view == "users":
+            return list(self.bot_data.users.keys())
+        if view == "history":
+            stats = self.history_stats()
+            # Сначала каналы с большей долей сбоев, затем с большей задержкой p95
+            return sorted(
+                (cid for cid in stats if cid in self.bot_data.channels),
+                key=lambda cid: (-stats[cid]["failure_rate"], -(history.percentile(stats[cid]["delays"], 0.95) or 0))
+            )
+        channel_ids = list(self.bot_data.channels.keys())
+        if access_key != "all":
+            channel_ids = [cid for cid in channel_ids if cid in access_key]
+        return channel_ids
+
+    # --- блоки ---
+
+    def schedule_rows(self, channel_id, now):
+        """Срабатывания канала на сутки вперед; пересчет только при смене плана или раз в час"""
+        occurrence, planned, compiled = self.scheduler.preview_post(channel_id, now)
+        key = (compiled, planned)
+        cached = self._rows.get(channel_id)
+        if cached is None or cached[0] != key or cached[1] < now + timedelta(hours=23):
+            cached = (key, now + timedelta(hours=24), self.scheduler.calculate_post_times(channel_id))
+            self._rows[channel_id] = cached
+        return cached[2]
+
+    def status_block(self, channel_id, now):
+        channel_data = self.bot_data.channels[channel_id]
+        lines = [
+            f"📺 Канал: {channel_data['name']}",
+            f"📊 Осталось медиа: {queue_summary(channel_data['media_queue'])}",
+        ]
+        try:
+            rows = self.schedule_rows(channel_id, now)
+            tz_label = schedule.timezone_label(self.scheduler.channel_timezone(channel_id))
+        except schedule.ScheduleError as e:
+            lines.append(f"   ⚠️ Ошибка расписания: {e}")
+            return "\n".join(lines) + "\n"
+
+        if not rows:
+            lines.append("   ⚠️ Нет расписания")
+        for i, (label, post_time) in enumerate(rows[:MAX_SCHEDULE_ROWS], 1):
+            time_left = max(post_time - now, timedelta(0))
+            hours, rem = divmod(int(time_left.total_seconds()), 3600)
+            minutes, seconds = divmod(rem, 60)
+            lines.append(f"   {i}. Через {hours:02d}:{minutes:02d}:{seconds:02d} (~{label} {tz_label})")
+        if len(rows) > MAX_SCHEDULE_ROWS:
+            lines.append(f"   … еще {len(rows) - MAX_SCHEDULE_ROWS} за сутки")
+        return "\n".join(lines) + "\n"
+
+    def channel_block(self, channel_id):
+        channel_data = self.bot_data.channels[channel_id]
+        return (
+            f"📺 {channel_data['name']}\n"
+            f"   ID: {channel_id}\n"
+            f"   Очередь: {queue_summary(channel_data['media_queue'])}\n"
+            f"   Время постов: {'; '.join(channel_data['post_times'])}\n"
+            f"   Часовой пояс: {channel_data.get('timezone') or 'из конфига'}\n"
+        )
+
+    def user_block(self, uid):
+        user_data = self.bot_data.users[uid]
+        role_icon = "👑" if user_data['role'] == "owner" else "🛡️" if user_data['role'] == "admin" else "🛠️"
+        role_text = user_data['role']
+        # Добавляем информацию о каналах для модераторов
+        if user_data['role'] == "moderator":
+            role_text += f" ({len(user_data.get('channels', []))} каналов)"
+        return f"{role_icon} {uid}: {role_text}"
+
+    def history_block(self, channel_id):
+        stats = self.history_stats()[channel_id]
+        outcomes = stats["outcomes"]
+        lines = [
+            f"📺 {self.bot_data.channels[channel_id]['name']}",
+            f"   Попыток: {stats['total']}, отправлено {outcomes['sent']}, ошибок {outcomes['failed']}, "
+            f"пустая очередь {outcomes['empty']}, пропущено {outcomes['missed']} (сбоев {stats['failure_rate']:.1%})",
+        ]
+        delays = stats["delays"]
+        if delays:
+            line = (
+                f"   Задержка p50/p95: {format_seconds(history.percentile(delays, 0.5))} / "
+                f"{format_seconds(history.percentile(delays, 0.95))}"
+            )
+            if stats["upload"]:
+                line += f", выгрузка p95 {history.percentile(stats['upload'], 0.95):.1f}s"
+            lines.append(line)
+            hours = sorted(
+                ((hour, history.percentile(values, 0.95)) for hour, values in stats["by_hour"].items() if len(values) >= 2),
+                key=lambda item: -item[1]
+            )[:SLOW_HOURS]
+            if len(stats["by_hour"]) > 1 and hours:
+                lines.append("   Медленные часы: " + ", ".join(f"{hour}ч p95 {format_seconds(p95)}" for hour, p95 in hours))
+        return "\n".join(lines) + "\n"
+
+    def block(self, view, item_id, now):
+        if view == "status":
+            # Статус содержит обратный отсчет, поэтому кэшируются только строки расписания
+            return self.status_block(item_id, now)
+        version = self.version(view)
+        cached = self._blocks.get((view, item_id))
+        if cached is None or cached[0] != version:
+            if view == "history":
+                text = self.history_block(item_id)
+            else:
+                text = self.channel_block(item_id) if view == "channels" else self.user_block(item_id)
+            cached = self._blocks[(view, item_id)] = (version, text)
+        return cached[1]
+
+    # --- страницы ---
+
+    def pages(self, view, user_id, now):
+        key = (view, self.access_key(view, user_id))
+        version = self.version(view)
+        cached = self._pages.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        pages, current, size = [], [], 0
+        for item_id in self.items(view, key[1]):
+            length = len(self.block(view, item_id, now)) + 1
+            if current and size + length > self.page_limit:
+                pages.append(current)
+                current, size = [], 0
+            current.append(item_id)
+            size += length
+        if current:
+            pages.append(current)
+
+        if view in ("status", "channels"):
+            # Кэш строк расписания удаленных каналов больше не нужен
+            for channel_id in set(self._rows) - set(self.bot_data.channels):
+                del self._rows[channel_id]
+        self._pages[key] = (version, pages)
+        return pages
+
+    def render(self, view, user_id, page=0):
+        """Текст страницы и инлайн-клавиатура (None, если страница одна)"""
+        with self._lock:
+            now = self.scheduler.clock()
+            pages = self.pages(view, user_id, now)
+            if not pages:
+                return EMPTY[view], None
+            page = max(0, min(page, len(pages) - 1))
+            blocks = [self.block(view, item_id, now) for item_id in pages[page] if self._exists(view, item_id)]
+
+        title = TITLES[view] + (f" (стр. {page + 1}/{len(pages)})" if len(pages) > 1 else "") + ":"
+        separator = "\n" if view == "users" else "\n\n"
+        text = title + "\n\n" + separator.join(block.rstrip("\n") for block in blocks)
+        return text, self.keyboard(view, page, len(pages))
+
+    def _exists(self, view, item_id):
+        return item_id in (self.bot_data.users if view == "users" else self.bot_data.channels)
+
+    @staticmethod
+    def keyboard(view, page, total):
+        if total <= 1:
+            return None
+        keyboard = types.InlineKeyboardMarkup()
+        buttons = []
+        if page > 0:
+            buttons.append(types.InlineKeyboardButton("◀️", callback_data=f"{CALLBACK_PREFIX}:{view}:{page - 1}"))
+        buttons.append(types.InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"{CALLBACK_PREFIX}:{view}:{page}"))
+        if page < total - 1:
+            buttons.append(types.InlineKeyboardButton("▶️", callback_data=f"{CALLBACK_PREFIX}:{view}:{page + 1}"))
+        keyboard.row(*buttons)
+        return keyboard
+
+
+def parse_callback(data):
+    """'page:status:2' -> ('status', 2) или None"""
+    parts = (data or "").split(":")
+    if len(parts) != 3 or parts[0] != CALLBACK_PREFIX or parts[1] not in TITLES or not parts[2].isdigit():
+        return None
+    return parts[1], int(parts[2])